@@ -0,0 +1,318 @@
+"""
+Module 5: Giai ma am thanh (Decoder Backends)
+Lop truu tuong cho cac bo giai ma: uu tien giai ma trong tien trinh va doc theo khoi,
+chi dung ffmpeg/pydub khi khong con lua chon nao khac.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import importlib.util
+import numpy as np
+
+
+DEFAULT_BLOCK_FRAMES = 65536
+
+
+def pcm_to_float(samples, dtype=np.float64):
+    """Chuẩn hóa mẫu PCM về [-1, 1] theo kiểu dữ liệu gốc."""
+    if samples.dtype == np.int16:
+        return samples.astype(dtype) * (1.0 / 32768.0)
+    elif samples.dtype == np.int32:
+        return samples.astype(dtype) * (1.0 / 2147483648.0)
+    elif samples.dtype == np.int8:
+        return samples.astype(dtype) * (1.0 / 128.0)
+    elif samples.dtype == np.uint8:
+        return (samples.astype(dtype) - 128) * (1.0 / 128.0)
+    elif np.issubdtype(samples.dtype, np.floating):
+        return samples.astype(dtype, copy=False)
+    else:
+        raise ValueError(f"Kieu mau khong ho tro: {samples.dtype}")
+
+
+class DecodedAudio:
+    """Một file đã mở: thông tin định dạng và các khối mẫu (frames, channels) trong [-1, 1]."""
+    
+    def __init__(self, backend, sample_rate, channels, blocks):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._blocks = blocks
+    
+    def blocks(self):
+        return self._blocks
+    
+    def read_all(self):
+        blocks = list(self._blocks)
+        if not blocks:
+            return np.zeros((0, self.channels))
+        return np.concatenate(blocks)
+
+
+class AudioDecoder:
+    """Lớp cơ sở cho một bộ giải mã."""
+    
+    name = 'base'
+    extensions = ()
+    
+    def is_available(self):
+        return True
+    
+    def can_decode(self, file_ext):
+        return file_ext in self.extensions and self.is_available()
+    
+    def open(self, file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+        """Mở file và trả về DecodedAudio; lỗi định dạng phải được báo ngay tại đây."""
+        raise NotImplementedError
+
+
+class WavDecoder(AudioDecoder):
+    """Đọc WAV bằng scipy, ánh xạ bộ nhớ (mmap) để chỉ đọc từng khối khi cần."""
+    
+    name = 'scipy-wav'
+    extensions = ('.wav',)
+    
+    def is_available(self):
+        return importlib.util.find_spec('scipy') is not None
+    
+    def open(self, file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+        from scipy.io import wavfile
+        
+        try:
+            sample_rate, samples = wavfile.read(file_path, mmap=True)
+        except ValueError:
+            # Một số định dạng (vd. 24-bit) không hỗ trợ mmap
+            sample_rate, samples = wavfile.read(file_path)
+        
+        if samples.ndim == 1:
+            samples = samples.reshape(-1, 1)
+        
+        def blocks():
+            for start in range(0, len(samples), block_frames):
+                yield pcm_to_float(samples[start:start + block_frames], dtype)
+        
+        return DecodedAudio(self.name, sample_rate, samples.shape[1], blocks())
+
+
+class SoundfileDecoder(AudioDecoder):
+    """Giải mã trong tiến trình bằng libsndfile (FLAC/OGG/WAV, MP3 nếu bản libsndfile hỗ trợ)."""
+    
+    name = 'soundfile'
+    extensions = ('.wav', '.flac', '.ogg', '.mp3')
+    
+    def is_available(self):
+        return importlib.util.find_spec('soundfile') is not None
+    
+    def can_decode(self, file_ext):
+        if not super().can_decode(file_ext):
+            return False
+        if file_ext == '.mp3':
+            import soundfile
+            return 'MP3' in soundfile.available_formats()
+        return True
+    
+    def open(self, file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+        import soundfile
+        
+        sound_file = soundfile.SoundFile(file_path)
+        dtype_name = np.dtype(dtype).name
+        
+        def blocks():
+            with sound_file:
+                while True:
+                    block = sound_file.read(block_frames, dtype=dtype_name, always_2d=True)
+                    if len(block) == 0:
+                        break
+                    yield block
+        
+        return DecodedAudio(self.name, sound_file.samplerate, sound_file.channels, blocks())
+
+
+class FFmpegPipeDecoder(AudioDecoder):
+    """
+    Giải mã qua ống (pipe) ffmpeg: đọc PCM float32 trực tiếp từ stdout theo từng khối.
+    
+    Không tạo file WAV tạm và không dựng mảng Python như pydub; thông tin định dạng
+    lấy từ header WAV mà ffmpeg ghi ra pipe nên không cần gọi thêm ffprobe.
+    """
+    
+    name = 'ffmpeg-pipe'
+    extensions = ('.mp3', '.ogg', '.flac', '.m4a', '.aac', '.wav')
+    
+    def __init__(self):
+        self._binary = None
+    
+    def is_available(self):
+        if self._binary is None:
+            self._binary = shutil.which('ffmpeg') or ''
+        return bool(self._binary)
+    
+    def _read_exact(self, stream, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if not chunk:
+                break
+            data.extend(chunk)
+        return data
+    
+    def _read_header(self, stream):
+        """Đọc header WAV do ffmpeg ghi; trả về (sample_rate, channels)."""
+        riff = self._read_exact(stream, 12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise ValueError("ffmpeg khong tra ve du lieu WAV hop le")
+        
+        sample_rate, channels = None, None
+        while True:
+            chunk_header = self._read_exact(stream, 8)
+            if len(chunk_header) < 8:
+                raise ValueError("Header WAV tu ffmpeg bi cat ngang")
+            chunk_id, chunk_size = chunk_header[:4], struct.unpack('<I', chunk_header[4:])[0]
+            
+            if chunk_id == b'data':
+                break
+            
+            body = self._read_exact(stream, chunk_size + (chunk_size & 1))
+            if chunk_id == b'fmt ':
+                channels, sample_rate = struct.unpack('<HI', body[2:8])
+        
+        if sample_rate is None:
+            raise ValueError("Header WAV tu ffmpeg thieu chunk fmt")
+        return sample_rate, channels
+    
+    def open(self, file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+        process = subprocess.Popen(
+            [self._binary, '-v', 'error', '-nostdin', '-i', file_path,
+             '-f', 'wav', '-acodec', 'pcm_f32le', '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        
+        try:
+            sample_rate, channels = self._read_header(process.stdout)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+        
+        block_bytes = block_frames * channels * 4
+        
+        def blocks():
+            completed = False
+            try:
+                while True:
+                    data = self._read_exact(process.stdout, block_bytes)
+                    usable = len(data) - len(data) % (channels * 4)
+                    if usable == 0:
+                        break
+                    block = np.frombuffer(data, dtype='<f4', count=usable // 4)
+                    yield block.reshape(-1, channels).astype(dtype, copy=False)
+                completed = True
+            finally:
+                process.stdout.close()
+                if not completed:
+                    # Người dùng dừng đọc giữa chừng
+                    process.kill()
+                process.wait()
+            
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg loi khi giai ma {file_path} (ma {process.returncode})")
+        
+        return DecodedAudio(self.name, sample_rate, channels, blocks())
+
+
+class PydubDecoder(AudioDecoder):
+    """Phương án cuối: pydub (gọi ffmpeg và giải mã toàn bộ file vào bộ nhớ)."""
+    
+    name = 'pydub'
+    extensions = ('.mp3', '.ogg', '.flac', '.m4a', '.aac')
+    
+    def is_available(self):
+        return importlib.util.find_spec('pydub') is not None
+    
+    def open(self, file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+        from pydub import AudioSegment
+        
+        audio = AudioSegment.from_file(file_path)
+        sample_types = {1: np.int8, 2: np.int16, 4: np.int32}
+        
+        if audio.sample_width in sample_types:
+            # Đọc thẳng trên bộ đệm raw_data, không qua array của Python
+            samples = np.frombuffer(audio.raw_data, dtype=sample_types[audio.sample_width])
+            samples = samples.reshape(-1, audio.channels)
+        else:
+            samples = np.array(audio.get_array_of_samples()).reshape(-1, audio.channels)
+            peak = np.max(np.abs(samples)) if len(samples) else 0
+            samples = samples.astype(dtype) / (peak if peak > 0 else 1)
+        
+        def blocks():
+            for start in range(0, len(samples), block_frames):
+                yield pcm_to_float(samples[start:start + block_frames], dtype)
+        
+        return DecodedAudio(self.name, audio.frame_rate, audio.channels, blocks())
+
+
+# Thứ tự ưu tiên: giải mã trong tiến trình trước, tiến trình ngoài sau cùng
+_DECODERS = [WavDecoder(), SoundfileDecoder(), FFmpegPipeDecoder(), PydubDecoder()]
+
+
+def register_decoder(decoder, first=True):
+    """Đăng ký bộ giải mã mới (mặc định ưu tiên cao nhất)."""
+    if first:
+        _DECODERS.insert(0, decoder)
+    else:
+        _DECODERS.append(decoder)
+
+
+def get_decoders(file_path):
+    """Danh sách bộ giải mã dùng được cho file, theo thứ tự ưu tiên."""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    return [decoder for decoder in _DECODERS if decoder.can_decode(file_ext)]
+
+
+def supported_extensions():
+    """Các đuôi file có ít nhất một bộ giải mã đã đăng ký."""
+    return sorted({ext for decoder in _DECODERS for ext in decoder.extensions})
+
+
+def describe_backends():
+    """Trạng thái các bộ giải mã: [(tên, có dùng được không, các đuôi file)]."""
+    return [(decoder.name, decoder.is_available(), decoder.extensions) for decoder in _DECODERS]
+
+
+def open_audio(file_path, block_frames=DEFAULT_BLOCK_FRAMES, dtype=np.float64):
+    """
+    Mở file bằng bộ giải mã đầu tiên thành công.
+    
+    Returns:
+        DecodedAudio: backend, sample_rate, channels và generator các khối mẫu
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext not in supported_extensions():
+        raise ValueError(f"Dinh dang file khong ho tro: {file_ext}")
+    
+    decoders = get_decoders(file_path)
+    if not decoders:
+        raise ImportError(
+            f"Khong co bo giai ma cho {file_ext}: pip install soundfile, "
+            "cai ffmpeg hoac pip install pydub"
+        )
+    
+    # Kiểm tra trước: ffmpeg/pydub báo lỗi riêng của chúng khi file không tồn tại,
+    # che mất nguyên nhân thật nếu chỉ ném lại lỗi của bộ giải mã cuối cùng
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Khong tim thay file: {file_path}")
+    if not os.access(file_path, os.R_OK):
+        raise PermissionError(f"Khong co quyen doc file: {file_path}")
+    
+    last_error = None
+    for decoder in decoders:
+        try:
+            return decoder.open(file_path, block_frames, dtype)
+        except (FileNotFoundError, PermissionError, IsADirectoryError):
+            # Lỗi của file chứ không phải của bộ giải mã: thử bộ khác cũng vô ích
+            raise
+        except Exception as e:
+            last_error = e
+    
+    raise last_error
@@ -4,64 +4,207 @@ Chua cac thuat toan STE, ZCR va cac ham xu ly am thanh co ban.
 """
 
 import numpy as np
-from scipy.io import wavfile
 import os
+import json
+import hashlib
 
-try:
-    from pydub import AudioSegment
-    PYDUB_AVAILABLE = True
-except ImportError:
-    PYDUB_AVAILABLE = False
+from audio_decoders import open_audio
+import profiling
 
 
-def load_audio(file_path):
+# Độ chính xác của toàn bộ luồng xử lý (đọc file, phân khung, STE/ZCR).
+# 'float32' dùng một nửa bộ nhớ và nhanh gấp ~2 lần; so với 'float64':
+#   - STE: sai số tương đối < 1e-5 (đo trên testmusic: tối đa ~4e-6)
+#   - ZCR: giống hệt (chỉ phụ thuộc dấu mẫu, mẫu 16-bit biểu diễn chính xác trong float32)
+PRECISION_DTYPES = {'float32': np.float32, 'float64': np.float64}
+DEFAULT_PRECISION = 'float64'
 
-    file_ext = os.path.splitext(file_path)[1].lower()
+
+def set_precision(precision):
+    """Đặt độ chính xác mặc định ('float32' hoặc 'float64')."""
+    global DEFAULT_PRECISION
+    get_dtype(precision)
+    DEFAULT_PRECISION = precision
+
+
+def get_dtype(precision=None):
+    """Kiểu numpy ứng với độ chính xác (None = mặc định của module)."""
+    precision = precision or DEFAULT_PRECISION
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(f"Do chinh xac khong ho tro: {precision}")
+    return PRECISION_DTYPES[precision]
+
+
+# Tần số lấy mẫu chuẩn khi bật chuẩn hóa tần số (target_rate) trước khi trích đặc trưng
+CANONICAL_SAMPLE_RATE = 16000
+
+# Cách xử lý các kênh khi trích đặc trưng:
+#   'mono'        - gộp các kênh thành một (mặc định)
+#   'per_channel' - STE/ZCR trên từng kênh, trực tiếp trên bộ đệm xen kẽ (không gộp kênh)
+#   'mid_side'    - kênh giữa (L+R)/2 và kênh bên (L-R)/2
+CHANNEL_MODES = ('mono', 'per_channel', 'mid_side')
+
+
+class StreamingResampler:
+    """
+    Bộ đổi tần số lấy mẫu đa pha (polyphase) xử lý theo từng khối.
     
-    if file_ext == '.wav':
-        sample_rate, audio_data = wavfile.read(file_path)
+    Dùng cùng bộ lọc FIR (cửa sổ Kaiser) và cách bù trễ như scipy.signal.resample_poly
+    nhưng giữ trạng thái giữa các khối, nên có thể nối vào luồng đọc file mà không
+    cần giữ toàn bộ tín hiệu gốc trong bộ nhớ.
+    """
+    
+    def __init__(self, orig_rate, target_rate, dtype=np.float64):
+        from math import gcd
+        from scipy.signal import firwin
+        
+        divisor = gcd(int(orig_rate), int(target_rate))
+        self.up = int(target_rate) // divisor
+        self.down = int(orig_rate) // divisor
         
-        if len(audio_data.shape) > 1:
-            audio_data = np.mean(audio_data, axis=1)
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        taps = firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * self.up
         
-        if audio_data.dtype == np.int16:
-            audio_data = audio_data.astype(np.float64) / 32768.0
-        elif audio_data.dtype == np.int32:
-            audio_data = audio_data.astype(np.float64) / 2147483648.0
-        elif audio_data.dtype == np.uint8:
-            audio_data = (audio_data.astype(np.float64) - 128) / 128.0
-            
-    elif file_ext in ['.mp3', '.ogg', '.flac', '.m4a', '.aac']:
-        if not PYDUB_AVAILABLE:
-            raise ImportError("Can cai dat pydub de doc file MP3: pip install pydub")
+        # Thêm số 0 phía trước để độ trễ của bộ lọc chia hết cho down
+        pad = (-half_len) % self.down
+        self.taps = np.concatenate([np.zeros(pad), taps]).astype(dtype)
+        self.offset = (half_len + pad) // self.down
+        self.dtype = dtype
+        
+        self._buffer = np.zeros(0, dtype=dtype)
+        self._start = 0      # chỉ số (toàn cục) của mẫu đầu tiên trong _buffer, là bội của down
+        self._num_in = 0
+        self._num_out = 0
+    
+    def process(self, block):
+        """Đưa thêm một khối mẫu vào; trả về các mẫu đầu ra đã xác định đầy đủ."""
+        self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=self.dtype)])
+        self._num_in += len(block)
         
-        audio = AudioSegment.from_file(file_path)
+        # Mẫu ra k cần các mẫu vào tới vị trí (k + offset) * down trên lưới đã tăng mẫu
+        ready = ((self._num_in - 1) * self.up) // self.down - self.offset + 1
+        return self._emit(ready, final=False)
+    
+    def flush(self):
+        """Kết thúc luồng: trả về các mẫu còn lại (coi phần sau cuối tín hiệu là 0)."""
+        total = -(-self._num_in * self.up // self.down)
+        return self._emit(total, final=True)
+    
+    def _emit(self, end, final):
+        from scipy.signal import upfirdn
         
-        if audio.channels > 1:
-            audio = audio.set_channels(1)
+        if end <= self._num_out:
+            return np.zeros(0, dtype=self.dtype)
         
-        sample_rate = audio.frame_rate
+        signal = self._buffer
+        if final:
+            signal = np.concatenate([signal, np.zeros(len(self.taps) // self.up + 2, dtype=self.dtype)])
         
-        samples = np.array(audio.get_array_of_samples())
+        filtered = upfirdn(self.taps, signal, self.up, self.down)
+        base = self._start * self.up // self.down
+        output = filtered[self._num_out + self.offset - base:end + self.offset - base]
+        self._num_out = end
         
-        # Chuan hoa ve [-1, 1] dua tren sample width
-        if audio.sample_width == 1:  # 8-bit
-            audio_data = (samples.astype(np.float64) - 128) / 128.0
-        elif audio.sample_width == 2:  # 16-bit
-            audio_data = samples.astype(np.float64) / 32768.0
-        elif audio.sample_width == 4:  # 32-bit
-            audio_data = samples.astype(np.float64) / 2147483648.0
-        else:
-            audio_data = samples.astype(np.float64) / np.max(np.abs(samples))
-    else:
-        raise ValueError(f"Dinh dang file khong ho tro: {file_ext}")
+        # Bỏ các mẫu vào không còn ảnh hưởng tới mẫu ra tiếp theo
+        needed = ((self._num_out + self.offset) * self.down - (len(self.taps) - 1)) // self.up
+        new_start = max(self._start, (needed // self.down) * self.down)
+        self._buffer = self._buffer[new_start - self._start:]
+        self._start = new_start
+        
+        return output.astype(self.dtype, copy=False)
+
+
+def _mid_side(block):
+    """Khối (mẫu, kênh) -> (mẫu, 2) gồm kênh giữa và kênh bên; file mono có kênh bên bằng 0."""
+    result = np.zeros((len(block), 2), dtype=block.dtype)
+    result[:, 0] = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+    if block.shape[1] > 1:
+        result[:, 1] = (block[:, 0] - block[:, 1]) / 2
+    return result
+
+
+def load_audio_info(file_path, precision=None, target_rate=None, channel_mode='mono'):
+    """
+    Đọc file âm thanh thành tín hiệu trong [-1, 1] kèm thông tin giải mã.
+    
+    Việc giải mã được giao cho audio_decoders (WAV/soundfile trong tiến trình,
+    ffmpeg/pydub làm phương án dự phòng); các kênh được gộp và (nếu cần) đổi
+    tần số lấy mẫu ngay theo từng khối khi đọc.
+    
+    Args:
+        file_path (str): Đường dẫn file
+        precision (str): 'float32' hoặc 'float64' (None = mặc định của module)
+        target_rate (int): Tần số lấy mẫu đích, vd. CANONICAL_SAMPLE_RATE (None = giữ nguyên)
+        channel_mode (str): Một trong CHANNEL_MODES; khác 'mono' thì audio_data có dạng
+            (mẫu, kênh) và các kênh không bị gộp
+        
+    Returns:
+        dict: audio_data, sample_rate (sau khi đổi), original_sample_rate, channels, decoder
+    """
+    if channel_mode not in CHANNEL_MODES:
+        raise ValueError(f"Chế độ kênh không hỗ trợ: {channel_mode}")
+    
+    dtype = get_dtype(precision)
+    decoded = open_audio(file_path, dtype=dtype)
+    
+    num_channels = 1 if channel_mode == 'mono' else 2 if channel_mode == 'mid_side' else decoded.channels
+    resamplers = []
+    if target_rate and int(target_rate) != decoded.sample_rate:
+        # Mỗi kênh một bộ đổi tần số vì bộ lọc giữ trạng thái riêng
+        resamplers = [StreamingResampler(decoded.sample_rate, target_rate, dtype)
+                      for _ in range(num_channels)]
+    
+    blocks = []
+    for block in decoded.blocks():
+        if channel_mode == 'mid_side':
+            block = _mid_side(block)
+        elif channel_mode == 'mono':
+            block = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        
+        if resamplers and block.ndim == 1:
+            block = resamplers[0].process(block)
+        elif resamplers:
+            block = np.column_stack([resampler.process(block[:, channel])
+                                     for channel, resampler in enumerate(resamplers)])
+        blocks.append(block)
+    
+    if resamplers:
+        tails = [resampler.flush() for resampler in resamplers]
+        blocks.append(tails[0] if channel_mode == 'mono' else np.column_stack(tails))
+    
+    empty_shape = (0,) if channel_mode == 'mono' else (0, num_channels)
+    return {
+        'audio_data': np.concatenate(blocks) if blocks else np.zeros(empty_shape, dtype=dtype),
+        'sample_rate': int(target_rate) if resamplers else decoded.sample_rate,
+        'original_sample_rate': decoded.sample_rate,
+        'channels': decoded.channels,
+        'decoder': decoded.backend
+    }
+
+
+def load_audio(file_path, return_backend=False, precision=None, target_rate=None):
+    """
+    Đọc file âm thanh thành tín hiệu mono trong [-1, 1].
+    
+    Returns:
+        tuple: (sample_rate, audio_data) hoặc (sample_rate, audio_data, backend)
+    """
+    info = load_audio_info(file_path, precision, target_rate)
     
-    return sample_rate, audio_data
+    if return_backend:
+        return info['sample_rate'], info['audio_data'], info['decoder']
+    return info['sample_rate'], info['audio_data']
 
 
 def framing(audio_data, sample_rate, frame_duration_ms=25, overlap_ratio=0.5):
-
+    """
+    Chia tín hiệu thành các khung chồng lấp.
     
+    Kết quả là một view (chỉ đọc) trên audio_data, không cấp phát bộ nhớ mới
+    và giữ nguyên kiểu dữ liệu (float32/float64) của tín hiệu. Với tín hiệu
+    nhiều kênh dạng (mẫu, kênh), kết quả có dạng (khung, kênh, mẫu trong khung).
+    """
     frame_size = int(sample_rate * frame_duration_ms / 1000)
     
     hop_size = int(frame_size * (1 - overlap_ratio))
@@ -72,71 +215,44 @@ def framing(audio_data, sample_rate, frame_duration_ms=25, overlap_ratio=0.5):
     num_frames = 1 + (len(audio_data) - frame_size) // hop_size
     
     if num_frames <= 0:
-        frame = np.zeros(frame_size)
+        frame = np.zeros((frame_size,) + audio_data.shape[1:], dtype=audio_data.dtype)
         frame[:len(audio_data)] = audio_data
-        return np.array([frame])
-    
-    frames = np.zeros((num_frames, frame_size))
+        return np.moveaxis(frame, 0, -1)[np.newaxis]
     
-    for i in range(num_frames):
-        start = i * hop_size
-        end = start + frame_size
-        frames[i] = audio_data[start:end]
-    
-    return frames
+    # Khung thứ i bắt đầu tại i * hop_size: cửa sổ trượt rồi lấy bước hop_size
+    windows = np.lib.stride_tricks.sliding_window_view(audio_data, frame_size, axis=0)
+    return windows[::hop_size]
 
 
 def calculate_ste(frames):
 
-    num_frames = frames.shape[0]
-    ste_values = np.zeros(num_frames)
-    
-    for i in range(num_frames):
-        frame = frames[i]
-        # Tính tổng bình phương các mẫu trong khung
-        energy = 0.0
-        for sample in frame:
-            energy += sample * sample
-        ste_values[i] = energy
-    
-    return ste_values
+    # Tổng bình phương các mẫu trong từng khung
+    return np.einsum('ij,ij->i', frames, frames)
 
 
 def calculate_ste_normalized(frames):
 
-    num_frames = frames.shape[0]
-    frame_size = frames.shape[1]
-    ste_values = np.zeros(num_frames)
-    
-    for i in range(num_frames):
-        frame = frames[i]
-        energy = 0.0
-        for sample in frame:
-            energy += sample * sample
-        ste_values[i] = energy / frame_size
-    
-    return ste_values
+    # Trục cuối là các mẫu trong khung (khung nhiều kênh cho kết quả (khung, kênh))
+    frame_size = frames.shape[-1]
+    energy = np.einsum('...j,...j->...', frames, frames)
+    return energy / frames.dtype.type(frame_size)
 
 
 def calculate_zcr(frames):
 
-    num_frames = frames.shape[0]
-    zcr_values = np.zeros(num_frames)
+    frame_size = frames.shape[-1]
     
-    for i in range(num_frames):
-        frame = frames[i]
-        frame_size = len(frame)
-        zero_crossings = 0
-        
-        for j in range(1, frame_size):
-            # Đếm số lần tín hiệu đổi dấu
-            if (frame[j] >= 0 and frame[j-1] < 0) or (frame[j] < 0 and frame[j-1] >= 0):
-                zero_crossings += 1
-        
-        # Chuẩn hóa bằng độ dài khung
-        zcr_values[i] = zero_crossings / (frame_size - 1)
+    # Đếm số lần tín hiệu đổi dấu: (x[j] < 0) khác (x[j-1] < 0).
+    # Xử lý theo từng nhóm khung để mảng bool tạm không lớn theo độ dài bài hát
+    zero_crossings = np.empty(frames.shape[:-1], dtype=np.int64)
+    for start in range(0, len(frames), 4096):
+        negative = frames[start:start + 4096] < 0
+        zero_crossings[start:start + 4096] = np.count_nonzero(
+            negative[..., 1:] != negative[..., :-1], axis=-1
+        )
     
-    return zcr_values
+    # Chuẩn hóa bằng độ dài khung
+    return (zero_crossings / (frame_size - 1)).astype(frames.dtype)
 
 
 def sign_function(x):
@@ -147,14 +263,113 @@ def sign_function(x):
         return -1
 
 
-def extract_features(audio_data, sample_rate, frame_duration_ms=25, overlap_ratio=0.5):
+# Ngưỡng phát hiện đoạn có âm thanh (VAD) trên STE chuẩn hóa, tính theo dB
+VAD_MODES = ('off', 'trim', 'mask')
+VAD_ENERGY_FLOOR_DB = -60.0
+VAD_RELATIVE_THRESHOLD = 0.25
+VAD_ZCR_THRESHOLD = 0.25
+VAD_HANGOVER_MS = 200
+
 
+def detect_voice_activity(ste_values, zcr_values, hangover_frames=0):
+    """
+    Đánh dấu các khung có âm thanh từ STE (chuẩn hóa) và ZCR đã tính sẵn.
+    
+    Ngưỡng năng lượng nằm giữa mức nền (phân vị 10) và mức đỉnh (phân vị 99)
+    theo thang dB, không thấp hơn VAD_ENERGY_FLOOR_DB. Khung năng lượng yếu
+    nhưng ZCR cao (phụ âm xát như "s", "x") vẫn được giữ nếu trên mức sàn.
+    Mỗi khung có âm thanh kéo theo hangover_frames khung hai bên để không cắt
+    mất phần đầu/cuối của âm tiết.
+    
+    Returns:
+        np.array: Mảng bool, True tại các khung có âm thanh
+    """
+    if len(ste_values) == 0:
+        return np.zeros(0, dtype=bool)
+    
+    energy_db = 10 * np.log10(np.maximum(ste_values, 1e-12))
+    noise_db, peak_db = np.percentile(energy_db, [10, 99])
+    threshold_db = max(VAD_ENERGY_FLOOR_DB,
+                       noise_db + VAD_RELATIVE_THRESHOLD * (peak_db - noise_db))
+    
+    active = (energy_db >= threshold_db) | (
+        (energy_db >= VAD_ENERGY_FLOOR_DB) & (zcr_values >= VAD_ZCR_THRESHOLD)
+    )
+    
+    if hangover_frames > 0 and active.any():
+        window = np.ones(2 * hangover_frames + 1)
+        active = np.convolve(active, window, mode='same') > 0
+    
+    return active
+
+
+def _channel_names(channel_mode, num_channels):
+    if channel_mode == 'mid_side':
+        return ['mid', 'side']
+    if num_channels == 2:
+        return ['left', 'right']
+    return [f'ch{channel}' for channel in range(num_channels)]
+
+
+def extract_features(audio_data, sample_rate, frame_duration_ms=25, overlap_ratio=0.5, vad='off',
+                     channel_mode='mono'):
+    """
+    Trích xuất chuỗi STE/ZCR và các thống kê tổng hợp.
+    
+    vad='trim' bỏ các khung im lặng ở đầu và cuối; vad='mask' bỏ mọi khung im
+    lặng. Chuỗi STE/ZCR trả về và các thống kê chỉ tính trên phần được giữ lại;
+    duration vẫn là độ dài của cả file.
+    
+    Với audio_data nhiều kênh (mẫu, kênh) từ load_audio_info(channel_mode=...),
+    STE/ZCR được tính trên từng kênh; 'ste'/'zcr' là chuỗi chính (kênh giữa với
+    'mid_side', trung bình các kênh với 'per_channel') và 'channels' chứa thống
+    kê của từng kênh.
+    """
+    if vad not in VAD_MODES:
+        raise ValueError(f"Chế độ VAD không hỗ trợ: {vad}")
+    if channel_mode not in CHANNEL_MODES:
+        raise ValueError(f"Chế độ kênh không hỗ trợ: {channel_mode}")
+    
     # Phân khung
-    frames = framing(audio_data, sample_rate, frame_duration_ms, overlap_ratio)
+    with profiling.stage('audio.framing'):
+        frames = framing(audio_data, sample_rate, frame_duration_ms, overlap_ratio)
+    
+    # Tính STE và ZCR (với nhiều kênh: mảng (khung, kênh))
+    with profiling.stage('audio.ste'):
+        ste_values = calculate_ste_normalized(frames)
+    with profiling.stage('audio.zcr'):
+        zcr_values = calculate_zcr(frames)
+    num_frames = len(frames)
+    profiling.count('audio.frames', num_frames)
     
-    # Tính STE và ZCR
-    ste_values = calculate_ste_normalized(frames)
-    zcr_values = calculate_zcr(frames)
+    ste_channels = zcr_channels = None
+    if ste_values.ndim == 2:
+        ste_channels, zcr_channels = ste_values, zcr_values
+        if channel_mode == 'mid_side':
+            ste_values, zcr_values = ste_channels[:, 0], zcr_channels[:, 0]
+        else:
+            ste_values, zcr_values = ste_channels.mean(axis=1), zcr_channels.mean(axis=1)
+    
+    if vad != 'off':
+        hop_ms = max(frame_duration_ms * (1 - overlap_ratio), 1000 / sample_rate)
+        with profiling.stage('audio.vad'):
+            active = detect_voice_activity(
+                ste_values, zcr_values, int(np.ceil(VAD_HANGOVER_MS / hop_ms))
+            )
+        
+        # File im lặng hoàn toàn: giữ nguyên để vẫn có thống kê
+        if active.any():
+            if vad == 'trim':
+                first = np.argmax(active)
+                last = len(active) - np.argmax(active[::-1])
+                keep = slice(first, last)
+            else:
+                keep = active
+            ste_values = ste_values[keep]
+            zcr_values = zcr_values[keep]
+            if ste_channels is not None:
+                ste_channels = ste_channels[keep]
+                zcr_channels = zcr_channels[keep]
     
     # Tạo vector đặc trưng tổng hợp
     features = {
@@ -168,16 +383,31 @@ def extract_features(audio_data, sample_rate, frame_duration_ms=25, overlap_rati
         'zcr_std': float(np.std(zcr_values)),
         'zcr_max': float(np.max(zcr_values)),
         'zcr_min': float(np.min(zcr_values)),
-        'num_frames': len(frames),
+        'num_frames': num_frames,
+        'num_active_frames': len(ste_values),
+        'vad': vad,
         'duration': len(audio_data) / sample_rate
     }
     
+    if ste_channels is not None:
+        features['channel_mode'] = channel_mode
+        features['channels'] = [
+            {
+                'name': name,
+                'ste_mean': float(np.mean(ste_channels[:, channel])),
+                'ste_std': float(np.std(ste_channels[:, channel])),
+                'zcr_mean': float(np.mean(zcr_channels[:, channel])),
+                'zcr_std': float(np.std(zcr_channels[:, channel]))
+            }
+            for channel, name in enumerate(_channel_names(channel_mode, ste_channels.shape[1]))
+        ]
+    
     return features
 
 
 def get_feature_vector(features):
 
-    return np.array([
+    vector = [
         features['ste_mean'],
         features['ste_std'],
         features['ste_max'],
@@ -186,7 +416,78 @@ def get_feature_vector(features):
         features['zcr_std'],
         features['zcr_max'],
         features['zcr_min']
-    ])
+    ]
+    
+    # Chế độ nhiều kênh: thêm thống kê của hai kênh đầu (file mono lặp lại kênh duy
+    # nhất) để mọi bản ghi cùng phiên bản đặc trưng có vector cùng độ dài
+    channels = features.get('channels')
+    if channels:
+        for channel in (channels + channels)[:2]:
+            vector.extend([channel['ste_mean'], channel['ste_std'],
+                           channel['zcr_mean'], channel['zcr_std']])
+    
+    return np.array(vector)
+
+
+def build_envelope_pyramid(audio_data, base_bucket=64, factor=4, min_buckets=512):
+    """
+    Tạo kim tự tháp bao min/max của dạng sóng để vẽ ở độ phân giải màn hình.
+    
+    Mức 0 gom mỗi base_bucket mẫu thành một cặp (min, max); mỗi mức sau gom
+    factor ô của mức trước, dừng trước khi số ô ít hơn min_buckets.
+    
+    Returns:
+        list: Các mức [{'bucket': số mẫu mỗi ô, 'min': np.array, 'max': np.array}]
+    """
+    if len(audio_data) == 0:
+        return []
+    
+    starts = np.arange(0, len(audio_data), base_bucket)
+    mins = np.minimum.reduceat(audio_data, starts).astype(np.float32)
+    maxs = np.maximum.reduceat(audio_data, starts).astype(np.float32)
+    if mins.ndim == 2:
+        # Tín hiệu nhiều kênh: bao chung của mọi kênh
+        mins, maxs = mins.min(axis=1), maxs.max(axis=1)
+    levels = [{'bucket': base_bucket, 'min': mins, 'max': maxs}]
+    
+    while len(mins) >= min_buckets * factor:
+        starts = np.arange(0, len(mins), factor)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+        levels.append({'bucket': levels[-1]['bucket'] * factor, 'min': mins, 'max': maxs})
+    
+    return levels
+
+
+class AudioHandle:
+    """
+    Tham chiếu nhẹ tới tín hiệu đã phân tích, thay cho việc giữ cả mảng audio_data.
+    
+    Chỉ giữ đường dẫn, thông số giải mã và kim tự tháp bao min/max (vài trăm KB với
+    bài dài) đủ để vẽ dạng sóng; load() giải mã lại file khi thật sự cần mẫu gốc.
+    """
+    
+    def __init__(self, file_path, sample_rate, num_samples, envelope=None,
+                 precision=None, target_rate=None, channel_mode='mono'):
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.num_samples = num_samples
+        self.envelope = envelope if envelope is not None else []
+        self.precision = precision
+        self.target_rate = target_rate
+        self.channel_mode = channel_mode
+    
+    @property
+    def duration(self):
+        return self.num_samples / self.sample_rate if self.sample_rate else 0.0
+    
+    def load(self):
+        """Giải mã lại file; trả về mảng tín hiệu giống audio_data ban đầu."""
+        return load_audio_info(self.file_path, self.precision, self.target_rate,
+                               self.channel_mode)['audio_data']
+    
+    def __repr__(self):
+        return f"AudioHandle({self.file_path!r}, {self.sample_rate} Hz, {self.num_samples} mẫu)"
 
 
 def classify_audio(features, ste_threshold=0.01, zcr_threshold=0.1):
@@ -205,26 +506,255 @@ def classify_audio(features, ste_threshold=0.01, zcr_threshold=0.1):
         else:
             return "Âm thanh tĩnh / Im lặng"
 
+# Nhãn theo mã (STE cao) * 2 + (ZCR cao), dùng cho phân loại hàng loạt
+CLASS_LABELS = (
+    "Âm thanh tĩnh / Im lặng",
+    "Tiếng nói",
+    "Nhạc cụ / Âm nhạc",
+    "Âm thanh động / Nhiễu"
+)
+
+
+def classify_audio_batch(ste_means, zcr_means, ste_threshold=0.01, zcr_threshold=0.1):
+    """
+    Phân loại nhiều bài hát cùng lúc, cùng quy tắc với classify_audio.
+    
+    Args:
+        ste_means (np.array): ste_mean của từng bài hát
+        zcr_means (np.array): zcr_mean của từng bài hát
+    
+    Returns:
+        np.array: Nhãn phân loại (kiểu object) theo thứ tự đầu vào
+    """
+    ste_means = np.asarray(ste_means, dtype=np.float64)
+    zcr_means = np.asarray(zcr_means, dtype=np.float64)
+    
+    codes = (ste_means > ste_threshold).astype(np.intp) * 2 + (zcr_means > zcr_threshold)
+    return np.array(CLASS_LABELS, dtype=object)[codes]
+
+
+def _threshold_edges(values, bins, log_scale):
+    """Các ngưỡng ứng viên (bins + 1 biên) trải trên khoảng giá trị của values."""
+    if log_scale:
+        positive = values[values > 0]
+        low = positive.min() if len(positive) else 1e-12
+        high = max(values.max(), low * 10)
+        return np.geomspace(low, high, bins + 1)
+    
+    low, high = values.min(), values.max()
+    if high <= low:
+        high = low + 1e-12
+    return np.linspace(low, high, bins + 1)
+
+
+def _bin_index(values, edges):
+    """Chỉ số ô của từng giá trị: giá trị > edges[k] thì thuộc ô k trở lên."""
+    return np.clip(np.searchsorted(edges, values, side='left') - 1, 0, len(edges) - 2)
+
+
+def _otsu_threshold(values, edges):
+    """Ngưỡng Otsu (cực đại phương sai giữa hai lớp) trên histogram theo edges."""
+    counts = np.bincount(_bin_index(values, edges), minlength=len(edges) - 1).astype(np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+    
+    # Trọng số và tổng tích lũy của lớp "thấp" khi cắt sau từng ô
+    weight_low = np.cumsum(counts)[:-1]
+    sum_low = np.cumsum(counts * centers)[:-1]
+    weight_high = counts.sum() - weight_low
+    sum_high = (counts * centers).sum() - sum_low
+    
+    valid = (weight_low > 0) & (weight_high > 0)
+    if not valid.any():
+        return float(edges[len(edges) // 2])
+    
+    mean_low = np.divide(sum_low, weight_low, out=np.zeros_like(sum_low), where=valid)
+    mean_high = np.divide(sum_high, weight_high, out=np.zeros_like(sum_high), where=valid)
+    between = np.where(valid, weight_low * weight_high * (mean_low - mean_high) ** 2, -1)
+    
+    # Giữa hai cụm tách rời thì mọi ngưỡng trong khoảng trống đều tốt như nhau: lấy điểm giữa
+    best = np.flatnonzero(between >= between.max() * (1 - 1e-9))
+    return float(edges[1 + best[len(best) // 2]])
 
-def process_audio_file(file_path, frame_duration_ms=25, overlap_ratio=0.5):
 
-    # Đọc file
-    sample_rate, audio_data = load_audio(file_path)
+def calibrate_thresholds(ste_means, zcr_means, labels=None, bins=256):
+    """
+    Tìm cặp ngưỡng (STE, ZCR) cho classify_audio từ thống kê đã lưu của thư viện.
+    
+    Không có nhãn: mỗi ngưỡng là ngưỡng Otsu của phân bố tương ứng (STE xét theo
+    thang log). Có nhãn (một phần): dựng histogram 2 chiều cho từng lớp rồi dùng
+    tổng tích lũy để tính số bài phân loại đúng với mọi cặp ngưỡng ứng viên cùng
+    lúc, chọn cặp đúng nhiều nhất. Độ mịn của ngưỡng là một ô histogram.
+    
+    Args:
+        ste_means (np.array): ste_mean của từng bài hát
+        zcr_means (np.array): zcr_mean của từng bài hát
+        labels (list): Nhãn đúng (một trong CLASS_LABELS) hoặc None nếu chưa gán
+        bins (int): Số ô histogram trên mỗi trục
+    
+    Returns:
+        dict: {'ste_threshold', 'zcr_threshold', 'method', 'num_samples', 'accuracy'}
+    """
+    ste_means = np.asarray(ste_means, dtype=np.float64)
+    zcr_means = np.asarray(zcr_means, dtype=np.float64)
+    
+    if len(ste_means) == 0:
+        raise ValueError("Không có dữ liệu để hiệu chỉnh ngưỡng")
+    
+    ste_edges = _threshold_edges(ste_means, bins, log_scale=True)
+    zcr_edges = _threshold_edges(zcr_means, bins, log_scale=False)
+    
+    codes = None
+    if labels is not None:
+        label_codes = {label: code for code, label in enumerate(CLASS_LABELS)}
+        codes = np.array([label_codes.get(label, -1) for label in labels], dtype=np.intp)
+        if not (codes >= 0).any():
+            codes = None
     
-    # Trích xuất đặc trưng
-    features = extract_features(audio_data, sample_rate, frame_duration_ms, overlap_ratio)
+    if codes is None:
+        log_ste = np.log10(np.maximum(ste_means, ste_edges[0]))
+        return {
+            'ste_threshold': float(10 ** _otsu_threshold(log_ste, np.log10(ste_edges))),
+            'zcr_threshold': _otsu_threshold(zcr_means, zcr_edges),
+            'method': 'otsu',
+            'num_samples': len(ste_means),
+            'accuracy': None
+        }
     
-    # Phân loại
-    classification = classify_audio(features)
+    labelled = codes >= 0
+    # Số biên nhỏ hơn hẳn giá trị (0..bins+1): với ngưỡng edges[i], giá trị là "thấp"
+    # (không > ngưỡng, đúng như classify_audio) khi và chỉ khi chỉ số này <= i
+    ste_bins = np.searchsorted(ste_edges, ste_means[labelled], side='left')
+    zcr_bins = np.searchsorted(zcr_edges, zcr_means[labelled], side='left')
+    
+    # Histogram theo (lớp, ô STE, ô ZCR) và tổng tích lũy có đệm 0:
+    # cum[c, p, q] = số bài lớp c có ô STE < p và ô ZCR < q
+    size = bins + 2
+    hist = np.zeros((len(CLASS_LABELS), size, size), dtype=np.int64)
+    np.add.at(hist, (codes[labelled], ste_bins, zcr_bins), 1)
+    cum = np.zeros((len(CLASS_LABELS), size + 1, size + 1), dtype=np.int64)
+    cum[:, 1:, 1:] = hist.cumsum(axis=1).cumsum(axis=2)
+    
+    # Với ngưỡng (edges[i], edges[j]) thì p = i + 1, q = j + 1:
+    # lớp đúng của mỗi góc phần tư theo mã CLASS_LABELS
+    low_low = cum[0]
+    low_high = cum[1][:, [size]] - cum[1]
+    high_low = cum[2][[size], :] - cum[2]
+    high_high = cum[3][size, size] - cum[3][:, [size]] - cum[3][[size], :] + cum[3]
+    correct = (low_low + low_high + high_low + high_high)[1:bins + 2, 1:bins + 2]
+    
+    i, j = np.unravel_index(np.argmax(correct), correct.shape)
+    ste_threshold, zcr_threshold = float(ste_edges[i]), float(zcr_edges[j])
+    
+    # Độ chính xác báo cáo phải đúng bằng độ chính xác khi phân loại với ngưỡng trả về
+    predicted = classify_audio_batch(ste_means[labelled], zcr_means[labelled],
+                                     ste_threshold, zcr_threshold)
+    expected = np.array(CLASS_LABELS, dtype=object)[codes[labelled]]
+    num_correct = int((predicted == expected).sum())
+    if num_correct != correct[i, j]:
+        raise RuntimeError(
+            f"Histogram khong khop voi classify_audio_batch tai nguong "
+            f"({ste_threshold}, {zcr_threshold}): {int(correct[i, j])} != {num_correct}"
+        )
     
     return {
+        'ste_threshold': ste_threshold,
+        'zcr_threshold': zcr_threshold,
+        'method': 'supervised',
+        'num_samples': int(labelled.sum()),
+        'accuracy': num_correct / int(labelled.sum())
+    }
+
+
+# Tăng khi thay đổi cách tính đặc trưng (làm mọi bản ghi cũ trở nên lỗi thời)
+FEATURE_SCHEMA_VERSION = 1
+
+
+def make_extraction_config(frame_duration_ms=25, overlap_ratio=0.5, target_rate=None, vad='off',
+                           channel_mode='mono'):
+    """
+    Bộ tham số quyết định giá trị đặc trưng của một bản ghi.
+    
+    precision không nằm trong cấu hình vì float32/float64 cho kết quả tương thích
+    (xem PRECISION_DTYPES). Tham số thêm sau chỉ được ghi khi khác giá trị mặc
+    định, để phiên bản của các bản ghi cũ không thay đổi.
+    """
+    config = {
+        'schema': FEATURE_SCHEMA_VERSION,
+        'frame_duration_ms': float(frame_duration_ms),
+        'overlap_ratio': float(overlap_ratio),
+        'target_rate': int(target_rate) if target_rate else None
+    }
+    if vad != 'off':
+        config['vad'] = vad
+    if channel_mode != 'mono':
+        config['channel_mode'] = channel_mode
+    return config
+
+
+def get_feature_version(config=None):
+    """Mã phiên bản ngắn, ổn định của một cấu hình trích đặc trưng."""
+    if config is None:
+        config = make_extraction_config()
+    payload = json.dumps(config, sort_keys=True).encode('utf-8')
+    return f"v{config['schema']}-{hashlib.sha1(payload).hexdigest()[:10]}"
+
+
+# Phiên bản của cấu hình mặc định; các bản ghi cũ (chưa gắn phiên bản) được tính theo cấu hình này
+DEFAULT_FEATURE_VERSION = get_feature_version()
+
+
+def process_audio_file(file_path, frame_duration_ms=25, overlap_ratio=0.5, precision=None,
+                       target_rate=None, vad='off', keep_audio=True, audio_handle=False,
+                       channel_mode='mono'):
+    """
+    Đọc, trích đặc trưng và phân loại một file.
+    
+    Args:
+        keep_audio (bool): Giữ toàn bộ tín hiệu trong kết quả ('audio_data'); đặt False
+            khi chỉ cần đặc trưng để không giữ mảng lớn trong bộ nhớ
+        audio_handle (bool): Thêm 'audio_handle' (AudioHandle có bao min/max để vẽ)
+        channel_mode (str): Một trong CHANNEL_MODES
+    """
+    with profiling.stage('process_audio_file'):
+        # Đọc file (đổi về target_rate ngay khi đọc nếu được yêu cầu)
+        with profiling.stage('audio.decode'):
+            info = load_audio_info(file_path, precision, target_rate, channel_mode)
+        sample_rate = info['sample_rate']
+        audio_data = info['audio_data']
+        profiling.count('audio.samples', len(audio_data))
+        
+        # Trích xuất đặc trưng
+        features = extract_features(audio_data, sample_rate, frame_duration_ms, overlap_ratio, vad,
+                                    channel_mode)
+        
+        # Phân loại
+        classification = classify_audio(features)
+        
+        handle = None
+        if audio_handle:
+            with profiling.stage('audio.envelope'):
+                handle = AudioHandle(file_path, sample_rate, len(audio_data),
+                                     build_envelope_pyramid(audio_data), precision, target_rate,
+                                     channel_mode)
+    
+    config = make_extraction_config(frame_duration_ms, overlap_ratio, target_rate, vad, channel_mode)
+    
+    result = {
         'file_path': file_path,
+        'extraction_config': config,
+        'feature_version': get_feature_version(config),
         'sample_rate': sample_rate,
-        'audio_data': audio_data,
+        'original_sample_rate': info['original_sample_rate'],
+        'decoder': info['decoder'],
         'features': features,
         'feature_vector': get_feature_vector(features),
         'classification': classification
     }
+    if keep_audio:
+        result['audio_data'] = audio_data
+    if handle is not None:
+        result['audio_handle'] = handle
+    return result
 
 
 # Test module nếu chạy trực tiếp
@@ -232,9 +762,15 @@ if __name__ == "__main__":
     print("=== Module Xử lý Tín hiệu Âm thanh ===")
     print("Các hàm có sẵn:")
     print("- load_audio(file_path): Đọc file .wav")
+    print("- load_audio_info(file_path, precision, target_rate, channel_mode): Đọc file kèm thông tin, đổi tần số lấy mẫu")
     print("- framing(audio_data, sample_rate): Chia thành các khung")
     print("- calculate_ste(frames): Tính năng lượng ngắn hạn")
     print("- calculate_zcr(frames): Tính tốc độ qua điểm không")
-    print("- extract_features(audio_data, sample_rate): Trích xuất đặc trưng")
+    print("- extract_features(audio_data, sample_rate, vad, channel_mode): Trích xuất đặc trưng (mono/từng kênh/mid-side)")
+    print("- detect_voice_activity(ste, zcr): Tìm các khung có âm thanh")
     print("- classify_audio(features): Phân loại âm thanh")
-    print("- process_audio_file(file_path): Xử lý hoàn chỉnh file")
+    print("- classify_audio_batch(ste_means, zcr_means): Phân loại hàng loạt")
+    print("- calibrate_thresholds(ste_means, zcr_means, labels): Hiệu chỉnh ngưỡng phân loại")
+    print("- process_audio_file(file_path, keep_audio, audio_handle, channel_mode): Xử lý hoàn chỉnh file")
+    print("- AudioHandle: Đường dẫn + bao min/max thay cho toàn bộ tín hiệu")
+    print("- get_feature_version(config): Mã phiên bản của cấu hình trích đặc trưng")
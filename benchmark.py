@@ -0,0 +1,318 @@
+"""
+Module 9: Do hieu nang (Benchmark)
+Sinh am thanh va thu vien tong hop co the tai lap (theo seed), do thoi gian cac buoc
+chinh va ghi ket qua JSON de so sanh giua cac lan chay.
+
+Vi du:
+    python benchmark.py run --duration 60 --library-size 2000 --output base.json
+    python benchmark.py run --output new.json
+    python benchmark.py compare base.json new.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy.io import wavfile
+
+from audio_processing import (load_audio, framing, calculate_ste_normalized, calculate_zcr,
+                              extract_features, get_feature_vector, classify_audio,
+                              make_extraction_config, get_feature_version)
+from database_manager import DatabaseManager, encode_series, decode_series
+from search_engine import SearchEngine
+from quantization import measure_recall
+
+
+def generate_audio(duration_s=30.0, sample_rate=22050, seed=0):
+    """
+    Tín hiệu tổng hợp xen kẽ các đoạn im lặng, âm sắc (hài âm) và nhiễu.
+    
+    Returns:
+        np.array: Tín hiệu float64 trong [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    num_samples = int(duration_s * sample_rate)
+    audio = np.zeros(num_samples)
+    
+    segment = sample_rate // 2
+    t = np.arange(segment) / sample_rate
+    for start in range(0, num_samples, segment):
+        length = min(segment, num_samples - start)
+        kind = rng.integers(3)
+        if kind == 1:
+            f0 = rng.uniform(100, 800)
+            tone = sum(np.sin(2 * np.pi * f0 * h * t) / h for h in range(1, 5))
+            audio[start:start + length] = 0.3 * tone[:length]
+        elif kind == 2:
+            audio[start:start + length] = 0.1 * rng.standard_normal(length)
+        else:
+            audio[start:start + length] = 0.001 * rng.standard_normal(length)
+    
+    return np.clip(audio, -1, 1)
+
+
+def write_wav(file_path, audio, sample_rate):
+    """Ghi tín hiệu [-1, 1] ra WAV 16-bit."""
+    wavfile.write(file_path, sample_rate, (audio * 32767).astype(np.int16))
+
+
+def generate_processed(rng, duration_s, frames_per_second=80):
+    """Một kết quả process_audio_file giả lập (không cần file) để nạp thư viện tổng hợp."""
+    num_frames = max(1, int(duration_s * frames_per_second))
+    ste = rng.gamma(0.5, 0.02, num_frames)
+    zcr = np.clip(rng.normal(rng.uniform(0.02, 0.4), 0.05, num_frames), 0, 1)
+    
+    features = {
+        'ste': ste,
+        'zcr': zcr,
+        'ste_mean': float(np.mean(ste)), 'ste_std': float(np.std(ste)),
+        'ste_max': float(np.max(ste)), 'ste_min': float(np.min(ste)),
+        'zcr_mean': float(np.mean(zcr)), 'zcr_std': float(np.std(zcr)),
+        'zcr_max': float(np.max(zcr)), 'zcr_min': float(np.min(zcr)),
+        'num_frames': num_frames,
+        'duration': duration_s
+    }
+    config = make_extraction_config()
+    return {
+        'extraction_config': config,
+        'feature_version': get_feature_version(config),
+        'sample_rate': 22050,
+        'features': features,
+        'feature_vector': get_feature_vector(features),
+        'classification': classify_audio(features)
+    }
+
+
+def time_call(func, repeat=5, warmup=1):
+    """
+    Đo thời gian func() qua nhiều lần chạy.
+    
+    Returns:
+        dict: {'min_s', 'median_s', 'mean_s', 'repeat'}
+    """
+    for _ in range(warmup):
+        func()
+    
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    
+    return {
+        'min_s': min(samples),
+        'median_s': statistics.median(samples),
+        'mean_s': statistics.fmean(samples),
+        'repeat': repeat
+    }
+
+
+def run_benchmarks(duration_s=30.0, library_size=1000, song_duration_s=180.0, repeat=5,
+                   seed=0, sample_rate=22050, duplicate_threshold=0.01):
+    """
+    Chạy toàn bộ các phép đo trong một thư mục tạm.
+    
+    Returns:
+        dict: {'meta': {...}, 'results': {tên phép đo: thống kê thời gian},
+               'quality': {tên: độ chính xác/bộ nhớ của chỉ mục nén}}
+    """
+    rng = np.random.default_rng(seed)
+    work_dir = tempfile.mkdtemp(prefix='audio_bench_')
+    results = {}
+    quality = {}
+    
+    try:
+        # Trích đặc trưng trên một file WAV tổng hợp
+        wav_path = os.path.join(work_dir, 'bench.wav')
+        write_wav(wav_path, generate_audio(duration_s, sample_rate, seed), sample_rate)
+        
+        results['load_audio'] = time_call(lambda: load_audio(wav_path), repeat)
+        _, audio = load_audio(wav_path)
+        results['framing'] = time_call(lambda: framing(audio, sample_rate), repeat)
+        frames = framing(audio, sample_rate)
+        results['ste'] = time_call(lambda: calculate_ste_normalized(frames), repeat)
+        results['zcr'] = time_call(lambda: calculate_zcr(frames), repeat)
+        results['extract_features'] = time_call(lambda: extract_features(audio, sample_rate), repeat)
+        
+        # Nén chuỗi STE/ZCR của một bài dài song_duration_s
+        series = generate_processed(rng, song_duration_s)['features']
+        encoded = [encode_series(series['ste'], log_scale=True), encode_series(series['zcr'])]
+        results['encode_series'] = time_call(
+            lambda: (encode_series(series['ste'], log_scale=True), encode_series(series['zcr'])), repeat
+        )
+        results['decode_series'] = time_call(lambda: [decode_series(data) for data in encoded], repeat)
+        json_bytes = sum(len(json.dumps(np.asarray(series[name], dtype=np.float64).tolist()))
+                         for name in ('ste', 'zcr'))
+        points = len(series['ste']) + len(series['zcr'])
+        quality['series_q16'] = {
+            'points': points,
+            'json_bytes': json_bytes,
+            'stored_bytes': sum(len(data) for data in encoded),
+            'ratio': json_bytes / sum(len(data) for data in encoded),
+            'points_per_s': points / results['decode_series']['median_s']
+        }
+        
+        # Thư viện tổng hợp
+        db = DatabaseManager(os.path.join(work_dir, 'bench.db'), async_history=False)
+        processed = [generate_processed(rng, song_duration_s) for _ in range(library_size)]
+        
+        start = time.perf_counter()
+        for i, item in enumerate(processed):
+            db.add_song(f'song_{i:06d}.wav', item)
+        elapsed = time.perf_counter() - start
+        results['add_song'] = {
+            'min_s': elapsed / library_size,
+            'median_s': elapsed / library_size,
+            'mean_s': elapsed / library_size,
+            'repeat': library_size,
+            'total_s': elapsed
+        }
+        
+        results['get_all_feature_vectors'] = time_call(db.get_all_feature_vectors, repeat)
+        
+        engine = SearchEngine(db, cache_size=0)
+        queries = [generate_processed(rng, song_duration_s)['feature_vector'] for _ in range(repeat + 1)]
+        query_iter = iter(queries)
+        results['search_similar'] = time_call(
+            lambda: engine.search_similar(next(query_iter), 5), repeat
+        )
+        results['search_similar_batch_100'] = time_call(
+            lambda: engine.search_similar_batch(np.vstack(queries * 20)[:100], 5), repeat
+        )
+        results['find_duplicates'] = time_call(
+            lambda: engine.find_duplicates(duplicate_threshold), max(1, repeat // 2)
+        )
+        
+        # Chỉ mục nén: thời gian học/mã hóa, tìm kiếm ADC + xếp hạng lại và recall
+        batch = np.vstack(queries * 20)[:100]
+        for codec in ('pq', 'sq'):
+            results[f'quantize_{codec}'] = time_call(
+                lambda: engine.build_quantized_index(None, codec), max(1, repeat // 2)
+            )
+            results[f'search_quantized_{codec}_100'] = time_call(
+                lambda: engine.search_quantized(batch, 5, feature_version=None), repeat
+            )
+            quality[f'quantized_{codec}'] = measure_recall(engine, batch, 5, feature_version=None)
+        
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'params': {
+                'duration_s': duration_s,
+                'library_size': library_size,
+                'song_duration_s': song_duration_s,
+                'repeat': repeat,
+                'seed': seed,
+                'sample_rate': sample_rate,
+                'duplicate_threshold': duplicate_threshold
+            }
+        },
+        'results': results,
+        'quality': quality
+    }
+
+
+def compare_results(baseline, current, tolerance=0.1, metric='median_s'):
+    """
+    So sánh hai lần chạy theo từng phép đo.
+    
+    Returns:
+        list: [(tên, thời gian cũ, thời gian mới, tỉ lệ mới/cũ, trạng thái)]
+    """
+    rows = []
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        old = baseline['results'].get(name, {}).get(metric)
+        new = current['results'].get(name, {}).get(metric)
+        if old is None or new is None:
+            rows.append((name, old, new, None, 'missing'))
+            continue
+        
+        ratio = new / old if old > 0 else float('inf')
+        if ratio > 1 + tolerance:
+            status = 'slower'
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append((name, old, new, ratio, status))
+    return rows
+
+
+def _print_results(report):
+    params = report['meta']['params']
+    print(f"Audio {params['duration_s']}s, thu vien {params['library_size']} bai, repeat {params['repeat']}")
+    for name, stats in report['results'].items():
+        print(f"  {name:<28} median {stats['median_s'] * 1000:10.3f} ms   min {stats['min_s'] * 1000:10.3f} ms")
+    for name, item in report.get('quality', {}).items():
+        if 'ratio' in item:
+            print(f"  {name:<28} nen x{item['ratio']:.1f}   giai ma {item['points_per_s'] / 1e6:.1f} M diem/s")
+            continue
+        print(f"  {name:<28} recall@{item['top_k']} {item['recall']:.3f}   "
+              f"{item['bytes_per_song']:.0f} B/bai (float64: {item['float64_bytes_per_song']} B)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Do hieu nang trich dac trung, luu tru va tim kiem")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run = subparsers.add_parser('run', help="Chay cac phep do")
+    run.add_argument('--duration', type=float, default=30.0, help="Do dai am thanh tong hop (giay)")
+    run.add_argument('--library-size', type=int, default=1000, help="So bai hat trong thu vien tong hop")
+    run.add_argument('--song-duration', type=float, default=180.0, help="Do dai gia lap moi bai (giay)")
+    run.add_argument('--repeat', type=int, default=5, help="So lan do moi phep")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', '-o', default=None, help="Ghi ket qua JSON ra file")
+    
+    compare = subparsers.add_parser('compare', help="So sanh hai file ket qua")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=0.1, help="Sai lech cho phep (0.1 = 10%%)")
+    compare.add_argument('--metric', choices=('min_s', 'median_s', 'mean_s'), default='median_s')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'run':
+        report = run_benchmarks(args.duration, args.library_size, args.song_duration,
+                                args.repeat, args.seed)
+        _print_results(report)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        return 0
+    
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    
+    if baseline['meta']['params'] != current['meta']['params']:
+        print("Canh bao: hai lan chay dung tham so khac nhau", file=sys.stderr)
+    
+    rows = compare_results(baseline, current, args.tolerance, args.metric)
+    for name, old, new, ratio, status in rows:
+        if ratio is None:
+            print(f"  {name:<28} {status}")
+        else:
+            print(f"  {name:<28} {old * 1000:10.3f} -> {new * 1000:10.3f} ms  x{ratio:5.2f}  {status}")
+    
+    # Mã thoát 1 nếu có phép đo chậm đi quá ngưỡng
+    return 1 if any(row[4] == 'slower' for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""
+Module 7: Giao dien dong lenh (Command-Line Interface)
+Chay cac tac vu hang loat (nap thu vien, tim kiem, tim trung lap, thong ke, xuat du lieu)
+khong can giao dien do hoa, phu hop cho cron va pipeline.
+
+Vi du:
+    python cli.py --db library.db ingest music/ --recursive --workers 4
+    python cli.py --db library.db search query.wav --top-k 10 --format csv
+    python cli.py --db library.db dedupe --threshold 0.05 --output dup.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_processing import process_audio_file, VAD_MODES, CHANNEL_MODES
+from audio_decoders import supported_extensions
+from database_manager import DatabaseManager
+from search_engine import SearchEngine
+import profiling
+
+
+def _process_file(file_path, options):
+    """Xử lý một file (chạy trong tiến trình con); kết quả không kèm tín hiệu âm thanh."""
+    try:
+        result = process_audio_file(file_path, keep_audio=False, **options)
+        return file_path, result, None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def _process_files(file_paths, options, workers):
+    """Xử lý nhiều file, song song nếu workers > 1; trả về theo thứ tự đầu vào."""
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_process_file, file_paths, [options] * len(file_paths))
+    else:
+        for file_path in file_paths:
+            yield _process_file(file_path, options)
+
+
+def _collect_files(paths, recursive):
+    """Các file âm thanh được hỗ trợ trong danh sách đường dẫn (file hoặc thư mục)."""
+    extensions = set(supported_extensions())
+    files = []
+    
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                walker = os.walk(path)
+            else:
+                walker = [(path, [], os.listdir(path))]
+            for root, _, names in walker:
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in extensions:
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    
+    return files
+
+
+def _extraction_options(args):
+    return {
+        'frame_duration_ms': args.frame_ms,
+        'overlap_ratio': args.overlap,
+        'target_rate': args.target_rate,
+        'vad': args.vad,
+        'channel_mode': args.channel_mode
+    }
+
+
+def _to_plain(value):
+    """Chuyển kiểu numpy sang kiểu Python để ghi JSON/CSV."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def write_output(rows, output_format='json', output=None):
+    """
+    Ghi danh sách dict ra stdout hoặc file.
+    
+    Args:
+        rows (list): Các dòng kết quả (dict cùng khóa với CSV)
+        output_format (str): 'json' hoặc 'csv'
+        output (str): Đường dẫn file, None để ghi ra stdout
+    """
+    rows = [{key: _to_plain(value) for key, value in row.items()} for row in rows]
+    stream = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+    
+    try:
+        if output_format == 'csv':
+            fieldnames = []
+            for row in rows:
+                fieldnames.extend(key for key in row if key not in fieldnames)
+            writer = csv.DictWriter(stream, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, stream, ensure_ascii=False, indent=2, default=str)
+            stream.write('\n')
+    finally:
+        if output:
+            stream.close()
+
+
+def cmd_ingest(args, db, engine):
+    files = _collect_files(args.paths, args.recursive)
+    if args.skip_existing:
+        files = [path for path in files if db.get_song_by_path(path) is None]
+    
+    rows = []
+    for file_path, result, error in _process_files(files, _extraction_options(args), args.workers):
+        song_id = None
+        if result is not None:
+            song_id = db.add_song(file_path, result)
+            if song_id is None:
+                error = "Khong ghi duoc vao database"
+        
+        rows.append({
+            'file_path': file_path,
+            'song_id': song_id,
+            'classification': result['classification'] if result else None,
+            'feature_version': result['feature_version'] if result else None,
+            'status': 'ok' if error is None else 'error',
+            'error': error
+        })
+        if args.verbose:
+            print(f"[{len(rows)}/{len(files)}] {file_path}: {rows[-1]['status']}", file=sys.stderr)
+    
+    return rows
+
+
+def cmd_search(args, db, engine):
+    files = _collect_files(args.queries, recursive=False)
+    processed = list(_process_files(files, _extraction_options(args), args.workers))
+    
+    # Gom các truy vấn cùng phiên bản đặc trưng để tìm theo lô
+    by_version = {}
+    for file_path, result, error in processed:
+        if result is not None:
+            by_version.setdefault(result['feature_version'], []).append((file_path, result))
+    
+    results_by_file = {}
+    for feature_version, items in by_version.items():
+        query_matrix = np.vstack([result['feature_vector'] for _, result in items])
+        batch_results = engine.search_similar_batch(
+            query_matrix, args.top_k, args.method, feature_version=feature_version
+        )
+        for (file_path, _), results in zip(items, batch_results):
+            results_by_file[file_path] = results
+    
+    rows = []
+    for file_path, result, error in processed:
+        if error is not None:
+            rows.append({'query': file_path, 'rank': None, 'song_id': None, 'error': error})
+            continue
+        for match in results_by_file.get(file_path, []):
+            rows.append({
+                'query': file_path,
+                'rank': match['rank'],
+                'song_id': match['id'],
+                'title': match['title'],
+                'artist': match['artist'],
+                'file_path': match['file_path'],
+                'classification': match['classification'],
+                'score': match['score'],
+                'score_type': match['score_type']
+            })
+        if args.save_history:
+            db.save_search_history(file_path, results_by_file.get(file_path, []))
+    
+    return rows
+
+
+def cmd_dedupe(args, db, engine):
+    return [
+        {
+            'song1_id': pair['song1']['id'],
+            'song1_path': pair['song1']['file_path'],
+            'song2_id': pair['song2']['id'],
+            'song2_path': pair['song2']['file_path'],
+            'distance': pair['distance']
+        }
+        for pair in engine.find_duplicates(args.threshold)
+    ]
+
+
+def cmd_stats(args, db, engine):
+    stats = db.get_statistics()
+    rows = [
+        {'metric': 'total_songs', 'key': None, 'value': stats['total_songs']},
+        {'metric': 'total_duration', 'key': None, 'value': stats['total_duration']}
+    ]
+    rows.extend(
+        {'metric': 'by_classification', 'key': key, 'value': value}
+        for key, value in stats['by_classification'].items()
+    )
+    rows.extend(
+        {'metric': 'by_feature_version', 'key': key, 'value': value}
+        for key, value in db.get_feature_versions().items()
+    )
+    return rows
+
+
+def cmd_export(args, db, engine):
+    columns = [name for name in db.SONG_COLUMNS if name not in ('ste_data', 'zcr_data')]
+    if not args.include_vectors:
+        columns.remove('feature_vector')
+    
+    rows = []
+    for song in db.get_all_songs(include_series=False):
+        row = {name: song[name] for name in columns}
+        if args.include_vectors and isinstance(row['feature_vector'], np.ndarray):
+            row['feature_vector'] = ' '.join(map(repr, row['feature_vector'].tolist()))
+        for name in ('extraction_config', 'channel_summary'):
+            if row.get(name) is not None:
+                row[name] = json.dumps(row[name], sort_keys=True)
+        rows.append(row)
+    return rows
+
+
+def cmd_compress_series(args, db, engine):
+    converted = db.compress_series()
+    if args.vacuum and converted:
+        db.conn.execute('VACUUM')
+    
+    stats = db.get_series_storage_stats()
+    rows = [{'metric': 'converted_rows', 'value': converted}]
+    rows.extend({'metric': key, 'value': value} for key, value in stats.items())
+    return rows
+
+
+def _add_extraction_arguments(parser):
+    parser.add_argument('--frame-ms', type=float, default=25, help="Do dai khung (ms)")
+    parser.add_argument('--overlap', type=float, default=0.5, help="Ti le chong lap giua cac khung")
+    parser.add_argument('--target-rate', type=int, default=None, help="Doi tan so lay mau truoc khi phan tich")
+    parser.add_argument('--vad', choices=VAD_MODES, default='off', help="Cat/bo cac doan im lang")
+    parser.add_argument('--channel-mode', choices=CHANNEL_MODES, default='mono',
+                        help="Gop kenh, tinh tung kenh hoac mid/side")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="So tien trinh xu ly file song song")
+
+
+def _add_common_arguments(parser, defaults=True):
+    # Trên subcommand dùng SUPPRESS để không ghi đè giá trị đã đặt trước tên lệnh
+    def default(value):
+        return value if defaults else argparse.SUPPRESS
+    
+    parser.add_argument('--db', default=default('audio_database.db'), help="Duong dan database")
+    parser.add_argument('--format', choices=('json', 'csv'), default=default('json'), help="Dinh dang dau ra")
+    parser.add_argument('--output', '-o', default=default(None), help="Ghi ket qua ra file thay vi stdout")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Xu ly thu vien am thanh tu dong lenh")
+    _add_common_arguments(parser)
+    parser.add_argument('--profile', action='store_true',
+                        help="In thoi gian tung buoc ra stderr (buoc chay trong tien trinh con "
+                             "khong duoc tinh, dung --workers 1 de do ca giai ma)")
+    parser.add_argument('--cprofile', action='store_true', help="In them ket qua cProfile")
+    parser.add_argument('--trace-memory', action='store_true', help="Ghi bo nho dinh cua tung buoc")
+    parser.add_argument('--feature-store', action='store_true',
+                        help="Tim kiem tren kho vector anh xa bo nho canh database")
+    
+    common = argparse.ArgumentParser(add_help=False)
+    _add_common_arguments(common, defaults=False)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    ingest = subparsers.add_parser('ingest', parents=[common], help="Phan tich va them file vao thu vien")
+    ingest.add_argument('paths', nargs='+', help="File hoac thu muc")
+    ingest.add_argument('--recursive', '-r', action='store_true', help="Duyet thu muc con")
+    ingest.add_argument('--skip-existing', action='store_true', help="Bo qua file da co trong thu vien")
+    ingest.add_argument('--verbose', '-v', action='store_true', help="In tien do ra stderr")
+    _add_extraction_arguments(ingest)
+    ingest.set_defaults(handler=cmd_ingest)
+    
+    search = subparsers.add_parser('search', parents=[common], help="Tim bai hat tuong dong voi cac file truy van")
+    search.add_argument('queries', nargs='+', help="File truy van")
+    search.add_argument('--top-k', type=int, default=5, help="So ket qua moi truy van")
+    search.add_argument('--method', choices=('euclidean', 'cosine', 'manhattan'), default='euclidean')
+    search.add_argument('--save-history', action='store_true', help="Ghi vao lich su tim kiem")
+    _add_extraction_arguments(search)
+    search.set_defaults(handler=cmd_search)
+    
+    dedupe = subparsers.add_parser('dedupe', parents=[common], help="Tim cac cap bai hat trung lap")
+    dedupe.add_argument('--threshold', type=float, default=0.1, help="Nguong khoang cach Euclidean")
+    dedupe.set_defaults(handler=cmd_dedupe)
+    
+    stats = subparsers.add_parser('stats', parents=[common], help="Thong ke thu vien")
+    stats.set_defaults(handler=cmd_stats)
+    
+    export = subparsers.add_parser('export', parents=[common], help="Xuat thong tin bai hat")
+    export.add_argument('--include-vectors', action='store_true', help="Kem vector dac trung")
+    export.set_defaults(handler=cmd_export)
+    
+    compress = subparsers.add_parser('compress-series', parents=[common],
+                                     help="Nen cac chuoi STE/ZCR con luu dang JSON")
+    compress.add_argument('--vacuum', action='store_true', help="Chay VACUUM de thu hoi dung luong file")
+    compress.set_defaults(handler=cmd_compress_series)
+    
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    
+    if args.profile or args.cprofile or args.trace_memory:
+        profiling.enable(profile=args.cprofile, trace_memory=args.trace_memory)
+    
+    with DatabaseManager(args.db) as db:
+        engine = SearchEngine(db, feature_store=True if args.feature_store else None)
+        rows = args.handler(args, db, engine)
+    
+    write_output(rows, args.format, args.output)
+    
+    if profiling.is_enabled():
+        profiling.disable()
+        print(profiling.format_stats(), file=sys.stderr)
+        if args.cprofile:
+            print(profiling.profile_report(), file=sys.stderr)
+    
+    # Mã thoát khác 0 nếu có file lỗi, để cron/pipeline phát hiện được
+    return 1 if any(row.get('error') for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,15 +7,275 @@ Sử dụng SQLite làm database.
 import sqlite3
 import json
 import os
+import queue
+import struct
+import threading
+import time
+import zlib
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
+import profiling
+
+
+# Các mức giảm mẫu của chuỗi STE/ZCR được lưu sẵn (mức 1x chính là cột trong bảng songs)
+SERIES_LOD_FACTORS = (8, 64)
+
+# Số dòng tối đa giữ trong nhật ký thay đổi đặc trưng, kể cả khi có nơi đọc chưa áp dụng
+FEATURE_CHANGE_LOG_MAX_ROWS = 100000
+
+
+def _downsample_series(values, factor):
+    """Giảm mẫu chuỗi bằng trung bình của từng khối factor điểm (khối cuối có thể ngắn hơn)."""
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        values = values.astype(np.float64)
+    if factor <= 1 or len(values) == 0:
+        return values
+    
+    starts = np.arange(0, len(values), factor)
+    sums = np.add.reduceat(values, starts)
+    counts = np.diff(np.append(starts, len(values)))
+    return (sums / counts).astype(values.dtype)
+
+
+# Kết quả tìm kiếm trong lịch sử: (id bài hát, điểm) đóng gói nhị phân, 8 byte mỗi kết quả
+HISTORY_RESULT_DTYPE = np.dtype([('song_id', '<i4'), ('score', '<f4')])
+
+
+def encode_history_results(results):
+    """Danh sách kết quả (dict có 'id'/'score' hoặc cặp (id, score)) -> bytes."""
+    packed = np.zeros(len(results), dtype=HISTORY_RESULT_DTYPE)
+    for i, result in enumerate(results):
+        if isinstance(result, dict):
+            packed[i] = (result['id'], result.get('score', 0.0))
+        else:
+            packed[i] = (result[0], result[1])
+    return packed.tobytes()
+
+
+def decode_history_results(data):
+    """bytes (hoặc JSON của phiên bản cũ) -> danh sách (song_id, score)."""
+    if not data:
+        return []
+    if isinstance(data, str):
+        return [(r.get('id'), r.get('score')) if isinstance(r, dict) else tuple(r)
+                for r in json.loads(data)]
+    packed = np.frombuffer(data, dtype=HISTORY_RESULT_DTYPE)
+    return list(zip(packed['song_id'].tolist(), packed['score'].tolist()))
+
+
+# Chuỗi STE/ZCR nén: 'q16' lượng tử hóa uint16 + delta + zlib, 'json' là định dạng cũ
+SERIES_CODECS = ('q16', 'json')
+SERIES_MAGIC = b'SQ16'
+# magic, cờ (bit 0: thang log), số điểm, giá trị nhỏ nhất, bước lượng tử
+_SERIES_HEADER = struct.Struct('<4sBIdd')
+_SERIES_LOG = 1
+# Cộng trước khi lấy log để giá trị 0 (khung im lặng) vẫn mã hóa được
+_SERIES_LOG_EPS = 1e-10
+
+
+def encode_series(values, log_scale=False, level=6):
+    """
+    Chuỗi float -> bytes nén.
+    
+    Mỗi chuỗi được lượng tử hóa thành uint16 trên khoảng [min, max] của chính nó
+    (sai số tuyệt đối tối đa (max - min) / 131070), lấy hiệu giữa hai điểm liên
+    tiếp, tách byte cao/thấp rồi nén zlib.
+    
+    Args:
+        values (np.array): Chuỗi STE hoặc ZCR
+        log_scale (bool): Lượng tử hóa log(x) thay vì x (sai số tương đối thay vì
+            tuyệt đối, hợp với STE có dải động lớn); bỏ qua nếu có giá trị âm
+        level (int): Mức nén zlib
+    
+    Returns:
+        bytes: hoặc None nếu chuỗi có NaN/inf (khi đó nên ghi JSON)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        return None
+    
+    flags = 0
+    if log_scale and len(values) and values.min() >= 0:
+        values = np.log(values + _SERIES_LOG_EPS)
+        flags |= _SERIES_LOG
+    
+    low = float(values.min()) if len(values) else 0.0
+    step = (float(values.max()) - low) / 65535 if len(values) else 0.0
+    if step > 0:
+        quantized = np.rint((values - low) / step).astype(np.uint16)
+    else:
+        quantized = np.zeros(len(values), dtype=np.uint16)
+    
+    # Hiệu liên tiếp (tràn số uint16 được cumsum khi giải mã bù lại)
+    deltas = quantized.copy()
+    deltas[1:] -= quantized[:-1]
+    # Byte thấp và byte cao tách thành hai khối: zlib nén tốt hơn khi byte cao hầu hết bằng 0
+    shuffled = deltas.astype('<u2').view(np.uint8).reshape(-1, 2).T.tobytes()
+    
+    header = _SERIES_HEADER.pack(SERIES_MAGIC, flags, len(values), low, step)
+    return header + zlib.compress(shuffled, level)
+
+
+def decode_series(data, dtype=np.float64):
+    """bytes nén (hoặc JSON của định dạng cũ) -> mảng numpy."""
+    if not data:
+        return np.array([], dtype=dtype)
+    if isinstance(data, str):
+        return np.array(json.loads(data), dtype=dtype)
+    
+    magic, flags, count, low, step = _SERIES_HEADER.unpack_from(data)
+    if magic != SERIES_MAGIC:
+        raise ValueError("Du lieu chuoi khong dung dinh dang")
+    
+    shuffled = np.frombuffer(zlib.decompress(data[_SERIES_HEADER.size:]), dtype=np.uint8)
+    deltas = shuffled.reshape(2, count).T.copy().view('<u2').ravel()
+    quantized = np.cumsum(deltas, dtype=np.uint16)
+    
+    values = low + quantized * step
+    if flags & _SERIES_LOG:
+        values = np.maximum(np.exp(values) - _SERIES_LOG_EPS, 0.0)
+    return values.astype(dtype, copy=False)
+
+
+class HistoryWriter:
+    """
+    Luồng nền ghi lịch sử tìm kiếm theo lô, trên kết nối SQLite riêng.
+    
+    Các bản ghi được gom trong hàng đợi và ghi mỗi flush_interval giây (hoặc khi
+    đủ batch_size) trong một transaction; cứ prune_interval giây lại xóa bớt theo
+    chính sách giữ lại (max_rows dòng mới nhất, không cũ hơn max_age_days ngày).
+    """
+    
+    def __init__(self, db_path, max_rows=10000, max_age_days=90,
+                 flush_interval=2.0, batch_size=64, prune_interval=600):
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.max_age_days = max_age_days
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.prune_interval = prune_interval
+        self._queue = queue.Queue()
+        self._stop = object()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, query_file, results_blob, search_time):
+        self._queue.put((query_file, results_blob, search_time))
+    
+    def close(self):
+        """Ghi nốt các bản ghi còn trong hàng đợi rồi dừng luồng."""
+        self._queue.put(self._stop)
+        self._thread.join()
+    
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        last_prune = 0
+        running = True
+        
+        try:
+            while running:
+                batch = []
+                deadline = None
+                
+                # Gom bản ghi tới khi đủ lô, hết thời gian hoặc có lệnh dừng; thời hạn
+                # flush_interval tính từ lúc bản ghi đầu tiên của lô tới
+                while len(batch) < self.batch_size:
+                    if batch:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = self.flush_interval
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        # Hết thời hạn của lô, hoặc đang rảnh: quay ra để còn dọn lịch sử
+                        break
+                    if item is self._stop:
+                        running = False
+                        break
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(item)
+                
+                try:
+                    if batch:
+                        conn.executemany(
+                            'INSERT INTO search_history (query_file, results, search_time) VALUES (?, ?, ?)',
+                            batch
+                        )
+                    if time.monotonic() - last_prune >= self.prune_interval or not running:
+                        prune_search_history(conn, self.max_rows, self.max_age_days)
+                        last_prune = time.monotonic()
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Lỗi lưu lịch sử: {e}")
+        finally:
+            conn.close()
+
+
+def prune_search_history(conn, max_rows=None, max_age_days=None):
+    """
+    Xóa lịch sử tìm kiếm cũ theo chính sách giữ lại (không commit).
+    
+    Returns:
+        int: Số dòng đã xóa
+    """
+    deleted = 0
+    
+    if max_age_days is not None:
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        deleted += conn.execute(
+            'DELETE FROM search_history WHERE search_time < ?', (cutoff,)
+        ).rowcount
+    
+    if max_rows is not None:
+        deleted += conn.execute('''
+            DELETE FROM search_history WHERE id <= (
+                SELECT id FROM search_history ORDER BY id DESC LIMIT 1 OFFSET ?
+            )
+        ''', (max_rows,)).rowcount
+    
+    return deleted
 
 
 class DatabaseManager:
+    
+    SONG_COLUMNS = [
+        'id', 'file_path', 'file_name', 'title', 'artist', 'duration',
+        'sample_rate', 'classification', 'feature_vector', 'ste_data',
+        'zcr_data', 'ste_mean', 'ste_std', 'ste_max', 'ste_min',
+        'zcr_mean', 'zcr_std', 'zcr_max', 'zcr_min', 'created_at', 'updated_at',
+        'feature_version', 'extraction_config', 'channel_summary'
+    ]
+    
+    # Các cột được tính từ file âm thanh (ghi lại khi tính lại đặc trưng)
+    FEATURE_COLUMNS = [
+        'duration', 'sample_rate', 'classification', 'feature_vector',
+        'ste_data', 'zcr_data', 'ste_mean', 'ste_std', 'ste_max', 'ste_min',
+        'zcr_mean', 'zcr_std', 'zcr_max', 'zcr_min', 'feature_version', 'extraction_config',
+        'channel_summary'
+    ]
 
-    def __init__(self, db_path="audio_database.db"):
+    def __init__(self, db_path="audio_database.db", series_dtype=np.float64,
+                 async_history=True, history_max_rows=10000, history_max_age_days=90,
+                 series_codec='q16'):
      
+        if series_codec not in SERIES_CODECS:
+            raise ValueError(f"Dinh dang chuoi khong ho tro: {series_codec}")
+        
         self.db_path = db_path
+        # Kiểu dữ liệu khi đọc chuỗi STE/ZCR (np.float32 để giảm một nửa bộ nhớ)
+        self.series_dtype = series_dtype
+        # Định dạng khi ghi chuỗi STE/ZCR; khi đọc, cả hai định dạng đều được nhận
+        self.series_codec = series_codec
+        # Lịch sử tìm kiếm: ghi nền theo lô (database trong bộ nhớ phải ghi trực tiếp)
+        self.async_history = async_history and db_path != ':memory:'
+        self.history_max_rows = history_max_rows
+        self.history_max_age_days = history_max_age_days
+        self._history_writer = None
         self.conn = None
         self.cursor = None
         self._connect()
@@ -50,9 +310,13 @@ class DatabaseManager:
                 zcr_max REAL,
                 zcr_min REAL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                feature_version TEXT,
+                extraction_config TEXT,
+                channel_summary TEXT
             )
         ''')
+        self._migrate_songs_table()
         
         # Bảng lưu lịch sử tìm kiếm
         self.cursor.execute('''
@@ -64,52 +328,419 @@ class DatabaseManager:
             )
         ''')
         
+        # Bảng lưu chuỗi STE/ZCR đã giảm mẫu (8x, 64x) để xem tổng quan nhanh
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_series_lod (
+                song_id INTEGER NOT NULL,
+                factor INTEGER NOT NULL,
+                num_points INTEGER NOT NULL,
+                ste_data TEXT,
+                zcr_data TEXT,
+                PRIMARY KEY (song_id, factor)
+            )
+        ''')
+        
+        # Tiến độ các lượt tính lại đặc trưng (một dòng cho mỗi phiên bản đích)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recompute_jobs (
+                job_id TEXT PRIMARY KEY,
+                extraction_config TEXT,
+                status TEXT,
+                last_song_id INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        ''')
+        
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recompute_failures (
+                job_id TEXT NOT NULL,
+                song_id INTEGER NOT NULL,
+                error TEXT,
+                PRIMARY KEY (job_id, song_id)
+            )
+        ''')
+        
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_songs_feature_version ON songs (feature_version)'
+        )
+        
+        # Top-K bài hát gần nhất của từng bài (tính sẵn cho gợi ý)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_neighbors (
+                song_id INTEGER NOT NULL,
+                rank INTEGER NOT NULL,
+                neighbor_id INTEGER NOT NULL,
+                distance REAL NOT NULL,
+                PRIMARY KEY (song_id, rank)
+            )
+        ''')
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_song_neighbors_neighbor ON song_neighbors (neighbor_id)'
+        )
+        
+        # Danh sách đã tính nhưng rỗng (bài duy nhất của phiên bản) được lưu bằng một dòng
+        # đánh dấu rank = 0 (neighbor_id = song_id), để không bị coi là chưa tính
+        
+        # Các bài hát cần tính lại danh sách láng giềng
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS neighbor_pending (
+                song_id INTEGER PRIMARY KEY
+            )
+        ''')
+        
+        # Thông tin chung của thư viện (vd. bộ đếm thế hệ cho cache tìm kiếm)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS library_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO library_meta (key, value) VALUES ('generation', 0)"
+        )
+        
+        # Nhật ký các bài hát có vector đặc trưng thay đổi (thêm/tính lại/xóa), để
+        # FeatureStore chỉ đọc lại các bài này thay vì quét cả bảng songs
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feature_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                song_id INTEGER NOT NULL
+            )
+        ''')
+        # Mốc nhật ký đã áp dụng của từng nơi đọc bền vững (vd. kho FeatureStore)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feature_change_readers (
+                name TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        ''')
+        # seq lớn nhất đã bị xóa khỏi nhật ký
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO library_meta (key, value) VALUES ('feature_changes_pruned', 0)"
+        )
+        
         self.conn.commit()
     
+    def _migrate_songs_table(self):
+        """Thêm các cột mới vào bảng songs của database tạo bởi phiên bản cũ."""
+        self.cursor.execute('PRAGMA table_info(songs)')
+        existing = {row[1] for row in self.cursor.fetchall()}
+        
+        for name in ('feature_version', 'extraction_config', 'channel_summary'):
+            if name not in existing:
+                self.cursor.execute(f'ALTER TABLE songs ADD COLUMN {name} TEXT')
+    
+    def _bump_generation(self):
+        """Tăng bộ đếm thế hệ của thư viện (không commit, đi cùng transaction thay đổi)."""
+        self.cursor.execute(
+            "UPDATE library_meta SET value = value + 1 WHERE key = 'generation'"
+        )
+    
+    def _log_feature_change(self, song_id):
+        """Ghi song_id vào nhật ký thay đổi đặc trưng (không commit)."""
+        self.cursor.execute('INSERT INTO feature_changes (song_id) VALUES (?)', (song_id,))
+        seq = self.cursor.lastrowid
+        if seq > FEATURE_CHANGE_LOG_MAX_ROWS:
+            self._prune_feature_changes(seq - FEATURE_CHANGE_LOG_MAX_ROWS)
+    
+    def _prune_feature_changes(self, up_to_seq):
+        """Xóa các dòng nhật ký có seq <= up_to_seq và ghi lại mốc đã xóa (không commit)."""
+        self.cursor.execute('DELETE FROM feature_changes WHERE seq <= ?', (up_to_seq,))
+        if self.cursor.rowcount > 0:
+            self.cursor.execute(
+                "UPDATE library_meta SET value = MAX(value, ?) WHERE key = 'feature_changes_pruned'",
+                (up_to_seq,)
+            )
+    
+    def mark_feature_changes_applied(self, reader, seq):
+        """
+        Ghi nhận nơi đọc reader đã áp dụng nhật ký tới seq, rồi xóa các dòng mà mọi
+        nơi đọc đã đăng ký đều đã áp dụng.
+        
+        Quy tắc giữ lại: một dòng được giữ cho tới khi mọi nơi đọc đăng ký ở đây đã
+        áp dụng nó, nhưng không quá FEATURE_CHANGE_LOG_MAX_ROWS dòng mới nhất. Nơi đọc
+        không đăng ký (vd. chỉ mục nén trong bộ nhớ) hoặc bị tụt lại quá xa sẽ nhận
+        None từ get_feature_changes và phải dựng lại từ bảng songs.
+        """
+        self.cursor.execute(
+            'INSERT OR REPLACE INTO feature_change_readers (name, seq) VALUES (?, ?)', (reader, seq)
+        )
+        self.cursor.execute('SELECT MIN(seq) FROM feature_change_readers')
+        self._prune_feature_changes(self.cursor.fetchone()[0])
+        self.conn.commit()
+    
+    def get_feature_change_seq(self):
+        """Số thứ tự của thay đổi đặc trưng mới nhất (0 nếu chưa có)."""
+        # Bộ đếm AUTOINCREMENT: không giảm khi các dòng cũ đã bị xóa khỏi nhật ký
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'feature_changes'")
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+    
+    def get_feature_changes(self, after_seq, until_seq):
+        """
+        Các bài hát có vector đặc trưng thay đổi trong khoảng (after_seq, until_seq].
+        
+        Returns:
+            np.ndarray: id int64 (không trùng, tăng dần), hoặc None nếu một phần của
+                khoảng đã bị xóa khỏi nhật ký (xem mark_feature_changes_applied)
+        """
+        self.cursor.execute("SELECT value FROM library_meta WHERE key = 'feature_changes_pruned'")
+        if after_seq < self.cursor.fetchone()[0]:
+            return None
+        
+        self.cursor.execute(
+            'SELECT DISTINCT song_id FROM feature_changes WHERE seq > ? AND seq <= ? ORDER BY song_id',
+            (after_seq, until_seq)
+        )
+        return np.array([row[0] for row in self.cursor.fetchall()], dtype=np.int64)
+    
+    def get_library_generation(self):
+        """
+        Bộ đếm thế hệ của thư viện, tăng mỗi khi bài hát được thêm/sửa/xóa.
+        
+        Được lưu trong database nên cũng thấy được thay đổi từ kết nối khác
+        (vd. RecomputeJob).
+        """
+        self.cursor.execute("SELECT value FROM library_meta WHERE key = 'generation'")
+        return self.cursor.fetchone()[0]
+    
+    def _invalidate_neighbors(self, song_id, keep_pending=True):
+        """
+        Bỏ danh sách láng giềng của song_id và đánh dấu tính lại các bài đang
+        dùng nó làm láng giềng (không commit).
+        """
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO neighbor_pending (song_id)
+            SELECT DISTINCT song_id FROM song_neighbors WHERE neighbor_id = ? AND song_id != ?
+        ''', (song_id, song_id))
+        self.cursor.execute('DELETE FROM song_neighbors WHERE song_id = ?', (song_id,))
+        
+        if keep_pending:
+            self.cursor.execute('INSERT OR IGNORE INTO neighbor_pending (song_id) VALUES (?)', (song_id,))
+        else:
+            self.cursor.execute('DELETE FROM neighbor_pending WHERE song_id = ?', (song_id,))
+    
+    def _feature_columns(self, processed_data):
+        """Các giá trị cột đặc trưng của bảng songs theo thứ tự FEATURE_COLUMNS."""
+        features = processed_data['features']
+        config = processed_data.get('extraction_config')
+        # Thống kê từng kênh (chỉ có khi channel_mode khác 'mono')
+        channels = features.get('channels')
+        
+        return (
+            features['duration'], processed_data['sample_rate'],
+            processed_data['classification'],
+            json.dumps(processed_data['feature_vector'].tolist()),
+            self._encode_series(features['ste'], log_scale=True), self._encode_series(features['zcr']),
+            features['ste_mean'], features['ste_std'],
+            features['ste_max'], features['ste_min'],
+            features['zcr_mean'], features['zcr_std'],
+            features['zcr_max'], features['zcr_min'],
+            processed_data.get('feature_version'),
+            json.dumps(config, sort_keys=True) if config is not None else None,
+            json.dumps(channels) if channels else None
+        )
+    
     def add_song(self, file_path, processed_data, title=None, artist=None):
 
         try:
             features = processed_data['features']
-            feature_vector = processed_data['feature_vector']
             
             file_name = os.path.basename(file_path)
             if title is None:
                 title = os.path.splitext(file_name)[0]
             
-            # Chuyển đổi các mảng numpy thành JSON để lưu trữ
-            feature_vector_json = json.dumps(feature_vector.tolist())
-            ste_data_json = json.dumps(features['ste'].tolist())
-            zcr_data_json = json.dumps(features['zcr'].tolist())
-            
-            self.cursor.execute('''
-                INSERT OR REPLACE INTO songs (
-                    file_path, file_name, title, artist, duration, sample_rate,
-                    classification, feature_vector, ste_data, zcr_data,
-                    ste_mean, ste_std, ste_max, ste_min,
-                    zcr_mean, zcr_std, zcr_max, zcr_min, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                file_path, file_name, title, artist,
-                features['duration'], processed_data['sample_rate'],
-                processed_data['classification'],
-                feature_vector_json, ste_data_json, zcr_data_json,
-                features['ste_mean'], features['ste_std'],
-                features['ste_max'], features['ste_min'],
-                features['zcr_mean'], features['zcr_std'],
-                features['zcr_max'], features['zcr_min'],
-                datetime.now()
-            ))
-            
-            self.conn.commit()
-            return self.cursor.lastrowid
+            with profiling.stage('db.add_song'):
+                # Các mảng numpy được chuyển thành JSON để lưu trữ
+                with profiling.stage('db.encode'):
+                    values = self._feature_columns(processed_data)
+                
+                with profiling.stage('db.insert'):
+                    # INSERT OR REPLACE tạo id mới, nên xóa các mức giảm mẫu của bản ghi cũ
+                    self.cursor.execute('SELECT id FROM songs WHERE file_path = ?', (file_path,))
+                    old_row = self.cursor.fetchone()
+                    if old_row:
+                        self.cursor.execute('DELETE FROM song_series_lod WHERE song_id = ?', (old_row[0],))
+                        self._invalidate_neighbors(old_row[0], keep_pending=False)
+                        self._log_feature_change(old_row[0])
+                    
+                    columns = ['file_path', 'file_name', 'title', 'artist'] + self.FEATURE_COLUMNS + ['updated_at']
+                    self.cursor.execute(f'''
+                        INSERT OR REPLACE INTO songs ({', '.join(columns)})
+                        VALUES ({', '.join('?' * len(columns))})
+                    ''', (file_path, file_name, title, artist) + values + (datetime.now(),))
+                    song_id = self.cursor.lastrowid
+                
+                with profiling.stage('db.series_lod'):
+                    self._save_series_lod(song_id, features['ste'], features['zcr'])
+                self.cursor.execute('INSERT OR IGNORE INTO neighbor_pending (song_id) VALUES (?)', (song_id,))
+                self._log_feature_change(song_id)
+                self._bump_generation()
+                
+                with profiling.stage('db.commit'):
+                    self.conn.commit()
+            return song_id
             
         except Exception as e:
+            # Bỏ các câu lệnh đã chạy (xóa LOD, nhật ký, thế hệ...) để lần commit sau không ghi dở dang
+            self.conn.rollback()
             print(f"Lỗi khi thêm bài hát: {e}")
             return None
     
-    def get_song_by_id(self, song_id):
-
-        self.cursor.execute('SELECT * FROM songs WHERE id = ?', (song_id,))
+    def update_song_features(self, song_id, processed_data, commit=True):
+        """
+        Ghi đè các cột đặc trưng của một bài hát (giữ nguyên id, tên, nghệ sĩ).
+        
+        Args:
+            song_id (int): ID bài hát
+            processed_data (dict): Kết quả process_audio_file
+            commit (bool): False để gộp nhiều lần cập nhật vào một transaction
+        
+        Returns:
+            bool: True nếu bài hát tồn tại và được cập nhật
+        """
+        assignments = ', '.join(f'{name} = ?' for name in self.FEATURE_COLUMNS)
+        self.cursor.execute(
+            f'UPDATE songs SET {assignments}, updated_at = ? WHERE id = ?',
+            self._feature_columns(processed_data) + (datetime.now(), song_id)
+        )
+        if self.cursor.rowcount == 0:
+            return False
+        
+        features = processed_data['features']
+        self.cursor.execute('DELETE FROM song_series_lod WHERE song_id = ?', (song_id,))
+        self._save_series_lod(song_id, features['ste'], features['zcr'])
+        self._invalidate_neighbors(song_id)
+        self._log_feature_change(song_id)
+        self._bump_generation()
+        
+        if commit:
+            self.conn.commit()
+        return True
+    
+    def _save_series_lod(self, song_id, ste_values, zcr_values):
+        """Tính và lưu các mức giảm mẫu của chuỗi STE/ZCR (không commit)."""
+        rows = []
+        for factor in SERIES_LOD_FACTORS:
+            ste_lod = _downsample_series(ste_values, factor)
+            zcr_lod = _downsample_series(zcr_values, factor)
+            rows.append((
+                song_id, factor, len(ste_lod),
+                self._encode_series(ste_lod, log_scale=True), self._encode_series(zcr_lod)
+            ))
+        
+        self.cursor.executemany('''
+            INSERT OR REPLACE INTO song_series_lod
+                (song_id, factor, num_points, ste_data, zcr_data)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+    
+    def build_series_lod(self):
+        """
+        Tạo các mức giảm mẫu cho những bài hát chưa có (dữ liệu thêm trước khi có bảng LOD).
+        
+        Returns:
+            int: Số bài hát được bổ sung
+        """
+        self.cursor.execute('''
+            SELECT id, ste_data, zcr_data FROM songs
+            WHERE id NOT IN (SELECT DISTINCT song_id FROM song_series_lod)
+        ''')
+        rows = self.cursor.fetchall()
+        
+        for song_id, ste_json, zcr_json in rows:
+            self._save_series_lod(
+                song_id,
+                self._decode_series(ste_json),
+                self._decode_series(zcr_json)
+            )
+        
+        self.conn.commit()
+        return len(rows)
+    
+    def get_series_lod(self, song_id, factor=64):
+        """
+        Đọc chuỗi STE/ZCR ở một mức chi tiết.
+        
+        Args:
+            song_id (int): ID bài hát
+            factor (int): Hệ số giảm mẫu (1 là dữ liệu gốc, hoặc một giá trị trong SERIES_LOD_FACTORS)
+        
+        Returns:
+            dict: {'factor', 'ste_data', 'zcr_data'} hoặc None nếu không có
+        """
+        if factor == 1:
+            self.cursor.execute('SELECT ste_data, zcr_data FROM songs WHERE id = ?', (song_id,))
+        else:
+            self.cursor.execute(
+                'SELECT ste_data, zcr_data FROM song_series_lod WHERE song_id = ? AND factor = ?',
+                (song_id, factor)
+            )
+        row = self.cursor.fetchone()
+        
+        if row is None:
+            if factor != 1 and self.build_series_lod() > 0:
+                return self.get_series_lod(song_id, factor)
+            return None
+        
+        return {
+            'factor': factor,
+            'ste_data': self._decode_series(row[0]),
+            'zcr_data': self._decode_series(row[1])
+        }
+    
+    def get_series_overview(self, song_id, max_points=2000):
+        """
+        Đọc chuỗi STE/ZCR ở mức chi tiết cao nhất có không quá max_points điểm.
+        
+        Mức gốc chỉ được đọc khi bản thân nó đã đủ ngắn; nếu mọi mức đều dài hơn
+        max_points thì trả về mức thô nhất.
+        """
+        self.cursor.execute(
+            'SELECT factor, num_points FROM song_series_lod WHERE song_id = ? ORDER BY factor',
+            (song_id,)
+        )
+        levels = self.cursor.fetchall()
+        
+        if not levels:
+            if self.build_series_lod() == 0:
+                return self.get_series_lod(song_id, 1)
+            return self.get_series_overview(song_id, max_points)
+        
+        # Ước lượng số điểm của mức gốc từ mức giảm mẫu mịn nhất
+        factor, num_points = levels[0]
+        candidates = [(1, num_points * factor)] + levels
+        
+        chosen = levels[-1][0]
+        for factor, num_points in candidates:
+            if num_points <= max_points:
+                chosen = factor
+                break
+        
+        return self.get_series_lod(song_id, chosen)
+    
+    def _song_columns(self, include_series):
+        """Danh sách cột cho SELECT; bỏ qua (NULL) các chuỗi STE/ZCR nếu không cần."""
+        if include_series:
+            return '*'
+        return ', '.join(
+            f'NULL AS {name}' if name in ('ste_data', 'zcr_data') else name
+            for name in self.SONG_COLUMNS
+        )
+    
+    def get_song_by_id(self, song_id, include_series=True):
+        """
+        Lấy thông tin bài hát theo ID.
+        
+        Với include_series=False, ste_data/zcr_data không được đọc (trả về None);
+        dùng get_series_lod/get_series_overview để lấy chuỗi ở mức chi tiết cần thiết.
+        """
+        columns = self._song_columns(include_series)
+        self.cursor.execute(f'SELECT {columns} FROM songs WHERE id = ?', (song_id,))
         row = self.cursor.fetchone()
         
         if row:
@@ -133,9 +764,10 @@ class DatabaseManager:
             return self._row_to_dict(row)
         return None
     
-    def get_all_songs(self):
-
-        self.cursor.execute('SELECT * FROM songs ORDER BY title')
+    def get_all_songs(self, include_series=True):
+        """Tất cả bài hát theo tên; include_series=False để không đọc chuỗi STE/ZCR."""
+        columns = self._song_columns(include_series)
+        self.cursor.execute(f'SELECT {columns} FROM songs ORDER BY title')
         rows = self.cursor.fetchall()
         
         return [self._row_to_dict(row) for row in rows]
@@ -164,6 +796,7 @@ class DatabaseManager:
         
         try:
             self.cursor.execute(query, values)
+            self._bump_generation()
             self.conn.commit()
             return True
         except Exception as e:
@@ -174,9 +807,16 @@ class DatabaseManager:
 
         try:
             self.cursor.execute('DELETE FROM songs WHERE id = ?', (song_id,))
+            deleted = self.cursor.rowcount > 0
+            self.cursor.execute('DELETE FROM song_series_lod WHERE song_id = ?', (song_id,))
+            if deleted:
+                self._invalidate_neighbors(song_id, keep_pending=False)
+                self._log_feature_change(song_id)
+                self._bump_generation()
             self.conn.commit()
-            return self.cursor.rowcount > 0
+            return deleted
         except Exception as e:
+            self.conn.rollback()
             print(f"Lỗi khi xóa: {e}")
             return False
     
@@ -200,9 +840,24 @@ class DatabaseManager:
         rows = self.cursor.fetchall()
         return [self._row_to_dict(row) for row in rows]
     
-    def get_all_feature_vectors(self):
-
-        self.cursor.execute('SELECT id, feature_vector FROM songs')
+    def _version_filter(self, feature_version, include_legacy):
+        """Mệnh đề WHERE (kèm tham số) chọn bản ghi theo phiên bản đặc trưng."""
+        if feature_version is None:
+            return '', ()
+        if include_legacy:
+            return ' WHERE feature_version = ? OR feature_version IS NULL', (feature_version,)
+        return ' WHERE feature_version = ?', (feature_version,)
+    
+    def get_all_feature_vectors(self, feature_version=None, include_legacy=False):
+        """
+        Đọc (id, vector đặc trưng) của các bài hát.
+        
+        Args:
+            feature_version (str): Chỉ lấy bản ghi của phiên bản này (None: lấy tất cả)
+            include_legacy (bool): Lấy thêm các bản ghi cũ chưa gắn phiên bản
+        """
+        where, params = self._version_filter(feature_version, include_legacy)
+        self.cursor.execute(f'SELECT id, feature_vector FROM songs{where}', params)
         rows = self.cursor.fetchall()
         
         result = []
@@ -213,18 +868,329 @@ class DatabaseManager:
         
         return result
     
-    def save_search_history(self, query_file, results):
-
-        try:
-            results_json = json.dumps(results)
+    def get_feature_ids(self, feature_version=None, include_legacy=False):
+        """Id (int64, tăng dần) của các bài hát theo phiên bản đặc trưng, không đọc vector."""
+        where, params = self._version_filter(feature_version, include_legacy)
+        self.cursor.execute(f'SELECT id FROM songs{where} ORDER BY id', params)
+        return np.array([row[0] for row in self.cursor.fetchall()], dtype=np.int64)
+    
+    def get_feature_vectors_by_ids(self, song_ids, chunk_size=500, feature_version=None,
+                                   include_legacy=False):
+        """
+        Vector đặc trưng của các id cho trước: [(id, vector)] theo id tăng dần.
+        
+        Id không tồn tại (hoặc không thuộc feature_version, nếu có) bị bỏ qua.
+        """
+        where, params = self._version_filter(feature_version, include_legacy)
+        # Ghép điều kiện phiên bản sau điều kiện id
+        where = f' AND ({where[len(" WHERE "):]})' if where else ''
+        
+        result = []
+        song_ids = [int(song_id) for song_id in song_ids]
+        for start in range(0, len(song_ids), chunk_size):
+            chunk = song_ids[start:start + chunk_size]
             self.cursor.execute(
-                'INSERT INTO search_history (query_file, results) VALUES (?, ?)',
-                (query_file, results_json)
+                f"SELECT id, feature_vector FROM songs WHERE id IN ({', '.join('?' * len(chunk))}){where}",
+                tuple(chunk) + params
+            )
+            result.extend((row[0], np.array(json.loads(row[1]))) for row in self.cursor.fetchall())
+        result.sort(key=lambda item: item[0])
+        return result
+    
+    def has_pending_neighbors(self):
+        """Có bài hát nào đang chờ tính lại láng giềng không."""
+        self.cursor.execute('SELECT 1 FROM neighbor_pending LIMIT 1')
+        return self.cursor.fetchone() is not None
+    
+    def get_pending_neighbor_songs(self):
+        """Các bài hát cần tính lại láng giềng: [(id, feature_version)]."""
+        self.cursor.execute('''
+            SELECT songs.id, songs.feature_version FROM neighbor_pending
+            JOIN songs ON songs.id = neighbor_pending.song_id
+            ORDER BY songs.id
+        ''')
+        return self.cursor.fetchall()
+    
+    def mark_neighbors_pending(self, song_ids=None):
+        """Đánh dấu tính lại láng giềng cho các bài hát (None: cả thư viện)."""
+        if song_ids is None:
+            self.cursor.execute('INSERT OR IGNORE INTO neighbor_pending (song_id) SELECT id FROM songs')
+        else:
+            self.cursor.executemany(
+                'INSERT OR IGNORE INTO neighbor_pending (song_id) VALUES (?)',
+                [(int(song_id),) for song_id in song_ids]
+            )
+        self.conn.commit()
+    
+    def get_neighbor_kth_distances(self):
+        """{song_id: (số láng giềng đã lưu, khoảng cách xa nhất trong danh sách)}."""
+        # Danh sách rỗng (chỉ có dòng đánh dấu) cho (0, None)
+        self.cursor.execute('''
+            SELECT song_id, SUM(rank > 0), MAX(CASE WHEN rank > 0 THEN distance END)
+            FROM song_neighbors GROUP BY song_id
+        ''')
+        return {row[0]: (row[1], row[2]) for row in self.cursor.fetchall()}
+    
+    def save_neighbors(self, neighbor_lists, done_ids):
+        """
+        Ghi danh sách láng giềng mới và xóa các bài đã xử lý khỏi hàng đợi (một transaction).
+        
+        Args:
+            neighbor_lists (dict): {song_id: [(neighbor_id, distance)]} theo thứ tự gần -> xa;
+                danh sách rỗng được lưu bằng dòng đánh dấu rank = 0
+            done_ids (list): Các id đã lấy từ neighbor_pending
+        """
+        try:
+            self.cursor.executemany(
+                'DELETE FROM song_neighbors WHERE song_id = ?',
+                [(int(song_id),) for song_id in neighbor_lists]
+            )
+            self.cursor.executemany(
+                'INSERT INTO song_neighbors (song_id, rank, neighbor_id, distance) VALUES (?, ?, ?, ?)',
+                [
+                    (int(song_id), rank, int(neighbor_id), float(distance))
+                    for song_id, neighbors in neighbor_lists.items()
+                    for rank, (neighbor_id, distance) in (enumerate(neighbors, 1) if neighbors
+                                                          else [(0, (song_id, 0.0))])
+                ]
+            )
+            self.cursor.executemany(
+                'DELETE FROM neighbor_pending WHERE song_id = ?',
+                [(int(song_id),) for song_id in done_ids]
             )
             self.conn.commit()
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Lỗi khi lưu láng giềng: {e}")
+            return False
+    
+    def get_neighbors(self, song_id, limit=None):
+        """Láng giềng đã tính sẵn của một bài hát: [(neighbor_id, distance)], gần nhất trước."""
+        query = 'SELECT neighbor_id, distance FROM song_neighbors WHERE song_id = ? AND rank > 0 ORDER BY rank'
+        params = [song_id]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall()
+    
+    def has_neighbor_list(self, song_id):
+        """Danh sách láng giềng của bài hát đã được tính chưa (kể cả khi rỗng)."""
+        self.cursor.execute('SELECT 1 FROM song_neighbors WHERE song_id = ? LIMIT 1', (song_id,))
+        return self.cursor.fetchone() is not None
+    
+    def get_history_marker(self):
+        """(id lớn nhất, số dòng) của search_history, đổi khi lịch sử được ghi hoặc dọn."""
+        self.cursor.execute('SELECT MAX(id), COUNT(*) FROM search_history')
+        return self.cursor.fetchone()
+    
+    def get_history_counts(self):
+        """Số lần mỗi bài hát xuất hiện trong kết quả tìm kiếm đã lưu: {song_id: count}."""
+        self.cursor.execute('SELECT results FROM search_history')
+        
+        counts = {}
+        for (data,) in self.cursor.fetchall():
+            for song_id, _ in decode_history_results(data):
+                counts[song_id] = counts.get(song_id, 0) + 1
+        return counts
+    
+    def get_classification_inputs(self):
+        """
+        Đọc các cột dùng để phân loại của toàn bộ thư viện dưới dạng mảng.
+        
+        Returns:
+            tuple: (ids, ste_means, zcr_means, classifications)
+        """
+        self.cursor.execute('SELECT id, ste_mean, zcr_mean, classification FROM songs ORDER BY id')
+        rows = self.cursor.fetchall()
+        
+        if not rows:
+            empty = np.zeros(0)
+            return np.zeros(0, dtype=np.int64), empty, empty, np.zeros(0, dtype=object)
+        
+        ids, ste_means, zcr_means, classifications = zip(*rows)
+        return (
+            np.array(ids, dtype=np.int64),
+            np.array(ste_means, dtype=np.float64),
+            np.array(zcr_means, dtype=np.float64),
+            np.array(classifications, dtype=object)
+        )
+    
+    def update_classifications(self, updates):
+        """
+        Ghi phân loại mới cho nhiều bài hát trong một transaction.
+        
+        Args:
+            updates (list): Các cặp (song_id, classification)
+        
+        Returns:
+            int: Số bài hát được cập nhật, hoặc None nếu lỗi
+        """
+        now = datetime.now()
+        rows = [(classification, now, int(song_id)) for song_id, classification in updates]
+        
+        try:
+            self.cursor.executemany(
+                'UPDATE songs SET classification = ?, updated_at = ? WHERE id = ?', rows
+            )
+            self._bump_generation()
+            self.conn.commit()
+            return len(rows)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Lỗi khi cập nhật phân loại: {e}")
+            return None
+    
+    def get_feature_versions(self):
+        """Số bài hát theo phiên bản đặc trưng (None: bản ghi cũ chưa gắn phiên bản)."""
+        self.cursor.execute('SELECT feature_version, COUNT(*) FROM songs GROUP BY feature_version')
+        return dict(self.cursor.fetchall())
+    
+    def get_stale_songs(self, feature_version, after_id=0, limit=None):
+        """
+        Các bài hát chưa được tính theo phiên bản feature_version, theo thứ tự id.
+        
+        Returns:
+            list: [(id, file_path)] với id > after_id
+        """
+        query = '''
+            SELECT id, file_path FROM songs
+            WHERE (feature_version IS NULL OR feature_version != ?) AND id > ?
+            ORDER BY id
+        '''
+        params = [feature_version, after_id]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall()
+    
+    def count_stale_songs(self, feature_version, after_id=0):
+        """Số bài hát chưa được tính theo phiên bản feature_version (id > after_id)."""
+        self.cursor.execute('''
+            SELECT COUNT(*) FROM songs
+            WHERE (feature_version IS NULL OR feature_version != ?) AND id > ?
+        ''', (feature_version, after_id))
+        return self.cursor.fetchone()[0]
+    
+    def get_recompute_job(self, job_id):
+        """Tiến độ đã lưu của một lượt tính lại (dict) hoặc None."""
+        self.cursor.execute('''
+            SELECT job_id, extraction_config, status, last_song_id, processed,
+                   failed, total, started_at, updated_at
+            FROM recompute_jobs WHERE job_id = ?
+        ''', (job_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        
+        keys = ['job_id', 'extraction_config', 'status', 'last_song_id', 'processed',
+                'failed', 'total', 'started_at', 'updated_at']
+        job = dict(zip(keys, row))
+        if job['extraction_config']:
+            job['extraction_config'] = json.loads(job['extraction_config'])
+        return job
+    
+    def save_recompute_job(self, job, commit=True):
+        """Ghi tiến độ lượt tính lại (dict cùng khóa với get_recompute_job)."""
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO recompute_jobs (
+                job_id, extraction_config, status, last_song_id, processed,
+                failed, total, started_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            job['job_id'], json.dumps(job.get('extraction_config'), sort_keys=True),
+            job['status'], job['last_song_id'], job['processed'],
+            job['failed'], job['total'], job.get('started_at'), datetime.now()
+        ))
+        if commit:
+            self.conn.commit()
+    
+    def record_recompute_failure(self, job_id, song_id, error):
+        """Ghi lại bài hát không tính lại được (không commit)."""
+        self.cursor.execute(
+            'INSERT OR REPLACE INTO recompute_failures (job_id, song_id, error) VALUES (?, ?, ?)',
+            (job_id, song_id, str(error))
+        )
+    
+    def get_recompute_failures(self, job_id):
+        """Danh sách (song_id, lỗi) của một lượt tính lại."""
+        self.cursor.execute(
+            'SELECT song_id, error FROM recompute_failures WHERE job_id = ? ORDER BY song_id',
+            (job_id,)
+        )
+        return self.cursor.fetchall()
+    
+    def save_search_history(self, query_file, results):
+        """
+        Lưu một lần tìm kiếm: chỉ giữ id bài hát và điểm của các kết quả.
+        
+        Với async_history, bản ghi được đưa vào hàng đợi và ghi nền theo lô nên
+        không làm chậm lượt tìm kiếm.
+        """
+        try:
+            row = (query_file, encode_history_results(results), datetime.now())
+            
+            if self.async_history:
+                if self._history_writer is None:
+                    self._history_writer = HistoryWriter(
+                        self.db_path, self.history_max_rows, self.history_max_age_days
+                    )
+                self._history_writer.submit(*row)
+            else:
+                self.cursor.execute(
+                    'INSERT INTO search_history (query_file, results, search_time) VALUES (?, ?, ?)',
+                    row
+                )
+                self.conn.commit()
         except Exception as e:
             print(f"Lỗi lưu lịch sử: {e}")
     
+    def flush_search_history(self):
+        """Đợi các bản ghi lịch sử đang chờ được ghi xong."""
+        if self._history_writer is not None:
+            self._history_writer.close()
+            self._history_writer = None
+    
+    def get_search_history(self, limit=50):
+        """
+        Các lần tìm kiếm gần nhất.
+        
+        Returns:
+            list: [{'id', 'query_file', 'results': [(song_id, score)], 'search_time'}]
+        """
+        self.cursor.execute(
+            'SELECT id, query_file, results, search_time FROM search_history ORDER BY id DESC LIMIT ?',
+            (limit,)
+        )
+        return [
+            {
+                'id': row[0],
+                'query_file': row[1],
+                'results': decode_history_results(row[2]),
+                'search_time': row[3]
+            }
+            for row in self.cursor.fetchall()
+        ]
+    
+    def prune_search_history(self, max_rows=None, max_age_days=None):
+        """
+        Xóa lịch sử cũ ngay lập tức (mặc định theo chính sách của đối tượng).
+        
+        Returns:
+            int: Số dòng đã xóa
+        """
+        self.flush_search_history()
+        deleted = prune_search_history(
+            self.conn,
+            self.history_max_rows if max_rows is None else max_rows,
+            self.history_max_age_days if max_age_days is None else max_age_days
+        )
+        self.conn.commit()
+        return deleted
+    
     def get_statistics(self):
       
         stats = {}
@@ -248,29 +1214,130 @@ class DatabaseManager:
         
         return stats
     
+    def _encode_series(self, values, log_scale=False):
+        """
+        Chuỗi STE/ZCR -> bytes nén (series_codec='q16') hoặc JSON.
+        
+        Chuỗi có NaN/inf luôn được ghi JSON (NaN/Infinity, json.loads đọc được).
+        Chuỗi float32 hữu hạn được ghi JSON ở dạng ngắn nhất của float32.
+        """
+        if self.series_codec == 'q16':
+            data = encode_series(values, log_scale)
+            if data is not None:
+                return data
+        
+        values = np.asarray(values)
+        if values.dtype == np.float32 and np.all(np.isfinite(values)):
+            return '[' + ','.join(map(str, values)) + ']'
+        return json.dumps(values.astype(np.float64).tolist())
+    
+    def _decode_series(self, data):
+        """bytes nén hoặc JSON -> mảng numpy theo series_dtype."""
+        return decode_series(data, self.series_dtype)
+    
+    def compress_series(self, batch_size=200):
+        """
+        Ghi lại các chuỗi STE/ZCR còn ở dạng JSON theo series_codec hiện tại
+        (gồm cả bảng giảm mẫu). Chạy VACUUM sau đó để thu hồi dung lượng file.
+        
+        Returns:
+            int: Số dòng đã ghi lại
+        """
+        if self.series_codec == 'json':
+            return 0
+        
+        converted = 0
+        for table in ('songs', 'song_series_lod'):
+            # Duyệt theo rowid tăng dần: dòng không nén được (có NaN) không bị đọc lại
+            last_rowid = 0
+            while True:
+                self.cursor.execute(f'''
+                    SELECT rowid, ste_data, zcr_data FROM {table}
+                    WHERE rowid > ? AND (typeof(ste_data) = 'text' OR typeof(zcr_data) = 'text')
+                    ORDER BY rowid LIMIT ?
+                ''', (last_rowid, batch_size))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                
+                updates = [
+                    (self._encode_series(self._decode_series(ste_data), log_scale=True) if ste_data else ste_data,
+                     self._encode_series(self._decode_series(zcr_data)) if zcr_data else zcr_data,
+                     rowid)
+                    for rowid, ste_data, zcr_data in rows
+                ]
+                # Bỏ các dòng không đổi được gì (chuỗi có NaN vẫn ở dạng JSON)
+                updates = [item for item, row in zip(updates, rows)
+                           if any(isinstance(old, str) and not isinstance(new, str)
+                                  for old, new in zip(row[1:], item[:2]))]
+                self.cursor.executemany(
+                    f'UPDATE {table} SET ste_data = ?, zcr_data = ? WHERE rowid = ?', updates
+                )
+                self.conn.commit()
+                converted += len(updates)
+                last_rowid = rows[-1][0]
+        
+        return converted
+    
+    def get_series_storage_stats(self, limit=None):
+        """
+        Dung lượng và tốc độ giải mã của chuỗi STE/ZCR trong bảng songs.
+        
+        Args:
+            limit (int): Chỉ đo trên limit bài hát đầu tiên (None: tất cả)
+        
+        Returns:
+            dict: số dòng theo định dạng, số byte đang lưu, số byte nếu ghi JSON
+                  float64, tỉ lệ nén, thời gian giải mã và số điểm giải mã mỗi giây
+        """
+        query = 'SELECT ste_data, zcr_data FROM songs ORDER BY id'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        self.cursor.execute(query)
+        
+        stats = {'songs': 0, 'rows_q16': 0, 'rows_json': 0, 'stored_bytes': 0,
+                 'json_bytes': 0, 'points': 0, 'decode_s': 0.0}
+        for row in self.cursor.fetchall():
+            stats['songs'] += 1
+            for data in row:
+                if not data:
+                    continue
+                stats['rows_json' if isinstance(data, str) else 'rows_q16'] += 1
+                stats['stored_bytes'] += len(data)
+                
+                start = time.perf_counter()
+                values = self._decode_series(data)
+                stats['decode_s'] += time.perf_counter() - start
+                
+                stats['points'] += len(values)
+                stats['json_bytes'] += len(data) if isinstance(data, str) else \
+                    len(json.dumps(values.astype(np.float64).tolist()))
+        
+        stats['ratio'] = stats['json_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else None
+        stats['points_per_s'] = stats['points'] / stats['decode_s'] if stats['decode_s'] else None
+        return stats
+    
     def _row_to_dict(self, row):
 
-        columns = [
-            'id', 'file_path', 'file_name', 'title', 'artist', 'duration',
-            'sample_rate', 'classification', 'feature_vector', 'ste_data',
-            'zcr_data', 'ste_mean', 'ste_std', 'ste_max', 'ste_min',
-            'zcr_mean', 'zcr_std', 'zcr_max', 'zcr_min', 'created_at', 'updated_at'
-        ]
-        
-        song_dict = dict(zip(columns, row))
+        song_dict = dict(zip(self.SONG_COLUMNS, row))
         
         # Parse JSON fields
         if song_dict['feature_vector']:
             song_dict['feature_vector'] = np.array(json.loads(song_dict['feature_vector']))
         if song_dict['ste_data']:
-            song_dict['ste_data'] = np.array(json.loads(song_dict['ste_data']))
+            song_dict['ste_data'] = self._decode_series(song_dict['ste_data'])
         if song_dict['zcr_data']:
-            song_dict['zcr_data'] = np.array(json.loads(song_dict['zcr_data']))
+            song_dict['zcr_data'] = self._decode_series(song_dict['zcr_data'])
+        if song_dict['extraction_config']:
+            song_dict['extraction_config'] = json.loads(song_dict['extraction_config'])
+        if song_dict['channel_summary']:
+            song_dict['channel_summary'] = json.loads(song_dict['channel_summary'])
         
         return song_dict
     
     def close(self):
         """Đóng kết nối database."""
+        self.flush_search_history()
         if self.conn:
             self.conn.close()
     
@@ -290,6 +1357,7 @@ if __name__ == "__main__":
     
     print(f"Database path: {db.db_path}")
     print(f"Statistics: {db.get_statistics()}")
+    print(f"Chuoi STE/ZCR: {db.get_series_storage_stats()}")
     
     db.close()
     print("Database đã được tạo thành công!")
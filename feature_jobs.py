@@ -0,0 +1,168 @@
+"""
+Module 6: Tinh lai dac trung (Recompute Jobs)
+Cap nhat cac ban ghi duoc tinh bang cau hinh trich dac trung cu sang cau hinh moi,
+theo tung lo song song, luu tien do de co the dung va chay tiep.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from audio_processing import process_audio_file, make_extraction_config, get_feature_version
+from database_manager import DatabaseManager
+
+
+def _recompute_one(song_id, file_path, config):
+    """Tính lại đặc trưng của một file (chạy trong tiến trình con)."""
+    try:
+        result = process_audio_file(
+            file_path,
+            frame_duration_ms=config['frame_duration_ms'],
+            overlap_ratio=config['overlap_ratio'],
+            target_rate=config['target_rate'],
+            vad=config.get('vad', 'off'),
+            channel_mode=config.get('channel_mode', 'mono'),
+            # Không gửi mảng âm thanh về tiến trình chính
+            keep_audio=False
+        )
+        return song_id, result, None
+    except Exception as e:
+        return song_id, None, e
+
+
+class RecomputeJob:
+    """
+    Tính lại các bài hát chưa theo cấu hình đích, mỗi lô được ghi trong một transaction.
+    
+    Tiến độ (id bài hát cuối cùng đã xử lý) nằm trong bảng recompute_jobs cùng
+    transaction với dữ liệu, nên khi chạy lại job sẽ tiếp tục ngay sau lô cuối
+    đã ghi thành công. Bài hát lỗi được ghi vào recompute_failures và bỏ qua.
+    """
+    
+    def __init__(self, db_path="audio_database.db", frame_duration_ms=25, overlap_ratio=0.5,
+                 target_rate=None, vad='off', workers=None, batch_size=32, progress_callback=None,
+                 channel_mode='mono'):
+        self.db_path = db_path
+        self.config = make_extraction_config(frame_duration_ms, overlap_ratio, target_rate, vad,
+                                             channel_mode)
+        self.feature_version = get_feature_version(self.config)
+        self.workers = workers
+        self.batch_size = batch_size
+        # progress_callback(job) được gọi sau mỗi lô
+        self.progress_callback = progress_callback
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.error = None
+    
+    def run(self):
+        """
+        Chạy job trong luồng hiện tại cho tới khi hết bài hát cũ hoặc bị dừng.
+        
+        Returns:
+            dict: Tiến độ cuối cùng (cùng định dạng với DatabaseManager.get_recompute_job)
+        """
+        # Kết nối riêng: job có thể chạy trên luồng khác với giao diện
+        db = DatabaseManager(self.db_path)
+        executor = None
+        
+        try:
+            job = db.get_recompute_job(self.feature_version)
+            if job is None or job['status'] == 'done':
+                job = {
+                    'job_id': self.feature_version,
+                    'extraction_config': self.config,
+                    'last_song_id': 0,
+                    'processed': 0,
+                    'failed': 0,
+                    'started_at': datetime.now()
+                }
+            job['status'] = 'running'
+            job['total'] = job['processed'] + job['failed'] + db.count_stale_songs(
+                self.feature_version, job['last_song_id']
+            )
+            db.save_recompute_job(job)
+            
+            if self.workers is None or self.workers > 1:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+            
+            while not self._stop_event.is_set():
+                batch = db.get_stale_songs(self.feature_version, job['last_song_id'], self.batch_size)
+                if not batch:
+                    job['status'] = 'done'
+                    break
+                
+                if executor is not None:
+                    futures = [executor.submit(_recompute_one, song_id, path, self.config)
+                               for song_id, path in batch]
+                    results = [future.result() for future in futures]
+                else:
+                    results = [_recompute_one(song_id, path, self.config) for song_id, path in batch]
+                
+                # Ghi cả lô và con trỏ tiến độ trong cùng một transaction
+                for song_id, result, error in results:
+                    if error is None and db.update_song_features(song_id, result, commit=False):
+                        job['processed'] += 1
+                    else:
+                        db.record_recompute_failure(
+                            self.feature_version, song_id, error or "Bai hat da bi xoa"
+                        )
+                        job['failed'] += 1
+                
+                job['last_song_id'] = batch[-1][0]
+                db.save_recompute_job(job)
+                
+                if self.progress_callback:
+                    self.progress_callback(dict(job))
+            else:
+                job['status'] = 'stopped'
+            
+            db.save_recompute_job(job)
+            return job
+        
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            db.close()
+    
+    def _run_in_thread(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.error = e
+            print(f"Lỗi khi tính lại đặc trưng: {e}")
+    
+    def start(self):
+        """Chạy job trên một luồng nền."""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run_in_thread, daemon=True)
+        self._thread.start()
+    
+    def stop(self, wait=True):
+        """Dừng sau lô đang xử lý; tiến độ đã ghi được giữ lại để chạy tiếp."""
+        self._stop_event.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def status(self):
+        """Tiến độ hiện tại đọc từ database."""
+        with DatabaseManager(self.db_path) as db:
+            return db.get_recompute_job(self.feature_version)
+
+
+# Test module
+if __name__ == "__main__":
+    print("=== Module Tính lại đặc trưng ===")
+    
+    job = RecomputeJob()
+    print(f"Phiên bản đích: {job.feature_version}")
+    print(f"Cấu hình: {job.config}")
+    
+    print("\nCác hàm có sẵn:")
+    print("- RecomputeJob(db_path, frame_duration_ms, overlap_ratio, target_rate, vad, workers, batch_size, channel_mode)")
+    print("- job.run() / job.start() / job.stop() / job.status()")
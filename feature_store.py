@@ -0,0 +1,291 @@
+"""
+Module 13: Kho vector anh xa bo nho (Memory-mapped Feature Store)
+File cot (columnar) nam canh database SQLite: ma tran vector float32 lien tuc, mang id
+va bitmap danh dau ban ghi da xoa. SearchEngine anh xa (mmap) truc tiep ma tran nay
+thay vi doc va giai ma tung dong SQLite, nen khoi dong voi thu vien lon gan nhu tuc thi.
+
+Vi du:
+    store = FeatureStore('audio_database.db')
+    ids, matrix = store.load(db, DEFAULT_FEATURE_VERSION)
+    engine = SearchEngine(db, feature_store=store)
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from audio_processing import DEFAULT_FEATURE_VERSION
+
+
+VECTOR_DTYPE = np.dtype('<f4')
+ID_DTYPE = np.dtype('<i8')
+
+# Gộp lại (compact) khi tỉ lệ bản ghi đã xóa vượt ngưỡng này
+DEFAULT_COMPACT_RATIO = 0.2
+
+
+class FeatureStore:
+    """
+    Kho vector chỉ ghi thêm (append-only), mỗi phiên bản đặc trưng một thư mục:
+        
+        <db_path>.fstore/<feature_version>/
+            vectors.f32     ma trận (count, dim) float32, các dòng nối tiếp nhau
+            ids.i64         id bài hát của từng dòng
+            tombstones.bin  bitmap (np.packbits), bit 1 = dòng đã bị xóa/thay thế
+            meta.json       dim, count, dead, generation, change_seq (ghi sau cùng)
+    
+    Đồng bộ dựa trên bộ đếm thế hệ của database: nếu không đổi thì không đọc SQLite.
+    Khi đổi, chỉ đọc nhật ký thay đổi đặc trưng (bảng feature_changes) từ change_seq
+    đã áp dụng: sửa tên/phân loại không ghi nhật ký nên chỉ tốn một truy vấn. Dòng
+    cũ của các bài trong nhật ký được đánh dấu trong bitmap, vector hiện tại của
+    những bài còn thuộc phiên bản được ghi nối vào cuối file. Khi số dòng đã xóa
+    vượt compact_ratio, các file được viết lại chỉ với các dòng còn dùng.
+    
+    Sau mỗi lần đồng bộ, kho ghi nhận change_seq vào database để nhật ký được xóa
+    bớt; nếu nhật ký đã bị xóa qua mốc của kho, kho được tạo lại.
+    
+    Chỉ nên có một tiến trình đồng bộ một kho tại một thời điểm; tiến trình chỉ đọc
+    thấy dữ liệu nhất quán vì meta.json (số dòng) được thay thế nguyên tử sau cùng.
+    Trong một tiến trình, các luồng dùng chung một đối tượng FeatureStore được
+    tuần tự hóa bằng khóa.
+    """
+    
+    def __init__(self, db_path, compact_ratio=DEFAULT_COMPACT_RATIO):
+        self.root = f'{db_path}.fstore'
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+    
+    def _dir(self, feature_version):
+        if not feature_version:
+            raise ValueError("FeatureStore can mot phien ban dac trung cu the")
+        return os.path.join(self.root, feature_version)
+    
+    def _path(self, feature_version, name):
+        return os.path.join(self._dir(feature_version), name)
+    
+    def read_meta(self, feature_version):
+        """meta.json của phiên bản (None nếu kho chưa được tạo)."""
+        try:
+            with open(self._path(feature_version, 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write_atomic(self, feature_version, name, data):
+        """Ghi cả file qua file tạm rồi os.replace (đọc cùng lúc không thấy file dở dang)."""
+        path = self._path(feature_version, name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    def _write_meta(self, feature_version, meta):
+        self._write_atomic(feature_version, 'meta.json', json.dumps(meta).encode('utf-8'))
+    
+    def _append(self, feature_version, name, offset, data):
+        """
+        Ghi data vào file cột bắt đầu từ offset (= số dòng trong meta x số byte mỗi dòng).
+        
+        Cắt bỏ trước các dòng thừa sau offset: dòng đã ghi nối nhưng chưa kịp ghi meta
+        (tiến trình dừng giữa chừng) không được tính, nên phải bị ghi đè.
+        """
+        with open(self._path(feature_version, name), 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(data)
+    
+    def _map(self, feature_version, meta):
+        """(vectors, ids, dead) ánh xạ từ file theo meta, không sao chép."""
+        count, dim = meta['count'], meta['dim']
+        if count == 0:
+            return (np.zeros((0, dim), dtype=VECTOR_DTYPE), np.zeros(0, dtype=ID_DTYPE),
+                    np.zeros(0, dtype=bool))
+        
+        vectors = np.memmap(self._path(feature_version, 'vectors.f32'), dtype=VECTOR_DTYPE,
+                            mode='r', shape=(count, dim))
+        ids = np.memmap(self._path(feature_version, 'ids.i64'), dtype=ID_DTYPE, mode='r', shape=(count,))
+        with open(self._path(feature_version, 'tombstones.bin'), 'rb') as f:
+            dead = np.unpackbits(np.frombuffer(f.read(), dtype=np.uint8), count=count).astype(bool)
+        return vectors, ids, dead
+    
+    def _write_all(self, feature_version, vectors, ids, generation, change_seq):
+        """Viết lại toàn bộ kho (tạo mới hoặc compact)."""
+        os.makedirs(self._dir(feature_version), exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+        
+        # meta cũ (nếu có) vẫn trỏ tới số dòng cũ cho tới khi được thay ở bước cuối,
+        # nhưng các file cột đã bị thay: xóa meta trước để không ai ánh xạ sai
+        meta_path = self._path(feature_version, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        
+        self._write_atomic(feature_version, 'vectors.f32', vectors.tobytes())
+        self._write_atomic(feature_version, 'ids.i64', np.asarray(ids, dtype=ID_DTYPE).tobytes())
+        self._write_atomic(feature_version, 'tombstones.bin',
+                           np.packbits(np.zeros(len(ids), dtype=bool)).tobytes())
+        self._write_meta(feature_version, {
+            'dim': int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            'count': len(ids),
+            'dead': 0,
+            'generation': generation,
+            'change_seq': change_seq
+        })
+    
+    def rebuild(self, db, feature_version):
+        """Tạo lại kho của một phiên bản từ database."""
+        # Đọc mốc trước dữ liệu: thay đổi xen giữa sẽ được áp dụng lại ở lần đồng bộ sau
+        generation = db.get_library_generation()
+        change_seq = db.get_feature_change_seq()
+        rows = db.get_all_feature_vectors(feature_version, feature_version == DEFAULT_FEATURE_VERSION)
+        
+        dim = len(rows[0][1]) if rows else 0
+        vectors = np.vstack([vector for _, vector in rows]) if rows else np.zeros((0, dim))
+        self._write_all(feature_version, vectors, [song_id for song_id, _ in rows],
+                        generation, change_seq)
+        db.mark_feature_changes_applied(self._reader(feature_version), change_seq)
+    
+    def _reader(self, feature_version):
+        """Tên của kho trong bảng feature_change_readers của database."""
+        return f'fstore:{feature_version}'
+    
+    def sync(self, db, feature_version):
+        """
+        Cập nhật kho theo database nếu bộ đếm thế hệ đã thay đổi.
+        
+        Returns:
+            bool: True nếu kho có thay đổi
+        """
+        with self._lock:
+            return self._sync(db, feature_version)
+    
+    def _sync(self, db, feature_version):
+        meta = self.read_meta(feature_version)
+        if meta is None or 'change_seq' not in meta:
+            # Chưa có kho, hoặc kho của định dạng cũ (đồng bộ bằng checksum)
+            self.rebuild(db, feature_version)
+            return True
+        
+        generation = db.get_library_generation()
+        if meta['generation'] == generation:
+            return False
+        
+        change_seq = db.get_feature_change_seq()
+        changed_ids = db.get_feature_changes(meta['change_seq'], change_seq)
+        if changed_ids is None:
+            # Nhật ký đã bị xóa bớt qua mốc của kho: không biết bài nào đổi, tạo lại
+            self.rebuild(db, feature_version)
+            return True
+        if len(changed_ids) == 0:
+            # Chỉ đổi tên/phân loại...: ghi nhận thế hệ mới, không đụng tới vector
+            meta.update(generation=generation, change_seq=change_seq)
+            self._write_meta(feature_version, meta)
+            db.mark_feature_changes_applied(self._reader(feature_version), change_seq)
+            return False
+        
+        _, ids, dead = self._map(feature_version, meta)
+        # Dòng cũ của mọi bài có thay đổi (xóa, đổi phiên bản, tính lại) không còn dùng
+        dead = dead | np.isin(ids, changed_ids)
+        
+        include_legacy = feature_version == DEFAULT_FEATURE_VERSION
+        rows = db.get_feature_vectors_by_ids(changed_ids, feature_version=feature_version,
+                                             include_legacy=include_legacy)
+        
+        if rows and meta['count'] and len(rows[0][1]) != meta['dim']:
+            # Kích thước vector đổi (không xảy ra với cùng một phiên bản): tạo lại
+            self.rebuild(db, feature_version)
+            return True
+        
+        if (os.path.getsize(self._path(feature_version, 'vectors.f32'))
+                < meta['count'] * meta['dim'] * VECTOR_DTYPE.itemsize
+                or os.path.getsize(self._path(feature_version, 'ids.i64')) < meta['count'] * ID_DTYPE.itemsize):
+            # File cột ngắn hơn meta (bị hỏng/cắt ngoài ý muốn): không thể ghi nối an toàn
+            self.rebuild(db, feature_version)
+            return True
+        
+        if rows:
+            added_ids = np.array([song_id for song_id, _ in rows], dtype=ID_DTYPE)
+            vectors = np.ascontiguousarray(np.vstack([vector for _, vector in rows]), dtype=VECTOR_DTYPE)
+            
+            # Ghi nối sau meta['count'] dòng của các file cột; meta (số dòng) chỉ được
+            # cập nhật sau cùng
+            count = meta['count']
+            self._append(feature_version, 'vectors.f32', count * vectors.shape[1] * VECTOR_DTYPE.itemsize,
+                         vectors.tobytes())
+            self._append(feature_version, 'ids.i64', count * ID_DTYPE.itemsize, added_ids.tobytes())
+            dead = np.concatenate([dead, np.zeros(len(rows), dtype=bool)])
+            meta['dim'] = int(vectors.shape[1])
+        
+        self._write_atomic(feature_version, 'tombstones.bin', np.packbits(dead).tobytes())
+        meta.update(count=len(dead), dead=int(dead.sum()), generation=generation, change_seq=change_seq)
+        self._write_meta(feature_version, meta)
+        db.mark_feature_changes_applied(self._reader(feature_version), change_seq)
+        
+        if meta['count'] and meta['dead'] > self.compact_ratio * meta['count']:
+            self.compact(feature_version)
+        return True
+    
+    def compact(self, feature_version):
+        """Viết lại kho chỉ với các dòng còn dùng."""
+        with self._lock:
+            meta = self.read_meta(feature_version)
+            if meta is None or meta['dead'] == 0:
+                return
+            
+            vectors, ids, dead = self._map(feature_version, meta)
+            live = ~dead
+            # Sao chép ra bộ nhớ trước khi thay file đang được ánh xạ
+            vectors, ids = np.array(vectors[live]), np.array(ids[live])
+            self._write_all(feature_version, vectors.reshape(-1, meta['dim']), ids,
+                            meta['generation'], meta['change_seq'])
+    
+    def load(self, db, feature_version):
+        """
+        (mảng id, ma trận N x D float32) của các dòng còn dùng, sau khi đồng bộ.
+        
+        Nếu kho không có dòng bị xóa, ma trận là memmap trên file (không sao chép).
+        
+        Returns:
+            tuple: (ids, matrix) hoặc (mảng rỗng, None) nếu không có bài hát nào
+        """
+        with self._lock:
+            self.sync(db, feature_version)
+            meta = self.read_meta(feature_version)
+            vectors, ids, dead = self._map(feature_version, meta)
+        
+        if meta['count'] - meta['dead'] == 0:
+            return np.zeros(0, dtype=np.int64), None
+        if meta['dead']:
+            live = ~dead
+            return np.array(ids[live]), np.array(vectors[live])
+        return ids, vectors
+    
+    def stats(self, feature_version):
+        meta = self.read_meta(feature_version)
+        if meta is None:
+            return None
+        return dict(meta, live=meta['count'] - meta['dead'])
+    
+    def versions(self):
+        """Các phiên bản đã có kho."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, 'meta.json')))
+    
+    def drop(self, feature_version=None):
+        """Xóa kho của một phiên bản (None: toàn bộ)."""
+        path = self.root if feature_version is None else self._dir(feature_version)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# Test module
+if __name__ == "__main__":
+    print("=== Module Kho vector ánh xạ bộ nhớ ===")
+    print("Các hàm có sẵn:")
+    print("- FeatureStore(db_path, compact_ratio)")
+    print("- store.load(db, feature_version): (ids, ma trận float32) sau khi đồng bộ")
+    print("- store.sync(db, feature_version) / store.compact(feature_version) / store.rebuild(db, feature_version)")
+    print("- store.stats(feature_version) / store.versions() / store.drop(feature_version)")
@@ -5,6 +5,11 @@ Module 4: Giao diện người dùng & Trực quan hóa (UI/UX & Visualization)
 
 import sys
 import os
+import time
+
+# Mốc bắt đầu để đo thời gian tới lần vẽ đầu tiên (tính cả thời gian import)
+_START_TIME = time.perf_counter()
+
 import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
@@ -12,23 +17,22 @@ from PyQt5.QtWidgets import (
     QTabWidget, QGroupBox, QLineEdit, QComboBox, QSlider, QSpinBox,
     QProgressBar, QStatusBar, QMessageBox, QSplitter, QFrame,
     QTableWidget, QTableWidgetItem, QHeaderView, QDialog, QFormLayout,
-    QDialogButtonBox
+    QDialogButtonBox, QCheckBox, QPlainTextEdit
 )
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
 from PyQt5.QtGui import QFont, QIcon
 
-import matplotlib
-matplotlib.use('Qt5Agg')
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.figure import Figure
-
-import pygame
-
 # Import các module khác
 from audio_processing import load_audio, framing, calculate_ste_normalized, calculate_zcr, process_audio_file, extract_features, get_feature_vector
 from database_manager import DatabaseManager
 from search_engine import SearchEngine
+import profiling
+
+
+def _plot_canvas():
+    """Import module biểu đồ (kéo theo matplotlib) khi cần lần đầu."""
+    import plot_canvas
+    return plot_canvas
 
 
 class AudioProcessingThread(QThread):
@@ -47,10 +51,13 @@ class AudioProcessingThread(QThread):
     def run(self):
         try:
             self.progress.emit(20)
+            # Không giữ tín hiệu gốc: chỉ cần bao min/max (tính một lần) để vẽ
             result = process_audio_file(
                 self.file_path, 
                 self.frame_duration, 
-                self.overlap_ratio
+                self.overlap_ratio,
+                keep_audio=False,
+                audio_handle=True
             )
             self.progress.emit(100)
             self.finished.emit(result)
@@ -58,13 +65,25 @@ class AudioProcessingThread(QThread):
             self.error.emit(str(e))
 
 
-class MplCanvas(FigureCanvas):
-    """Canvas cho Matplotlib."""
+class LibraryLoadThread(QThread):
+    """Thread đọc danh sách bài hát và thống kê bằng kết nối database riêng."""
+    
+    finished = pyqtSignal(int, list, dict)
     
-    def __init__(self, parent=None, width=8, height=4, dpi=100):
-        self.fig = Figure(figsize=(width, height), dpi=dpi)
-        super().__init__(self.fig)
-        self.setParent(parent)
+    def __init__(self, db_path, token):
+        super().__init__()
+        self.db_path = db_path
+        # token để bỏ qua kết quả của các lần tải đã cũ
+        self.token = token
+    
+    def run(self):
+        db = DatabaseManager(self.db_path, async_history=False)
+        try:
+            songs = db.get_all_songs(include_series=False)
+            stats = db.get_statistics()
+        finally:
+            db.close()
+        self.finished.emit(self.token, songs, stats)
 
 
 class EditSongDialog(QDialog):
@@ -106,19 +125,31 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         
-        # Khoi tao pygame mixer de phat am thanh
-        # Cau hinh cho file WAV: frequency=44100, size=-16, channels=2, buffer=2048
-        pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=2048)
+        # pygame mixer chi duoc khoi tao khi phat lan dau (xem _mixer)
+        self._pygame = None
         
         # Bien luu Sound object
         self.current_sound = None
         
+        # Canvas Matplotlib duoc tao khi can ve lan dau
+        self.canvas = None
+        self.toolbar = None
+        self.stats_canvas = None
+        
+        # Tải danh sách bài hát nền
+        self._library_token = 0
+        self._library_threads = []
+        
+        # Thời gian khởi động (giây): 'first_paint' được ghi ở lần vẽ đầu tiên
+        self.startup_timings = {}
+        self._first_paint_done = False
+        
         # Khoi tao database va search engine
         self.db = DatabaseManager()
         self.search_engine = SearchEngine(self.db)
         
         # Biến lưu trữ dữ liệu
-        self.current_audio_data = None
+        self.current_audio_handle = None
         self.current_processed_data = None
         self.current_file_path = None
         
@@ -127,10 +158,48 @@ class MainWindow(QMainWindow):
         self.setMinimumSize(1200, 800)
         
         self.setup_ui()
-        self.load_song_list()
+        self.startup_timings['setup_ui'] = time.perf_counter() - _START_TIME
         
         # Status bar
         self.statusBar().showMessage("Sẵn sàng")
+        
+        # Danh sách bài hát được đọc sau khi cửa sổ đã hiện
+        QTimer.singleShot(0, self.load_song_list)
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self._first_paint_done:
+            self._first_paint_done = True
+            self.startup_timings['first_paint'] = time.perf_counter() - _START_TIME
+            self.statusBar().showMessage(
+                f"Sẵn sàng (khởi động {self.startup_timings['first_paint'] * 1000:.0f} ms)"
+            )
+    
+    def _mixer(self):
+        """pygame.mixer, import và khởi tạo ở lần phát đầu tiên."""
+        if self._pygame is None:
+            import pygame
+            # Cau hinh cho file WAV: frequency=44100, size=-16, channels=2, buffer=2048
+            pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=2048)
+            self._pygame = pygame
+        return self._pygame.mixer
+    
+    def _ensure_analysis_canvas(self):
+        """Tạo canvas phân tích và toolbar ở lần vẽ đầu tiên."""
+        if self.canvas is None:
+            plot_canvas = _plot_canvas()
+            self.canvas = plot_canvas.AnalysisCanvas(self, width=10, height=6, dpi=100)
+            self.toolbar = plot_canvas.NavigationToolbar(self.canvas, self)
+            self.charts_placeholder.hide()
+            self.charts_layout.addWidget(self.toolbar)
+            self.charts_layout.addWidget(self.canvas)
+        return self.canvas
+    
+    def _ensure_stats_canvas(self):
+        if self.stats_canvas is None:
+            self.stats_canvas = _plot_canvas().MplCanvas(self, width=8, height=4, dpi=100)
+            self.stats_chart_layout.insertWidget(0, self.stats_canvas)
+        return self.stats_canvas
     
     def setup_ui(self):
         """Thiết lập giao diện."""
@@ -300,14 +369,12 @@ class MainWindow(QMainWindow):
         
         # Biểu đồ
         charts_group = QGroupBox("Bieu do")
-        charts_layout = QVBoxLayout(charts_group)
+        self.charts_layout = QVBoxLayout(charts_group)
         
-        # Canvas cho biểu đồ
-        self.canvas = MplCanvas(self, width=10, height=6, dpi=100)
-        self.toolbar = NavigationToolbar(self.canvas, self)
-        
-        charts_layout.addWidget(self.toolbar)
-        charts_layout.addWidget(self.canvas)
+        # Canvas cho biểu đồ được tạo khi có dữ liệu để vẽ (_ensure_analysis_canvas)
+        self.charts_placeholder = QLabel("Chưa có biểu đồ")
+        self.charts_placeholder.setAlignment(Qt.AlignCenter)
+        self.charts_layout.addWidget(self.charts_placeholder)
         
         layout.addWidget(charts_group, 1)
         
@@ -408,17 +475,35 @@ class MainWindow(QMainWindow):
         
         # Biểu đồ thống kê
         stats_chart_group = QGroupBox("Phan bo theo loai")
-        stats_chart_layout = QVBoxLayout(stats_chart_group)
-        
-        self.stats_canvas = MplCanvas(self, width=8, height=4, dpi=100)
-        stats_chart_layout.addWidget(self.stats_canvas)
+        self.stats_chart_layout = QVBoxLayout(stats_chart_group)
         
+        # Canvas được tạo ở lần cập nhật thống kê đầu tiên (_ensure_stats_canvas)
         refresh_btn = QPushButton("Cap nhat thong ke")
         refresh_btn.clicked.connect(self.update_statistics)
-        stats_chart_layout.addWidget(refresh_btn)
+        self.stats_chart_layout.addWidget(refresh_btn)
         
         layout.addWidget(stats_chart_group, 1)
         
+        # Thời gian từng bước xử lý (giải mã, STE/ZCR, ghi database, tìm kiếm)
+        perf_group = QGroupBox("Hieu nang")
+        perf_layout = QVBoxLayout(perf_group)
+        
+        self.profiling_checkbox = QCheckBox("Do thoi gian tung buoc")
+        self.profiling_checkbox.setChecked(profiling.is_enabled())
+        self.profiling_checkbox.toggled.connect(self.toggle_profiling)
+        perf_layout.addWidget(self.profiling_checkbox)
+        
+        self.profiling_text = QPlainTextEdit()
+        self.profiling_text.setReadOnly(True)
+        self.profiling_text.setFont(QFont('Courier New', 9))
+        perf_layout.addWidget(self.profiling_text)
+        
+        reset_btn = QPushButton("Xoa so lieu")
+        reset_btn.clicked.connect(self.reset_profiling)
+        perf_layout.addWidget(reset_btn)
+        
+        layout.addWidget(perf_group)
+        
         return tab
     
     def browse_file(self):
@@ -467,7 +552,7 @@ class MainWindow(QMainWindow):
         """Xử lý khi phân tích hoàn tất."""
         self.progress_bar.setVisible(False)
         self.current_processed_data = result
-        self.current_audio_data = result['audio_data']
+        self.current_audio_handle = result['audio_handle']
         
         # Hiển thị kết quả phân loại
         classification = result['classification']
@@ -485,7 +570,7 @@ class MainWindow(QMainWindow):
         # Vẽ biểu đồ
         self.plot_analysis(result)
         
-        self.statusBar().showMessage("Phân tích hoàn tất!")
+        self.statusBar().showMessage(f"Phân tích hoàn tất! (bộ giải mã: {result.get('decoder', '?')})")
     
     def on_analysis_error(self, error_msg):
         """Xử lý lỗi khi phân tích."""
@@ -494,46 +579,10 @@ class MainWindow(QMainWindow):
     
     def plot_analysis(self, result):
         """Vẽ biểu đồ phân tích."""
-        self.canvas.fig.clear()
-        
-        audio_data = result['audio_data']
-        sample_rate = result['sample_rate']
         features = result['features']
-        
-        # Tạo 3 subplot
-        ax1 = self.canvas.fig.add_subplot(3, 1, 1)
-        ax2 = self.canvas.fig.add_subplot(3, 1, 2)
-        ax3 = self.canvas.fig.add_subplot(3, 1, 3)
-        
-        # Plot 1: Waveform
-        time_axis = np.arange(len(audio_data)) / sample_rate
-        ax1.plot(time_axis, audio_data, color='steelblue', linewidth=0.5)
-        ax1.set_title('Dạng sóng âm thanh (Waveform)', fontsize=10)
-        ax1.set_xlabel('Thời gian (s)')
-        ax1.set_ylabel('Biên độ')
-        ax1.grid(True, alpha=0.3)
-        
-        # Plot 2: STE
-        ste_values = features['ste']
-        frame_times = np.linspace(0, features['duration'], len(ste_values))
-        ax2.plot(frame_times, ste_values, color='orangered', linewidth=1)
-        ax2.fill_between(frame_times, ste_values, alpha=0.3, color='orangered')
-        ax2.set_title('Năng lượng ngắn hạn (STE)', fontsize=10)
-        ax2.set_xlabel('Thời gian (s)')
-        ax2.set_ylabel('STE')
-        ax2.grid(True, alpha=0.3)
-        
-        # Plot 3: ZCR
-        zcr_values = features['zcr']
-        ax3.plot(frame_times, zcr_values, color='forestgreen', linewidth=1)
-        ax3.fill_between(frame_times, zcr_values, alpha=0.3, color='forestgreen')
-        ax3.set_title('Tốc độ qua điểm không (ZCR)', fontsize=10)
-        ax3.set_xlabel('Thời gian (s)')
-        ax3.set_ylabel('ZCR')
-        ax3.grid(True, alpha=0.3)
-        
-        self.canvas.fig.tight_layout()
-        self.canvas.draw()
+        self._ensure_analysis_canvas().show_analysis(
+            result['audio_handle'], features['ste'], features['zcr'], features['duration']
+        )
     
     def play_audio(self):
         """Phat am thanh."""
@@ -545,12 +594,13 @@ class MainWindow(QMainWindow):
                 # Kiem tra dinh dang file
                 if self.current_file_path.lower().endswith('.wav'):
                     # Su dung Sound object cho file WAV (chinh xac hon)
-                    self.current_sound = pygame.mixer.Sound(self.current_file_path)
+                    self.current_sound = self._mixer().Sound(self.current_file_path)
                     self.current_sound.play()
                 else:
                     # Su dung music cho cac dinh dang khac
-                    pygame.mixer.music.load(self.current_file_path)
-                    pygame.mixer.music.play()
+                    mixer = self._mixer()
+                    mixer.music.load(self.current_file_path)
+                    mixer.music.play()
                 
                 self.statusBar().showMessage("Dang phat...")
             except Exception as e:
@@ -562,8 +612,9 @@ class MainWindow(QMainWindow):
         if self.current_sound:
             self.current_sound.stop()
             self.current_sound = None
-        # Dung music
-        pygame.mixer.music.stop()
+        # Dung music (chua phat lan nao thi mixer chua duoc khoi tao)
+        if self._pygame is not None:
+            self._pygame.mixer.music.stop()
         self.statusBar().showMessage("Da dung")
     
     def save_to_library(self):
@@ -594,10 +645,30 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning(self, "Lỗi", "Không thể lưu bài hát!")
     
     def load_song_list(self):
-        """Load danh sách bài hát từ database."""
-        self.song_list.clear()
-        songs = self.db.get_all_songs()
+        """Load danh sách bài hát từ database (trên thread nền)."""
+        self._library_token += 1
+        
+        if self.db.db_path == ':memory:':
+            # Database trong bộ nhớ không mở được từ kết nối khác
+            self.on_song_list_loaded(
+                self._library_token, self.db.get_all_songs(include_series=False),
+                self.db.get_statistics()
+            )
+            return
         
+        # Giữ tham chiếu tới khi thread kết thúc (hủy QThread đang chạy sẽ lỗi)
+        self._library_threads = [thread for thread in self._library_threads if thread.isRunning()]
+        thread = LibraryLoadThread(self.db.db_path, self._library_token)
+        thread.finished.connect(self.on_song_list_loaded)
+        self._library_threads.append(thread)
+        thread.start()
+    
+    def on_song_list_loaded(self, token, songs, stats):
+        # Bỏ qua kết quả cũ (đã có lần tải mới hơn hoặc người dùng đang tìm theo tên)
+        if token != self._library_token:
+            return
+        
+        self.song_list.clear()
         for song in songs:
             item = QListWidgetItem(
                 f"{song['title']}" + (f" - {song['artist']}" if song['artist'] else "")
@@ -606,8 +677,10 @@ class MainWindow(QMainWindow):
             self.song_list.addItem(item)
         
         # Cập nhật thống kê
-        stats = self.db.get_statistics()
         self.stats_label.setText(f"Tổng: {stats['total_songs']} bài hát")
+        
+        if 'library_loaded' not in self.startup_timings:
+            self.startup_timings['library_loaded'] = time.perf_counter() - _START_TIME
     
     def search_by_name(self):
         """Tìm kiếm bài hát theo tên."""
@@ -617,6 +690,7 @@ class MainWindow(QMainWindow):
             self.load_song_list()
             return
         
+        self._library_token += 1
         self.song_list.clear()
         songs = self.db.search_by_name(keyword)
         
@@ -629,63 +703,56 @@ class MainWindow(QMainWindow):
             self.song_list.addItem(item)
     
     def on_song_selected(self):
-        """Xử lý khi chọn bài hát."""
-        pass
+        """Xử lý khi chọn bài hát: hiển thị ngay dữ liệu đã lưu."""
+        items = self.song_list.selectedItems()
+        if not items:
+            return
+        
+        song = self.db.get_song_by_id(items[0].data(Qt.UserRole), include_series=False)
+        if song:
+            self.show_saved_song(song)
     
     def on_song_double_click(self, item):
         """Xử lý double click vào bài hát."""
         song_id = item.data(Qt.UserRole)
-        song = self.db.get_song_by_id(song_id)
+        song = self.db.get_song_by_id(song_id, include_series=False)
         
         if song and os.path.exists(song['file_path']):
             self.current_file_path = song['file_path']
             self.file_label.setText(song['file_name'])
             
-            # Hiển thị thông tin đã lưu
-            self.classification_label.setText(f"{song['classification']}")
-            
-            features_text = (
-                f"STE: Mean={song['ste_mean']:.6f}, Std={song['ste_std']:.6f}\n"
-                f"ZCR: Mean={song['zcr_mean']:.4f}, Std={song['zcr_std']:.4f}\n"
-                f"Thời lượng: {song['duration']:.2f}s"
-            )
-            self.features_label.setText(features_text)
-            
-            # Vẽ biểu đồ từ dữ liệu đã lưu
-            self.plot_saved_analysis(song)
+            self.show_saved_song(song)
             
             # Phát nhạc
             self.play_audio()
     
+    def show_saved_song(self, song):
+        """Hiển thị thông tin và biểu đồ đã lưu của một bài hát."""
+        self.classification_label.setText(f"{song['classification']}")
+        
+        features_text = (
+            f"STE: Mean={song['ste_mean']:.6f}, Std={song['ste_std']:.6f}\n"
+            f"ZCR: Mean={song['zcr_mean']:.4f}, Std={song['zcr_std']:.4f}\n"
+            f"Thời lượng: {song['duration']:.2f}s"
+        )
+        self.features_label.setText(features_text)
+        
+        # Vẽ biểu đồ từ dữ liệu đã lưu
+        self.plot_saved_analysis(song)
+    
     def plot_saved_analysis(self, song):
-        """Vẽ biểu đồ từ dữ liệu đã lưu."""
-        self.canvas.fig.clear()
-        
-        # Tạo 2 subplot (không có waveform vì không lưu)
-        ax1 = self.canvas.fig.add_subplot(2, 1, 1)
-        ax2 = self.canvas.fig.add_subplot(2, 1, 2)
-        
-        # Plot STE
-        ste_values = song['ste_data']
-        frame_times = np.linspace(0, song['duration'], len(ste_values))
-        ax1.plot(frame_times, ste_values, color='orangered', linewidth=1)
-        ax1.fill_between(frame_times, ste_values, alpha=0.3, color='orangered')
-        ax1.set_title('Năng lượng ngắn hạn (STE)', fontsize=10)
-        ax1.set_xlabel('Thời gian (s)')
-        ax1.set_ylabel('STE')
-        ax1.grid(True, alpha=0.3)
-        
-        # Plot ZCR
-        zcr_values = song['zcr_data']
-        ax2.plot(frame_times, zcr_values, color='forestgreen', linewidth=1)
-        ax2.fill_between(frame_times, zcr_values, alpha=0.3, color='forestgreen')
-        ax2.set_title('Tốc độ qua điểm không (ZCR)', fontsize=10)
-        ax2.set_xlabel('Thời gian (s)')
-        ax2.set_ylabel('ZCR')
-        ax2.grid(True, alpha=0.3)
-        
-        self.canvas.fig.tight_layout()
-        self.canvas.draw()
+        """Vẽ biểu đồ từ dữ liệu đã lưu (không có waveform vì không lưu)."""
+        ste_values, zcr_values = song['ste_data'], song['zcr_data']
+        
+        if ste_values is None:
+            # Chỉ đọc mức chi tiết vừa đủ cho độ rộng biểu đồ
+            canvas = self._ensure_analysis_canvas()
+            overview = self.db.get_series_overview(song['id'], max_points=4 * canvas.width())
+            if overview is None:
+                return
+            ste_values, zcr_values = overview['ste_data'], overview['zcr_data']
+        
+        self._ensure_analysis_canvas().show_saved(ste_values, zcr_values, song['duration'])
     
     def add_song_to_library(self):
         """Them bai hat moi vao kho."""
@@ -703,7 +770,7 @@ class MainWindow(QMainWindow):
             file_ext = os.path.splitext(file_path)[1].lower()
             if file_ext in supported_formats:
                 try:
-                    processed = process_audio_file(file_path)
+                    processed = process_audio_file(file_path, keep_audio=False)
                     song_id = self.db.add_song(file_path, processed)
                     if song_id:
                         added += 1
@@ -768,7 +835,7 @@ class MainWindow(QMainWindow):
         
         try:
             # Xử lý file query
-            processed = process_audio_file(self.search_file_path)
+            processed = process_audio_file(self.search_file_path, keep_audio=False)
             
             # Lấy phương pháp và top_k
             method = self.search_method.currentText().lower()
@@ -778,6 +845,7 @@ class MainWindow(QMainWindow):
             results = self.search_engine.search_by_audio_file(
                 processed, top_k, method
             )
+            self.db.save_search_history(self.search_file_path, results)
             
             # Hiển thị kết quả
             self.results_table.setRowCount(len(results))
@@ -817,8 +885,9 @@ class MainWindow(QMainWindow):
         self.total_duration_label.setText(f"Tổng thời lượng: {total_minutes:.1f} phút")
         
         # Vẽ biểu đồ tròn
-        self.stats_canvas.fig.clear()
-        ax = self.stats_canvas.fig.add_subplot(1, 1, 1)
+        stats_canvas = self._ensure_stats_canvas()
+        stats_canvas.fig.clear()
+        ax = stats_canvas.fig.add_subplot(1, 1, 1)
         
         by_class = stats['by_classification']
         if by_class:
@@ -832,11 +901,41 @@ class MainWindow(QMainWindow):
         else:
             ax.text(0.5, 0.5, 'Chưa có dữ liệu', ha='center', va='center')
         
-        self.stats_canvas.draw()
+        stats_canvas.draw()
+        self.update_profiling_view()
+    
+    def toggle_profiling(self, enabled):
+        """Bật/tắt đo thời gian từng bước."""
+        if enabled:
+            profiling.enable()
+        else:
+            profiling.disable()
+        self.update_profiling_view()
+    
+    def reset_profiling(self):
+        profiling.reset()
+        self.update_profiling_view()
+    
+    def update_profiling_view(self):
+        """Hiển thị thời gian từng bước và thống kê cache tìm kiếm."""
+        stats = profiling.get_stats()
+        if not stats['stages'] and not profiling.is_enabled():
+            text = "Chua bat do thoi gian."
+        else:
+            text = profiling.format_stats(stats)
+        
+        cache_stats = self.search_engine.cache_stats()
+        if cache_stats:
+            text += (f"\n\nCache tim kiem: {cache_stats['hits']} hit / {cache_stats['misses']} miss "
+                     f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} muc")
+        self.profiling_text.setPlainText(text)
     
     def closeEvent(self, event):
         """Xử lý khi đóng ứng dụng."""
-        pygame.mixer.quit()
+        if self._pygame is not None:
+            self._pygame.mixer.quit()
+        for thread in self._library_threads:
+            thread.wait()
         self.db.close()
         event.accept()
 
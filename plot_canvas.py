@@ -0,0 +1,280 @@
+"""
+Module 11: Bieu do (Plot Canvases)
+Cac canvas Matplotlib dung trong giao dien. Tach rieng de main_gui chi import
+matplotlib khi bieu do duoc hien thi lan dau, giup cua so mo nhanh hon.
+"""
+
+import numpy as np
+import matplotlib
+matplotlib.use('Qt5Agg')
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.figure import Figure
+
+from audio_processing import build_envelope_pyramid
+
+
+class MplCanvas(FigureCanvas):
+    """Canvas cho Matplotlib."""
+    
+    def __init__(self, parent=None, width=8, height=4, dpi=100):
+        self.fig = Figure(figsize=(width, height), dpi=dpi)
+        super().__init__(self.fig)
+        self.setParent(parent)
+
+
+class DecimatedWaveform:
+    """
+    Vẽ dạng sóng từ kim tự tháp bao min/max thay vì toàn bộ mẫu.
+    
+    Mỗi khi trục x thay đổi (zoom/pan bằng NavigationToolbar), mức chi tiết được
+    chọn lại để số điểm vẽ xấp xỉ số pixel của trục, bất kể độ dài bài hát.
+    """
+    
+    def __init__(self, ax, color='steelblue', linewidth=0.5):
+        self.ax = ax
+        self.line, = ax.plot([], [], color=color, linewidth=linewidth)
+        self.audio_data = None
+        self.sample_rate = 1
+        self.num_samples = 0
+        self.pyramid = []
+        self._updating = False
+        ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+    
+    def set_audio(self, audio_data, sample_rate, pyramid=None, num_samples=None):
+        """
+        Gán dữ liệu mới và hiển thị toàn bộ bài hát.
+        
+        audio_data có thể là None nếu đã có pyramid và num_samples; khi đó zoom sâu
+        hơn mức 0 vẫn vẽ từ mức 0 thay vì từ mẫu gốc.
+        """
+        if pyramid is None:
+            pyramid = build_envelope_pyramid(audio_data)
+        
+        self.audio_data = audio_data
+        self.sample_rate = sample_rate
+        self.pyramid = pyramid
+        self.num_samples = len(audio_data) if audio_data is not None else num_samples
+        
+        peak = 1.0
+        if pyramid:
+            coarsest = pyramid[-1]
+            peak = float(max(np.max(np.abs(coarsest['min'])), np.max(np.abs(coarsest['max']))))
+        peak = peak if peak > 0 else 1.0
+        
+        self.ax.set_ylim(-1.05 * peak, 1.05 * peak)
+        self.ax.set_xlim(0, max(self.num_samples, 1) / sample_rate)
+        # set_xlim không phát sự kiện nếu giới hạn không đổi
+        self.update_view(*self.ax.get_xlim())
+    
+    def on_xlim_changed(self, ax):
+        if self._updating or self.num_samples == 0:
+            return
+        self._updating = True
+        try:
+            self.update_view(*ax.get_xlim())
+        finally:
+            self._updating = False
+    
+    def update_view(self, t_start, t_end):
+        """Chọn mức chi tiết phù hợp cho đoạn [t_start, t_end] và cập nhật đường vẽ."""
+        start = max(0, int(t_start * self.sample_rate))
+        end = min(self.num_samples, int(np.ceil(t_end * self.sample_rate)) + 1)
+        
+        if end <= start:
+            self.line.set_data([], [])
+            return
+        
+        pixels = max(1, int(self.ax.get_window_extent().width))
+        samples_per_pixel = (end - start) / pixels
+        
+        # Mức thô nhất mà mỗi ô vẫn không rộng hơn một pixel
+        level = None
+        for candidate in self.pyramid:
+            if candidate['bucket'] <= samples_per_pixel:
+                level = candidate
+        
+        if level is None and self.audio_data is not None:
+            # Đã zoom đủ gần: vẽ mẫu gốc
+            x = np.arange(start, end) / self.sample_rate
+            y = self.audio_data[start:end]
+        else:
+            level = level or self.pyramid[0]
+            bucket = level['bucket']
+            first = start // bucket
+            last = min(len(level['min']), -(-end // bucket))
+            
+            # Mỗi ô thành hai điểm (min, max) tại cùng thời điểm
+            x = np.repeat(np.arange(first, last) * bucket / self.sample_rate, 2)
+            y = np.empty(2 * (last - first), dtype=level['min'].dtype)
+            y[0::2] = level['min'][first:last]
+            y[1::2] = level['max'][first:last]
+        
+        self.line.set_data(x, y)
+
+
+class AnalysisCanvas(MplCanvas):
+    """
+    Canvas phân tích giữ nguyên các trục và đối tượng vẽ giữa các lần chọn bài.
+    
+    Có hai bố cục dựng sẵn một lần: 'full' (dạng sóng, STE, ZCR) khi vừa phân tích
+    file và 'saved' (STE, ZCR) cho bài trong kho. Chọn bài mới chỉ cập nhật dữ liệu
+    của các đường vẽ; nếu giới hạn trục không đổi thì vẽ lại bằng blitting.
+    """
+    
+    def __init__(self, parent=None, width=8, height=4, dpi=100):
+        super().__init__(parent, width, height, dpi)
+        
+        self.layouts = {
+            'full': self._create_layout(with_waveform=True),
+            'saved': self._create_layout(with_waveform=False)
+        }
+        self.active_layout = None
+        self._background = None
+        
+        # Các trục chỉ gắn vào figure khi bố cục của chúng được kích hoạt
+        for layout in self.layouts.values():
+            for ax in layout['axes']:
+                self.fig.delaxes(ax)
+        
+        self.mpl_connect('draw_event', self._on_draw)
+    
+    def _create_layout(self, with_waveform):
+        rows = 3 if with_waveform else 2
+        grid = self.fig.add_gridspec(rows, 1)
+        layout = {'axes': [], 'waveform': None, 'series': []}
+        row = 0
+        
+        if with_waveform:
+            ax = self.fig.add_subplot(grid[row])
+            ax.set_title('Dạng sóng âm thanh (Waveform)', fontsize=10)
+            ax.set_xlabel('Thời gian (s)')
+            ax.set_ylabel('Biên độ')
+            ax.grid(True, alpha=0.3)
+            layout['waveform'] = DecimatedWaveform(ax, color='steelblue', linewidth=0.5)
+            layout['waveform'].line.set_animated(True)
+            layout['axes'].append(ax)
+            row += 1
+        
+        for title, ylabel, color in [
+            ('Năng lượng ngắn hạn (STE)', 'STE', 'orangered'),
+            ('Tốc độ qua điểm không (ZCR)', 'ZCR', 'forestgreen')
+        ]:
+            ax = self.fig.add_subplot(grid[row])
+            ax.set_title(title, fontsize=10)
+            ax.set_xlabel('Thời gian (s)')
+            ax.set_ylabel(ylabel)
+            ax.grid(True, alpha=0.3)
+            line, = ax.plot([], [], color=color, linewidth=1, animated=True)
+            fill = ax.fill_between([0, 1], [0, 0], alpha=0.3, color=color, animated=True)
+            layout['series'].append((ax, line, fill))
+            layout['axes'].append(ax)
+            row += 1
+        
+        return layout
+    
+    def _animated_artists(self):
+        if self.active_layout is None:
+            return []
+        layout = self.layouts[self.active_layout]
+        artists = []
+        if layout['waveform'] is not None:
+            artists.append(layout['waveform'].line)
+        for _, line, fill in layout['series']:
+            artists.extend([fill, line])
+        return artists
+    
+    def _on_draw(self, event):
+        """Sau mỗi lần vẽ đầy đủ: lưu nền (không gồm dữ liệu) rồi vẽ dữ liệu lên trên."""
+        self._background = self.copy_from_bbox(self.fig.bbox)
+        for artist in self._animated_artists():
+            artist.axes.draw_artist(artist)
+    
+    def _activate(self, name):
+        """Chuyển bố cục; trả về True nếu cần vẽ lại toàn bộ."""
+        if self.active_layout == name:
+            return False
+        
+        if self.active_layout is not None:
+            for ax in self.layouts[self.active_layout]['axes']:
+                self.fig.delaxes(ax)
+        for ax in self.layouts[name]['axes']:
+            self.fig.add_axes(ax)
+        self.active_layout = name
+        
+        # Chỉ căn lề lại khi đổi bố cục, không phải mỗi lần chọn bài
+        self.fig.tight_layout()
+        return True
+    
+    def _set_limits(self, ax, xlim, ylim):
+        """Đặt giới hạn trục; trả về True nếu giới hạn thay đổi."""
+        if np.allclose(ax.get_xlim(), xlim) and np.allclose(ax.get_ylim(), ylim):
+            return False
+        ax.set_xlim(*xlim)
+        ax.set_ylim(*ylim)
+        return True
+    
+    def _update_series(self, ste_values, zcr_values, duration):
+        changed = False
+        for (ax, line, fill), values in zip(self.layouts[self.active_layout]['series'],
+                                            [ste_values, zcr_values]):
+            values = np.asarray(values)
+            frame_times = np.linspace(0, duration, len(values))
+            line.set_data(frame_times, values)
+            
+            if len(values):
+                # Đa giác tô: đi theo đường dữ liệu rồi khép lại trên trục 0
+                verts = np.empty((len(values) + 2, 2))
+                verts[0] = (frame_times[0], 0)
+                verts[1:-1, 0] = frame_times
+                verts[1:-1, 1] = values
+                verts[-1] = (frame_times[-1], 0)
+                fill.set_verts([verts])
+                top = float(np.max(values))
+            else:
+                fill.set_verts([])
+                top = 0.0
+            
+            xlim = (0, duration if duration > 0 else 1)
+            ylim = (0, 1.05 * top if top > 0 else 1)
+            changed = self._set_limits(ax, xlim, ylim) or changed
+        return changed
+    
+    def show_analysis(self, audio_handle, ste_values, zcr_values, duration):
+        """Hiển thị kết quả phân tích (có dạng sóng vẽ từ bao min/max của AudioHandle)."""
+        full_redraw = self._activate('full')
+        waveform = self.layouts['full']['waveform']
+        old_limits = (waveform.ax.get_xlim(), waveform.ax.get_ylim())
+        waveform.set_audio(None, audio_handle.sample_rate, audio_handle.envelope,
+                           audio_handle.num_samples)
+        full_redraw = full_redraw or old_limits != (waveform.ax.get_xlim(), waveform.ax.get_ylim())
+        full_redraw = self._update_series(ste_values, zcr_values, duration) or full_redraw
+        self.refresh(full_redraw)
+    
+    def show_saved(self, ste_values, zcr_values, duration):
+        """Hiển thị STE/ZCR đã lưu của một bài trong kho."""
+        full_redraw = self._activate('saved')
+        full_redraw = self._update_series(ste_values, zcr_values, duration) or full_redraw
+        self.refresh(full_redraw)
+    
+    def print_figure(self, *args, **kwargs):
+        # Khi lưu ảnh (nút Save của toolbar) các đối tượng animated bị bỏ qua,
+        # nên tạm thời vẽ chúng như đối tượng thường
+        artists = self._animated_artists()
+        for artist in artists:
+            artist.set_animated(False)
+        try:
+            return super().print_figure(*args, **kwargs)
+        finally:
+            for artist in artists:
+                artist.set_animated(True)
+    
+    def refresh(self, full_redraw=False):
+        """Vẽ lại: blit nếu nền còn dùng được, ngược lại vẽ toàn bộ."""
+        if full_redraw or self._background is None:
+            self.draw_idle()
+            return
+        self.restore_region(self._background)
+        for artist in self._animated_artists():
+            artist.axes.draw_artist(artist)
+        self.blit(self.fig.bbox)
@@ -0,0 +1,203 @@
+"""
+Module 10: Do thoi gian tung buoc (Profiling)
+Bo dem thoi gian dang context manager va bo dem su kien cho cac buoc xu ly
+(giai ma, phan khung, STE, ZCR, ghi database, tim kiem), tuy chon them cProfile
+va tracemalloc. Khi tat (mac dinh), moi lan goi stage() chi ton mot lenh kiem tra.
+
+Vi du:
+    import profiling
+    profiling.enable()
+    process_audio_file('a.wav')
+    print(profiling.format_stats())
+"""
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+_enabled = False
+_trace_memory = False
+_profiler = None
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+
+
+class _NullStage:
+    """Context rỗng dùng khi tắt đo đạc."""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Đo một lần chạy của một bước và cộng dồn vào thống kê chung."""
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        # tracemalloc chỉ có một mốc đỉnh: với các bước lồng nhau, đỉnh của bước
+        # ngoài chỉ tính từ lúc bước trong cuối cùng kết thúc
+        if _trace_memory:
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start
+        peak = None
+        if _trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] - self.memory_start
+        
+        with _lock:
+            stats = _stages.get(self.name)
+            if stats is None:
+                stats = _stages[self.name] = {
+                    'count': 0, 'total_s': 0.0, 'min_s': float('inf'), 'max_s': 0.0,
+                    'peak_bytes': 0
+                }
+            stats['count'] += 1
+            stats['total_s'] += elapsed
+            stats['min_s'] = min(stats['min_s'], elapsed)
+            stats['max_s'] = max(stats['max_s'], elapsed)
+            if peak is not None:
+                stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+        return False
+
+
+def stage(name):
+    """
+    Context manager đo thời gian một bước:
+        
+        with profiling.stage('audio.decode'):
+            ...
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name, value=1):
+    """Cộng value vào bộ đếm name (vd. số mẫu đã giải mã, số lần cache hit)."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def enable(profile=False, trace_memory=False):
+    """
+    Bật đo đạc.
+    
+    Args:
+        profile (bool): Chạy thêm cProfile cho toàn bộ tiến trình (chậm hơn đáng kể)
+        trace_memory (bool): Ghi bộ nhớ đỉnh của từng bước bằng tracemalloc
+    """
+    global _enabled, _trace_memory, _profiler
+    
+    _enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def disable():
+    """Tắt đo đạc (thống kê đã thu được vẫn giữ lại)."""
+    global _enabled, _trace_memory
+    
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _trace_memory = False
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Xóa thống kê và kết quả cProfile đã thu."""
+    global _profiler
+    
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = cProfile.Profile()
+        if _enabled:
+            _profiler.enable()
+
+
+def get_stats():
+    """
+    Thống kê đã thu.
+    
+    Returns:
+        dict: {'stages': {tên: {'count', 'total_s', 'mean_s', 'min_s', 'max_s', 'peak_bytes'}},
+               'counters': {tên: giá trị}}
+    """
+    with _lock:
+        stages = {}
+        for name, stats in _stages.items():
+            stages[name] = dict(stats, mean_s=stats['total_s'] / stats['count'])
+        return {'stages': stages, 'counters': dict(_counters)}
+
+
+def format_stats(stats=None):
+    """Bảng thống kê dạng văn bản, sắp theo tên bước."""
+    if stats is None:
+        stats = get_stats()
+    
+    lines = [f"{'Buoc':<28}{'So lan':>8}{'Tong (ms)':>12}{'TB (ms)':>10}{'Max (ms)':>10}{'Bo nho (KB)':>13}"]
+    for name in sorted(stats['stages']):
+        item = stats['stages'][name]
+        lines.append(
+            f"{name:<28}{item['count']:>8}{item['total_s'] * 1000:>12.2f}"
+            f"{item['mean_s'] * 1000:>10.3f}{item['max_s'] * 1000:>10.3f}"
+            f"{item['peak_bytes'] / 1024:>13.1f}"
+        )
+    
+    if stats['counters']:
+        lines.append("")
+        lines.extend(f"{name:<28}{value:>12}" for name, value in sorted(stats['counters'].items()))
+    return '\n'.join(lines)
+
+
+def profile_report(limit=25, sort='cumulative'):
+    """Kết quả cProfile (nếu đã bật với profile=True) dạng văn bản."""
+    if _profiler is None:
+        return ""
+    
+    stream = io.StringIO()
+    pstats.Stats(_profiler, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+# Test module
+if __name__ == "__main__":
+    print("=== Module Đo thời gian ===")
+    
+    enable()
+    for _ in range(3):
+        with stage('demo.sleep'):
+            time.sleep(0.01)
+    count('demo.items', 3)
+    print(format_stats())
@@ -0,0 +1,338 @@
+"""
+Module 14: Nen vector dac trung (Vector Quantization)
+Ma hoa vector dac trung thanh vai byte bang luong tu hoa vo huong (SQ) hoac luong tu
+hoa tich (PQ), tinh khoang cach bat doi xung (ADC) truc tiep tren ma va xep hang lai
+chinh xac mot danh sach ung vien ngan.
+
+Vi du:
+    engine = SearchEngine(db)
+    engine.build_quantized_index(codec='pq')
+    results = engine.search_quantized(query_matrix, top_k=10, rerank_k=100)
+"""
+
+import numpy as np
+
+from audio_processing import DEFAULT_FEATURE_VERSION
+from search_engine import merge_topk
+
+
+CODECS = ('sq', 'pq')
+
+
+def _assign(points, centroids, block_size=8192):
+    """
+    (nhãn, bình phương khoảng cách) tới tâm gần nhất của từng điểm, xử lý theo khối
+    để ma trận khoảng cách tạm chỉ là block_size x num_centroids.
+    """
+    labels = np.empty(len(points), dtype=np.int64)
+    nearest = np.empty(len(points))
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        # ||x||^2 cộng sau: không đổi thứ tự tâm trong cùng một dòng
+        distances = centroid_norms[None, :] - 2.0 * (block @ centroids.T)
+        block_labels = np.argmin(distances, axis=1)
+        labels[start:start + block_size] = block_labels
+        nearest[start:start + block_size] = (distances[np.arange(len(block)), block_labels]
+                                             + np.einsum('ij,ij->i', block, block))
+    return labels, nearest
+
+
+def _kmeans(points, num_centroids, iterations, rng):
+    """k-means (Lloyd) đơn giản; khởi tạo bằng các điểm chọn ngẫu nhiên."""
+    unique = np.unique(points, axis=0)
+    num_centroids = min(num_centroids, len(unique))
+    centroids = unique[rng.choice(len(unique), num_centroids, replace=False)].astype(np.float64)
+    
+    for _ in range(iterations):
+        labels, nearest = _assign(points, centroids)
+        
+        counts = np.bincount(labels, minlength=num_centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Cụm rỗng: đặt lại vào điểm xa tâm của nó nhất
+        if empty.any():
+            farthest = np.argsort(nearest)[::-1]
+            centroids[empty] = points[farthest[:empty.sum()]]
+    
+    return centroids
+
+
+class VectorQuantizer:
+    """
+    Bộ mã hóa dạng tích: vector D chiều được chia thành num_subspaces đoạn liền nhau,
+    mỗi đoạn thay bằng chỉ số (uint8) của điểm gần nhất trong bảng mã của đoạn đó.
+    
+    - codec='pq': bảng mã mỗi đoạn học bằng k-means (mặc định đoạn 2 chiều)
+    - codec='sq': mỗi chiều là một đoạn, bảng mã là 256 mức đều giữa min và max
+    
+    Khoảng cách ADC giữa truy vấn (không nén) và mã được cộng từ các bảng tra
+    (num_subspaces x num_centroids) tính một lần cho mỗi truy vấn.
+    """
+    
+    def __init__(self, codec='pq', num_subspaces=None, num_centroids=256, iterations=20, seed=0):
+        if codec not in CODECS:
+            raise ValueError(f"Codec khong ho tro: {codec}")
+        if not 1 < num_centroids <= 256:
+            raise ValueError("num_centroids phai trong khoang (1, 256]")
+        
+        self.codec = codec
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None      # (num_subspaces, num_centroids, sub_dim)
+    
+    @property
+    def dim(self):
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+    
+    def code_size(self):
+        """Số byte mã của mỗi vector."""
+        return self.codebooks.shape[0]
+    
+    def fit(self, matrix):
+        """Học bảng mã từ ma trận (N, D)."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        dim = matrix.shape[1]
+        
+        if self.codec == 'sq':
+            low, high = matrix.min(axis=0), matrix.max(axis=0)
+            levels = np.linspace(0.0, 1.0, self.num_centroids)
+            self.codebooks = (low[:, None] + (high - low)[:, None] * levels[None, :])[:, :, None]
+            return self
+        
+        num_subspaces = self.num_subspaces or max(1, dim // 2)
+        if dim % num_subspaces:
+            raise ValueError(f"So chieu {dim} khong chia het cho so doan {num_subspaces}")
+        sub_dim = dim // num_subspaces
+        
+        rng = np.random.default_rng(self.seed)
+        codebooks = np.zeros((num_subspaces, self.num_centroids, sub_dim))
+        for s in range(num_subspaces):
+            centroids = _kmeans(matrix[:, s * sub_dim:(s + 1) * sub_dim], self.num_centroids,
+                                self.iterations, rng)
+            codebooks[s, :len(centroids)] = centroids
+            # Ít điểm phân biệt hơn num_centroids: lặp lại tâm cuối (không bao giờ được chọn thêm)
+            codebooks[s, len(centroids):] = centroids[-1]
+        self.codebooks = codebooks
+        return self
+    
+    def _subvectors(self, matrix):
+        num_subspaces, _, sub_dim = self.codebooks.shape
+        return np.asarray(matrix, dtype=np.float64).reshape(len(matrix), num_subspaces, sub_dim)
+    
+    def encode(self, matrix, block_size=8192):
+        """Ma trận (N, D) -> mã (N, num_subspaces) uint8."""
+        num_subspaces = self.codebooks.shape[0]
+        codes = np.empty((len(matrix), num_subspaces), dtype=np.uint8)
+        
+        for start in range(0, len(matrix), block_size):
+            parts = self._subvectors(matrix[start:start + block_size])
+            if self.codec == 'sq':
+                low = self.codebooks[:, 0, 0]
+                step = self.codebooks[:, 1, 0] - low
+                scaled = np.divide(parts[:, :, 0] - low, step, out=np.zeros_like(parts[:, :, 0]),
+                                   where=step > 0)
+                codes[start:start + block_size] = np.clip(np.rint(scaled), 0, self.num_centroids - 1)
+                continue
+            for s in range(num_subspaces):
+                centroids = self.codebooks[s]
+                distances = (np.einsum('ij,ij->i', centroids, centroids)[None, :]
+                             - 2.0 * parts[:, s] @ centroids.T)
+                codes[start:start + block_size, s] = np.argmin(distances, axis=1)
+        return codes
+    
+    def decode(self, codes):
+        """Mã -> vector xấp xỉ (N, D)."""
+        num_subspaces = self.codebooks.shape[0]
+        parts = self.codebooks[np.arange(num_subspaces)[None, :], codes]
+        return parts.reshape(len(codes), self.dim)
+    
+    def distance_tables(self, queries, method):
+        """Bảng tra (Q, num_subspaces, num_centroids) cho ADC."""
+        parts = self._subvectors(queries)
+        if method == 'euclidean':
+            diff = parts[:, :, None, :] - self.codebooks[None]
+            return np.einsum('qsck,qsck->qsc', diff, diff)
+        if method == 'manhattan':
+            return np.abs(parts[:, :, None, :] - self.codebooks[None]).sum(axis=3)
+        if method == 'cosine':
+            return np.einsum('qsk,sck->qsc', parts, self.codebooks)
+        raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+    
+    def adc_scores(self, tables, codes, method, query_norms=None, code_norms=None):
+        """
+        Điểm (Q, N) giữa các truy vấn (qua bảng tra) và các mã.
+        
+        Với cosine, tables chứa tích vô hướng từng đoạn; query_norms/code_norms là
+        chuẩn của truy vấn và của vector xấp xỉ.
+        """
+        scores = np.zeros((tables.shape[0], len(codes)))
+        for s in range(codes.shape[1]):
+            scores += tables[:, s, codes[:, s]]
+        
+        if method == 'euclidean':
+            np.maximum(scores, 0.0, out=scores)
+            return np.sqrt(scores, out=scores)
+        if method == 'cosine':
+            norms = query_norms[:, None] * code_norms[None, :]
+            similarity = np.zeros_like(scores)
+            np.divide(scores, norms, out=similarity, where=norms > 0)
+            return similarity
+        return scores
+
+
+class QuantizedIndex:
+    """
+    Mã của toàn bộ thư viện (một phiên bản đặc trưng) cùng bộ mã hóa đã học.
+    
+    Chỉ giữ mã uint8, id và chuẩn float32 của vector xấp xỉ; vector gốc không nằm
+    trong bộ nhớ (xếp hạng lại đọc riêng các ứng viên). generation/change_seq là
+    mốc của database (bộ đếm thế hệ, nhật ký thay đổi đặc trưng) mà chỉ mục phản ánh.
+    """
+    
+    def __init__(self, quantizer, ids, codes, generation=None, change_seq=None, code_norms=None):
+        self.quantizer = quantizer
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.codes = codes
+        self.generation = generation
+        self.change_seq = change_seq
+        
+        if code_norms is None:
+            code_norms = self._norms(quantizer, codes)
+        self.code_norms = code_norms
+    
+    @staticmethod
+    def _norms(quantizer, codes):
+        decoded = quantizer.decode(codes)
+        return np.sqrt(np.einsum('ij,ij->i', decoded, decoded)).astype(np.float32)
+    
+    @classmethod
+    def build(cls, ids, matrix, codec='pq', generation=None, sample_size=100000, seed=0, **params):
+        """
+        Học bộ mã hóa trên (một mẫu của) ma trận rồi mã hóa toàn bộ.
+        
+        Args:
+            ids (np.array): Id bài hát của từng dòng
+            matrix (np.array): Ma trận (N, D) vector đặc trưng
+            codec (str): 'pq' hoặc 'sq'
+            sample_size (int): Số dòng tối đa dùng để học bảng mã
+            **params: Tham số thêm cho VectorQuantizer (num_subspaces, num_centroids, iterations)
+        """
+        rng = np.random.default_rng(seed)
+        sample = matrix
+        if len(matrix) > sample_size:
+            sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+        
+        quantizer = VectorQuantizer(codec, seed=seed, **params).fit(sample)
+        return cls(quantizer, ids, quantizer.encode(matrix), generation)
+    
+    @classmethod
+    def from_blocks(cls, quantizer, blocks, generation=None, change_seq=None):
+        """
+        Mã hóa thư viện theo từng khối (ids, ma trận) bằng bộ mã hóa đã học, để
+        không phải giữ toàn bộ vector gốc trong bộ nhớ.
+        """
+        num_subspaces = quantizer.code_size()
+        id_parts = [np.zeros(0, dtype=np.int64)]
+        code_parts = [np.zeros((0, num_subspaces), dtype=np.uint8)]
+        for ids, matrix in blocks:
+            id_parts.append(np.asarray(ids, dtype=np.int64))
+            code_parts.append(quantizer.encode(matrix))
+        return cls(quantizer, np.concatenate(id_parts), np.vstack(code_parts), generation, change_seq)
+    
+    def apply_changes(self, changed_ids, ids, matrix, generation=None, change_seq=None):
+        """
+        Chỉ mục mới sau khi thư viện thay đổi, giữ nguyên bảng mã đã học.
+        
+        Args:
+            changed_ids (np.array): Các bài hát đã thêm/tính lại/xóa (mã cũ bị bỏ)
+            ids (np.array): Các bài trong changed_ids vẫn còn trong thư viện
+            matrix (np.array): Vector hiện tại của ids (chỉ các dòng này được mã hóa)
+        """
+        keep = ~np.isin(self.ids, changed_ids)
+        codes = np.zeros((0, self.codes.shape[1]), dtype=np.uint8)
+        if len(ids):
+            codes = self.quantizer.encode(matrix)
+        return QuantizedIndex(
+            self.quantizer,
+            np.concatenate([self.ids[keep], np.asarray(ids, dtype=np.int64)]),
+            np.vstack([self.codes[keep], codes]),
+            generation, change_seq,
+            np.concatenate([self.code_norms[keep], self._norms(self.quantizer, codes)])
+        )
+    
+    def nbytes(self):
+        """Bộ nhớ của chỉ mục (mã + id + chuẩn), không tính bảng mã."""
+        return self.codes.nbytes + self.ids.nbytes + self.code_norms.nbytes
+    
+    def topk(self, queries, top_k, method, block_size=65536):
+        """
+        Top-k theo khoảng cách ADC, xử lý theo khối mã.
+        
+        Returns:
+            tuple: (scores, indices) dạng (Q, k), đã sắp xếp từ tốt nhất đến kém nhất
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        tables = self.quantizer.distance_tables(queries, method)
+        query_norms = np.sqrt(np.einsum('ij,ij->i', queries, queries))
+        largest = method == 'cosine'
+        best_scores, best_idx = None, None
+        
+        for start in range(0, len(self.codes), block_size):
+            scores = self.quantizer.adc_scores(
+                tables, self.codes[start:start + block_size], method,
+                query_norms, self.code_norms[start:start + block_size]
+            )
+            best_scores, best_idx = merge_topk(best_scores, best_idx, scores, start, top_k, largest)
+        
+        keys = -best_scores if largest else best_scores
+        order = np.lexsort((best_idx, keys), axis=1)
+        return (np.take_along_axis(best_scores, order, axis=1),
+                np.take_along_axis(best_idx, order, axis=1))
+
+
+def measure_recall(engine, query_matrix, top_k=10, method='euclidean',
+                   feature_version=DEFAULT_FEATURE_VERSION, rerank_k=100):
+    """
+    So sánh search_quantized với tìm kiếm chính xác trên cùng các truy vấn.
+    
+    Returns:
+        dict: recall@k (tỉ lệ kết quả chính xác có trong kết quả nén, trung bình theo
+              truy vấn), bộ nhớ mỗi bài của chỉ mục nén và của ma trận float64/float32
+    """
+    exact = engine.search_similar_batch(query_matrix, top_k, method, feature_version=feature_version)
+    approx = engine.search_quantized(query_matrix, top_k, method, feature_version, rerank_k)
+    
+    recalls = []
+    for exact_results, approx_results in zip(exact, approx):
+        if exact_results:
+            expected = {song['id'] for song in exact_results}
+            recalls.append(len(expected & {song['id'] for song in approx_results}) / len(expected))
+    
+    index = engine.quantized_indexes[feature_version]
+    count = max(len(index.ids), 1)
+    dim = index.quantizer.dim
+    return {
+        'codec': index.quantizer.codec,
+        'top_k': top_k,
+        'rerank_k': rerank_k,
+        'recall': float(np.mean(recalls)) if recalls else None,
+        'bytes_per_song': index.nbytes() / count,
+        'code_bytes': index.quantizer.code_size(),
+        'float64_bytes_per_song': dim * 8 + 8,
+        'float32_bytes_per_song': dim * 4 + 8
+    }
+
+
+# Test module
+if __name__ == "__main__":
+    print("=== Module Nén vector đặc trưng ===")
+    print("Các hàm có sẵn:")
+    print("- VectorQuantizer(codec, num_subspaces, num_centroids): fit / encode / decode")
+    print("- QuantizedIndex.build(ids, matrix, codec) / index.topk(queries, top_k, method)")
+    print("- measure_recall(engine, query_matrix, top_k, method, feature_version, rerank_k)")
@@ -3,19 +3,218 @@ Module 3: Logic Tìm kiếm & Phân loại (Search Engine & Logic)
 Xử lý logic so sánh để tìm ra sự tương đồng hoặc phân loại âm thanh.
 """
 
+import threading
 import numpy as np
+from collections import OrderedDict
+import profiling
 from database_manager import DatabaseManager
+from audio_processing import DEFAULT_FEATURE_VERSION, classify_audio_batch, calibrate_thresholds
+
+
+def _score_block(queries, block, method):
+    """Tính ma trận điểm (Q, B) giữa các vector truy vấn và một khối vector thư viện."""
+    # Khối float32 (từ FeatureStore) được tính ở float64 để công thức khai triển bên
+    # dưới không mất chính xác; chỉ sao chép một khối mỗi lần
+    queries = np.asarray(queries, dtype=np.float64)
+    block = np.asarray(block, dtype=np.float64)
+    if method == 'euclidean':
+        # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x  (phần q.x chạy bằng BLAS)
+        squared = (
+            np.einsum('ij,ij->i', queries, queries)[:, None]
+            + np.einsum('ij,ij->i', block, block)[None, :]
+            - 2.0 * (queries @ block.T)
+        )
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared, out=squared)
+    elif method == 'cosine':
+        dots = queries @ block.T
+        norms = np.sqrt(np.einsum('ij,ij->i', queries, queries))[:, None] * \
+            np.sqrt(np.einsum('ij,ij->i', block, block))[None, :]
+        # Tránh chia cho 0: giống cosine_similarity, vector rỗng cho điểm 0
+        similarity = np.zeros_like(dots)
+        np.divide(dots, norms, out=similarity, where=norms > 0)
+        return similarity
+    elif method == 'manhattan':
+        # Cộng dồn theo từng chiều để bộ nhớ chỉ là (Q, B) chứ không phải (Q, B, D)
+        distance = np.zeros((queries.shape[0], block.shape[0]))
+        for d in range(queries.shape[1]):
+            distance += np.abs(queries[:, d, None] - block[None, :, d])
+        return distance
+    else:
+        raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+
+
+def merge_topk(best_scores, best_idx, scores, offset, top_k, largest):
+    """Gộp điểm của một khối mới vào top-k hiện tại của từng truy vấn."""
+    block_idx = np.broadcast_to(
+        np.arange(offset, offset + scores.shape[1]), scores.shape
+    )
+    if best_scores is not None:
+        scores = np.concatenate([best_scores, scores], axis=1)
+        block_idx = np.concatenate([best_idx, block_idx], axis=1)
+    
+    k = min(top_k, scores.shape[1])
+    keys = -scores if largest else scores
+    if k < scores.shape[1]:
+        part = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    
+    return (np.take_along_axis(scores, part, axis=1),
+            np.take_along_axis(block_idx, part, axis=1))
+
+
+def _blocked_topk(queries, matrix, top_k, method, block_size=4096):
+    """
+    Top-k theo từng truy vấn trên toàn bộ ma trận thư viện, xử lý theo khối.
+    
+    Bộ nhớ tạm chỉ phụ thuộc vào Q x block_size, không phụ thuộc kích thước thư viện.
+    
+    Returns:
+        tuple: (scores, indices) dạng (Q, k), đã sắp xếp từ tốt nhất đến kém nhất
+    """
+    largest = method == 'cosine'
+    best_scores, best_idx = None, None
+    
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size]
+        scores = _score_block(queries, block, method)
+        best_scores, best_idx = merge_topk(
+            best_scores, best_idx, scores, start, top_k, largest
+        )
+    
+    # Sắp xếp lại top-k (ổn định, ưu tiên bài có chỉ số nhỏ hơn khi bằng điểm)
+    keys = -best_scores if largest else best_scores
+    order = np.lexsort((best_idx, keys), axis=1)
+    
+    return (np.take_along_axis(best_scores, order, axis=1),
+            np.take_along_axis(best_idx, order, axis=1))
+
+
+# Số láng giềng được tính sẵn cho mỗi bài hát (gợi ý nhiều hơn sẽ tìm trực tiếp)
+NEIGHBOR_K = 20
+
+
+class SearchCache:
+    """
+    Cache LRU cho kết quả search_similar.
+    
+    Chỉ lưu id và điểm của các kết quả; thông tin bài hát được đọc lại
+    khi trúng cache, nên cache nhỏ và người gọi sửa kết quả không ảnh hưởng tới cache.
+    
+    Khóa gồm vector truy vấn đã lượng tử hóa tương đối (giữ mantissa_bits bit
+    định trị của từng thành phần, nên các đặc trưng có thang đo khác nhau đều
+    được làm tròn như nhau), phương pháp, top_k và phiên bản đặc trưng. Toàn bộ
+    cache bị xóa khi bộ đếm thế hệ của thư viện thay đổi.
+    """
+    
+    def __init__(self, max_entries=256, mantissa_bits=20):
+        self.max_entries = max_entries
+        self.mantissa_bits = mantissa_bits
+        self._entries = OrderedDict()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def make_key(self, query_vector, method, top_k, feature_version):
+        mantissa, exponent = np.frexp(np.asarray(query_vector, dtype=np.float64))
+        quantized = np.round(mantissa * (1 << self.mantissa_bits)).astype(np.int64)
+        return (quantized.tobytes(), exponent.astype(np.int32).tobytes(),
+                method, top_k, feature_version)
+    
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation = generation
+    
+    def get(self, key, generation):
+        """(các id, các điểm, score_type) đã lưu hoặc None."""
+        self._check_generation(generation)
+        
+        results = self._entries.get(key)
+        if results is None:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return results
+    
+    def put(self, key, generation, results):
+        self._check_generation(generation)
+        
+        self._entries[key] = (
+            tuple(result['id'] for result in results),
+            tuple(result['score'] for result in results),
+            results[0]['score_type'] if results else None
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
 
 
 class SearchEngine:
 
     
-    def __init__(self, db_manager=None):
+    def __init__(self, db_manager=None, cache_size=256, feature_store=None):
 
         if db_manager is None:
             self.db = DatabaseManager()
         else:
             self.db = db_manager
+        
+        # FeatureStore (file vector ánh xạ bộ nhớ cạnh database); True để dùng kho mặc định
+        if feature_store is True:
+            from feature_store import FeatureStore
+            feature_store = FeatureStore(self.db.db_path)
+        self.feature_store = feature_store
+        
+        # Chỉ mục vector nén theo phiên bản đặc trưng (xem build_quantized_index)
+        self.quantized_indexes = {}
+        
+        # cache_size=0 để tắt cache kết quả tìm kiếm
+        self.cache = SearchCache(cache_size) if cache_size > 0 else None
+        
+        # Độ phổ biến từ lịch sử tìm kiếm, đọc lại khi lịch sử thay đổi
+        self._popularity = {}
+        self._popularity_marker = None
+        
+        # Luồng nền cập nhật bảng láng giềng (tạo khi cần, xem schedule_neighbor_refresh)
+        self._neighbor_thread = None
+        self._neighbor_event = threading.Event()
+        self._neighbor_stop = False
+    
+    def close(self):
+        """Dừng luồng nền cập nhật láng giềng (nếu có)."""
+        if self._neighbor_thread is not None:
+            self._neighbor_stop = True
+            self._neighbor_event.set()
+            self._neighbor_thread.join()
+            self._neighbor_thread = None
+    
+    def cache_stats(self):
+        """Thống kê hit/miss của cache tìm kiếm (None nếu cache bị tắt)."""
+        return self.cache.stats() if self.cache else None
     
     def euclidean_distance(self, vector1, vector2):
 
@@ -87,7 +286,19 @@ class SearchEngine:
         
         return distance
     
-    def search_similar(self, query_vector, top_k=5, method='euclidean'):
+    def _get_feature_vectors(self, feature_version=None):
+        """
+        Vector đặc trưng của các bài hát tương thích với feature_version.
+        
+        Bản ghi cũ chưa gắn phiên bản được tính bằng cấu hình mặc định nên chỉ
+        so sánh được với DEFAULT_FEATURE_VERSION.
+        """
+        return self.db.get_all_feature_vectors(
+            feature_version,
+            include_legacy=(feature_version == DEFAULT_FEATURE_VERSION)
+        )
+    
+    def search_similar(self, query_vector, top_k=5, method='euclidean', feature_version=None):
         """
         Tìm kiếm các bài hát tương đồng với vector đầu vào.
         
@@ -95,58 +306,337 @@ class SearchEngine:
             query_vector (np.array): Vector đặc trưng của file cần tìm
             top_k (int): Số kết quả trả về
             method (str): Phương pháp tính khoảng cách ('euclidean', 'cosine', 'manhattan')
+            feature_version (str): Chỉ so sánh với bản ghi cùng phiên bản đặc trưng (None: tất cả)
             
         Returns:
             list: Danh sách top_k bài hát tương đồng nhất
         """
-        # Lấy tất cả vector từ database
-        all_vectors = self.db.get_all_feature_vectors()
+        with profiling.stage('search.search_similar'):
+            if self.cache is not None:
+                with profiling.stage('search.cache_lookup'):
+                    generation = self.db.get_library_generation()
+                    cache_key = self.cache.make_key(query_vector, method, top_k, feature_version)
+                    cached = self.cache.get(cache_key, generation)
+                if cached is not None:
+                    profiling.count('search.cache_hits')
+                    song_ids, scores, score_type = cached
+                    return self._build_results(song_ids, scores, score_type, {})
+                
+                results = self._search_similar(query_vector, top_k, method, feature_version)
+                self.cache.put(cache_key, generation, results)
+                return results
+            
+            return self._search_similar(query_vector, top_k, method, feature_version)
+    
+    def _search_similar(self, query_vector, top_k, method, feature_version):
+
+        if self.feature_store is not None and feature_version is not None:
+            # Có kho vector: dùng đường tìm theo khối trên ma trận đã ánh xạ
+            return self.search_similar_batch(
+                np.asarray(query_vector)[None, :], top_k, method, feature_version=feature_version
+            )[0]
+        
+        # Lấy các vector tương thích từ database
+        with profiling.stage('search.load_vectors'):
+            all_vectors = self._get_feature_vectors(feature_version)
         
         if not all_vectors:
             return []
         
-        # Tính khoảng cách/độ tương đồng với mỗi bài hát
-        results = []
-        
-        for song_id, feature_vector in all_vectors:
-            if method == 'euclidean':
-                score = self.euclidean_distance(query_vector, feature_vector)
-                # Khoảng cách nhỏ = tương đồng cao
-                results.append((song_id, score, 'distance'))
-            elif method == 'cosine':
-                score = self.cosine_similarity(query_vector, feature_vector)
-                # Similarity cao = tương đồng cao
-                results.append((song_id, score, 'similarity'))
-            elif method == 'manhattan':
-                score = self.manhattan_distance(query_vector, feature_vector)
-                results.append((song_id, score, 'distance'))
+        with profiling.stage('search.score'):
+            # Tính khoảng cách/độ tương đồng với mỗi bài hát
+            results = []
+            
+            for song_id, feature_vector in all_vectors:
+                if method == 'euclidean':
+                    score = self.euclidean_distance(query_vector, feature_vector)
+                    # Khoảng cách nhỏ = tương đồng cao
+                    results.append((song_id, score, 'distance'))
+                elif method == 'cosine':
+                    score = self.cosine_similarity(query_vector, feature_vector)
+                    # Similarity cao = tương đồng cao
+                    results.append((song_id, score, 'similarity'))
+                elif method == 'manhattan':
+                    score = self.manhattan_distance(query_vector, feature_vector)
+                    results.append((song_id, score, 'distance'))
+                else:
+                    raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+            
+            # Sắp xếp kết quả
+            if results[0][2] == 'distance':
+                # Sắp xếp theo khoảng cách tăng dần (nhỏ nhất trước)
+                results.sort(key=lambda x: x[1])
             else:
-                raise ValueError(f"Phương pháp không hỗ trợ: {method}")
-        
-        # Sắp xếp kết quả
-        if results[0][2] == 'distance':
-            # Sắp xếp theo khoảng cách tăng dần (nhỏ nhất trước)
-            results.sort(key=lambda x: x[1])
-        else:
-            # Sắp xếp theo độ tương đồng giảm dần (lớn nhất trước)
-            results.sort(key=lambda x: x[1], reverse=True)
+                # Sắp xếp theo độ tương đồng giảm dần (lớn nhất trước)
+                results.sort(key=lambda x: x[1], reverse=True)
         
         # Lấy thông tin chi tiết của top_k kết quả
         top_results = []
-        for i, (song_id, score, score_type) in enumerate(results[:top_k]):
-            song_info = self.db.get_song_by_id(song_id)
-            if song_info:
-                song_info['score'] = score
-                song_info['score_type'] = score_type
-                song_info['rank'] = i + 1
-                top_results.append(song_info)
+        with profiling.stage('search.fetch_songs'):
+            for i, (song_id, score, score_type) in enumerate(results[:top_k]):
+                song_info = self.db.get_song_by_id(song_id, include_series=False)
+                if song_info:
+                    song_info['score'] = score
+                    song_info['score_type'] = score_type
+                    song_info['rank'] = i + 1
+                    top_results.append(song_info)
         
         return top_results
     
     def search_by_audio_file(self, processed_data, top_k=5, method='euclidean'):
 
         query_vector = processed_data['feature_vector']
-        return self.search_similar(query_vector, top_k, method)
+        # Chỉ so sánh với các bài hát được trích đặc trưng bằng cùng cấu hình
+        feature_version = processed_data.get('feature_version', DEFAULT_FEATURE_VERSION)
+        return self.search_similar(query_vector, top_k, method, feature_version)
+    
+    def _load_library_matrix(self, feature_version=None):
+        """
+        Đọc các vector đặc trưng thành (mảng id, ma trận N x D).
+        
+        Với feature_store, ma trận là float32 ánh xạ từ file (không đọc SQLite nếu
+        thư viện không đổi); ngược lại là float64 đọc từ database.
+        """
+        if self.feature_store is not None and feature_version is not None:
+            with profiling.stage('search.feature_store'):
+                return self.feature_store.load(self.db, feature_version)
+        
+        all_vectors = self._get_feature_vectors(feature_version)
+        
+        if not all_vectors:
+            return np.zeros(0, dtype=np.int64), None
+        
+        ids = np.array([song_id for song_id, _ in all_vectors], dtype=np.int64)
+        matrix = np.vstack([vector for _, vector in all_vectors]).astype(np.float64)
+        return ids, matrix
+    
+    def search_similar_batch(self, query_matrix, top_k=5, method='euclidean',
+                             block_size=4096, query_block_size=1024, feature_version=None):
+        """
+        Tìm kiếm tương đồng cho nhiều truy vấn cùng lúc.
+        
+        Thư viện chỉ được đọc một lần; khoảng cách được tính theo khối bằng phép
+        nhân ma trận nên bộ nhớ tạm bị chặn bởi query_block_size x block_size.
+        
+        Args:
+            query_matrix (np.array): Ma trận (Q, D), mỗi dòng là một vector truy vấn
+            top_k (int): Số kết quả trả về cho mỗi truy vấn
+            method (str): Phương pháp ('euclidean', 'cosine', 'manhattan')
+            block_size (int): Số bài hát trong mỗi khối thư viện
+            query_block_size (int): Số truy vấn xử lý trong mỗi lượt
+            feature_version (str): Chỉ so sánh với bản ghi cùng phiên bản đặc trưng (None: tất cả)
+        
+        Returns:
+            list: Q danh sách kết quả, cùng định dạng với search_similar
+        """
+        if method not in ('euclidean', 'cosine', 'manhattan'):
+            raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+        
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float64))
+        with profiling.stage('search.load_vectors'):
+            ids, matrix = self._load_library_matrix(feature_version)
+        
+        if matrix is None or top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+        
+        if queries.shape[1] != matrix.shape[1]:
+            raise ValueError("Kích thước vector truy vấn không khớp với thư viện")
+        
+        score_type = 'similarity' if method == 'cosine' else 'distance'
+        song_cache = {}
+        all_results = []
+        
+        for start in range(0, queries.shape[0], query_block_size):
+            with profiling.stage('search.score'):
+                scores, indices = _blocked_topk(
+                    queries[start:start + query_block_size], matrix,
+                    top_k, method, block_size
+                )
+            
+            for row_scores, row_indices in zip(scores, indices):
+                all_results.append(
+                    self._build_results(ids[row_indices], row_scores, score_type, song_cache)
+                )
+        
+        return all_results
+    
+    def _build_results(self, song_ids, scores, score_type, song_cache):
+        """Danh sách kết quả (thông tin bài hát + điểm + hạng) cho một truy vấn."""
+        top_results = []
+        for song_id, score in zip(song_ids, scores):
+            song_id = int(song_id)
+            if song_id not in song_cache:
+                song_cache[song_id] = self.db.get_song_by_id(song_id, include_series=False)
+            if song_cache[song_id]:
+                song_info = dict(song_cache[song_id])
+                song_info['score'] = float(score)
+                song_info['score_type'] = score_type
+                song_info['rank'] = len(top_results) + 1
+                top_results.append(song_info)
+        return top_results
+    
+    def _iter_feature_blocks(self, ids, feature_version, block_size):
+        """(ids, ma trận) của từng khối block_size bài hát, đọc lần lượt từ database."""
+        include_legacy = feature_version == DEFAULT_FEATURE_VERSION
+        for start in range(0, len(ids), block_size):
+            rows = self.db.get_feature_vectors_by_ids(ids[start:start + block_size],
+                                                      feature_version=feature_version,
+                                                      include_legacy=include_legacy)
+            if rows:
+                yield (np.array([song_id for song_id, _ in rows], dtype=np.int64),
+                       np.vstack([vector for _, vector in rows]))
+    
+    def build_quantized_index(self, feature_version=DEFAULT_FEATURE_VERSION, codec='pq',
+                              sample_size=100000, seed=0, block_size=10000, **params):
+        """
+        Học bộ mã hóa và nén toàn bộ vector của một phiên bản đặc trưng.
+        
+        Bảng mã được học trên một mẫu ngẫu nhiên sample_size bài; sau đó thư viện
+        được đọc và mã hóa theo khối block_size bài, nên vector gốc không bao giờ
+        nằm trọn trong bộ nhớ.
+        
+        Args:
+            feature_version (str): Phiên bản đặc trưng (None: tất cả bản ghi)
+            codec (str): 'pq' (lượng tử hóa tích, k-means từng đoạn) hoặc 'sq' (8 bit mỗi chiều)
+            sample_size (int): Số bài tối đa dùng để học bảng mã
+            block_size (int): Số bài đọc và mã hóa mỗi lượt
+            **params: num_subspaces, num_centroids, iterations
+        
+        Returns:
+            QuantizedIndex: hoặc None nếu thư viện rỗng
+        """
+        from quantization import QuantizedIndex, VectorQuantizer
+        
+        with profiling.stage('search.quantize'):
+            # Đọc mốc trước dữ liệu: thay đổi xen giữa sẽ được áp dụng lại ở lần tìm sau
+            generation = self.db.get_library_generation()
+            change_seq = self.db.get_feature_change_seq()
+            ids = self.db.get_feature_ids(feature_version, feature_version == DEFAULT_FEATURE_VERSION)
+            if len(ids) == 0:
+                self.quantized_indexes.pop(feature_version, None)
+                return None
+            
+            rng = np.random.default_rng(seed)
+            sample_ids = ids
+            if len(ids) > sample_size:
+                sample_ids = np.sort(rng.choice(ids, sample_size, replace=False))
+            sample = np.vstack([matrix for _, matrix in
+                                self._iter_feature_blocks(sample_ids, feature_version, block_size)])
+            
+            quantizer = VectorQuantizer(codec, seed=seed, **params).fit(sample)
+            del sample
+            index = QuantizedIndex.from_blocks(
+                quantizer, self._iter_feature_blocks(ids, feature_version, block_size),
+                generation, change_seq
+            )
+        
+        self.quantized_indexes[feature_version] = index
+        return index
+    
+    def _get_quantized_index(self, feature_version):
+        """
+        Chỉ mục nén đã dựng, cập nhật theo nhật ký thay đổi đặc trưng nếu thư viện
+        đã thay đổi: chỉ các bài được thêm/tính lại được mã hóa (giữ bảng mã), bài
+        bị xóa được bỏ khỏi chỉ mục.
+        """
+        index = self.quantized_indexes.get(feature_version)
+        if index is None:
+            raise ValueError("Chua co chi muc nen cho phien ban nay, goi build_quantized_index truoc")
+        
+        generation = self.db.get_library_generation()
+        if index.generation == generation:
+            return index
+        
+        with profiling.stage('search.quantize'):
+            change_seq = self.db.get_feature_change_seq()
+            changed_ids = self.db.get_feature_changes(index.change_seq, change_seq)
+            if changed_ids is None:
+                # Nhật ký đã bị xóa bớt qua mốc của chỉ mục: mã hóa lại cả thư viện (giữ bảng mã)
+                from quantization import QuantizedIndex
+                ids = self.db.get_feature_ids(feature_version, feature_version == DEFAULT_FEATURE_VERSION)
+                index = QuantizedIndex.from_blocks(
+                    index.quantizer, self._iter_feature_blocks(ids, feature_version, 10000),
+                    generation, change_seq
+                )
+                self.quantized_indexes[feature_version] = index
+                return index
+            if len(changed_ids) == 0:
+                # Chỉ đổi tên/phân loại...: mã không đổi
+                index.generation, index.change_seq = generation, change_seq
+                return index
+            
+            rows = self.db.get_feature_vectors_by_ids(
+                changed_ids, feature_version=feature_version,
+                include_legacy=(feature_version == DEFAULT_FEATURE_VERSION)
+            )
+            ids = np.array([song_id for song_id, _ in rows], dtype=np.int64)
+            matrix = np.vstack([vector for _, vector in rows]) if rows else None
+            index = index.apply_changes(changed_ids, ids, matrix, generation, change_seq)
+        
+        self.quantized_indexes[feature_version] = index
+        return index
+    
+    def search_quantized(self, query_matrix, top_k=5, method='euclidean',
+                         feature_version=DEFAULT_FEATURE_VERSION, rerank_k=100, query_block_size=1024):
+        """
+        Tìm kiếm trên chỉ mục vector nén.
+        
+        Khoảng cách được tính bất đối xứng (truy vấn gốc với vector nén) qua bảng tra,
+        lấy rerank_k ứng viên tốt nhất cho mỗi truy vấn rồi xếp hạng lại chính xác
+        bằng vector gốc của riêng các ứng viên đó.
+        
+        Args:
+            query_matrix (np.array): Ma trận (Q, D) hoặc một vector truy vấn
+            rerank_k (int): Số ứng viên xếp hạng lại (0: trả về điểm xấp xỉ)
+        
+        Returns:
+            list: Q danh sách kết quả, cùng định dạng với search_similar_batch
+        """
+        if method not in ('euclidean', 'cosine', 'manhattan'):
+            raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+        
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float64))
+        index = self._get_quantized_index(feature_version)
+        if len(index.ids) == 0 or top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+        if queries.shape[1] != index.quantizer.dim:
+            raise ValueError("Kích thước vector truy vấn không khớp với thư viện")
+        
+        score_type = 'similarity' if method == 'cosine' else 'distance'
+        largest = method == 'cosine'
+        song_cache = {}
+        all_results = []
+        
+        for start in range(0, queries.shape[0], query_block_size):
+            block = queries[start:start + query_block_size]
+            with profiling.stage('search.score'):
+                scores, indices = index.topk(block, max(top_k, rerank_k), method)
+            
+            if rerank_k <= 0:
+                for row_scores, row_indices in zip(scores, indices):
+                    all_results.append(
+                        self._build_results(index.ids[row_indices], row_scores, score_type, song_cache)
+                    )
+                continue
+            
+            with profiling.stage('search.rerank'):
+                candidates = np.unique(index.ids[indices])
+                vectors = dict(self.db.get_feature_vectors_by_ids(candidates))
+                
+                for query, row_indices in zip(block, indices):
+                    row_ids = [song_id for song_id in index.ids[row_indices] if song_id in vectors]
+                    if not row_ids:
+                        all_results.append([])
+                        continue
+                    exact = _score_block(query[None, :], np.vstack([vectors[i] for i in row_ids]),
+                                         method)[0]
+                    row_ids = np.array(row_ids)
+                    order = np.lexsort((row_ids, -exact if largest else exact))[:top_k]
+                    all_results.append(
+                        self._build_results(row_ids[order], exact[order], score_type, song_cache)
+                    )
+        
+        return all_results
     
     def classify_by_threshold(self, features, ste_threshold=0.01, zcr_threshold=0.1):
 
@@ -179,46 +669,289 @@ class SearchEngine:
             'zcr_value': zcr_mean
         }
     
-    def find_duplicates(self, threshold=0.1):
-
-        all_vectors = self.db.get_all_feature_vectors()
+    def reclassify_library(self, ste_threshold=0.01, zcr_threshold=0.1, dry_run=False):
+        """
+        Phân loại lại toàn bộ thư viện với ngưỡng mới từ ste_mean/zcr_mean đã lưu.
+        
+        Không cần đọc lại file âm thanh; chỉ các bài hát đổi nhãn được ghi lại.
+        
+        Args:
+            ste_threshold (float): Ngưỡng STE
+            zcr_threshold (float): Ngưỡng ZCR
+            dry_run (bool): True để chỉ thống kê, không ghi vào database
+        
+        Returns:
+            dict: {'total', 'changed', 'by_classification'}
+        
+        Raises:
+            RuntimeError: Nếu ghi nhãn mới vào database thất bại (không nhãn nào được đổi)
+        """
+        ids, ste_means, zcr_means, old_labels = self.db.get_classification_inputs()
+        new_labels = classify_audio_batch(ste_means, zcr_means, ste_threshold, zcr_threshold)
+        
+        changed = np.flatnonzero(new_labels != old_labels)
+        if len(changed) and not dry_run:
+            if self.db.update_classifications(zip(ids[changed], new_labels[changed])) is None:
+                raise RuntimeError("Khong ghi duoc phan loai moi vao database")
+        
+        labels, counts = np.unique(new_labels.astype(str), return_counts=True)
+        return {
+            'total': len(ids),
+            'changed': len(changed),
+            'by_classification': dict(zip(labels.tolist(), counts.tolist()))
+        }
+    
+    def calibrate_thresholds(self, labels=None, bins=256, apply=False):
+        """
+        Hiệu chỉnh ngưỡng STE/ZCR từ ste_mean/zcr_mean đã lưu của thư viện.
+        
+        Args:
+            labels (dict): {song_id: nhãn đúng} cho các bài đã gán nhãn (None: không giám sát)
+            bins (int): Số ô histogram trên mỗi trục
+            apply (bool): True để phân loại lại thư viện với ngưỡng tìm được
+        
+        Returns:
+            dict: Kết quả calibrate_thresholds, thêm 'reclassified' nếu apply=True
+        """
+        ids, ste_means, zcr_means, _ = self.db.get_classification_inputs()
+        
+        song_labels = None
+        if labels:
+            song_labels = [labels.get(int(song_id)) for song_id in ids]
+        
+        result = calibrate_thresholds(ste_means, zcr_means, song_labels, bins)
+        
+        if apply:
+            result['reclassified'] = self.reclassify_library(
+                result['ste_threshold'], result['zcr_threshold']
+            )
+        return result
+    
+    def find_duplicates(self, threshold=0.1, block_size=2048):
+        """
+        Tìm các cặp bài hát có khoảng cách Euclidean nhỏ hơn threshold.
+        
+        Chỉ so sánh các bài cùng phiên bản đặc trưng. Khoảng cách được tính theo
+        từng cặp khối (block_size x block_size) của nửa trên ma trận khoảng cách.
+        """
+        versions = {version or DEFAULT_FEATURE_VERSION for version in self.db.get_feature_versions()}
+        song_cache = {}
         duplicates = []
         
-        for i in range(len(all_vectors)):
-            for j in range(i + 1, len(all_vectors)):
-                id1, vector1 = all_vectors[i]
-                id2, vector2 = all_vectors[j]
+        for feature_version in sorted(versions):
+            ids, matrix = self._load_library_matrix(feature_version)
+            if matrix is None:
+                continue
+            
+            for start in range(0, len(ids), block_size):
+                rows_block = matrix[start:start + block_size]
+                pair_rows, pair_cols, pair_distances = [], [], []
+                
+                for col_start in range(start, len(ids), block_size):
+                    distances = _score_block(rows_block, matrix[col_start:col_start + block_size], 'euclidean')
+                    rows, cols = np.nonzero(distances < threshold)
+                    rows, cols = rows + start, cols + col_start
+                    keep = cols > rows
+                    pair_rows.append(rows[keep])
+                    pair_cols.append(cols[keep])
+                    pair_distances.append(distances[rows[keep] - start, cols[keep] - col_start])
                 
-                distance = self.euclidean_distance(vector1, vector2)
+                rows = np.concatenate(pair_rows)
+                cols = np.concatenate(pair_cols)
+                distances = np.concatenate(pair_distances)
                 
-                if distance < threshold:
-                    song1 = self.db.get_song_by_id(id1)
-                    song2 = self.db.get_song_by_id(id2)
+                for k in np.lexsort((cols, rows)):
+                    for index in (rows[k], cols[k]):
+                        song_id = int(ids[index])
+                        if song_id not in song_cache:
+                            song_cache[song_id] = self.db.get_song_by_id(song_id, include_series=False)
                     duplicates.append({
-                        'song1': song1,
-                        'song2': song2,
-                        'distance': distance
+                        'song1': song_cache[int(ids[rows[k]])],
+                        'song2': song_cache[int(ids[cols[k]])],
+                        'distance': float(distances[k])
                     })
         
         return duplicates
     
-    def get_recommendations(self, song_id, top_k=5):
+    def refresh_neighbors(self, k=NEIGHBOR_K, block_size=4096):
+        """
+        Cập nhật bảng láng giềng cho các bài hát trong hàng đợi neighbor_pending.
+        
+        Ngoài các bài trong hàng đợi, bài nào đã có danh sách mà một bài mới/đổi
+        đặc trưng gần hơn láng giềng xa nhất của nó cũng được tính lại. Chỉ so
+        sánh các bài cùng phiên bản đặc trưng.
+        
+        Returns:
+            int: Số bài hát được cập nhật danh sách láng giềng
+        """
+        pending = self.db.get_pending_neighbor_songs()
+        if not pending:
+            return 0
+        
+        by_version = {}
+        for song_id, feature_version in pending:
+            by_version.setdefault(feature_version or DEFAULT_FEATURE_VERSION, []).append(song_id)
+        
+        stored = self.db.get_neighbor_kth_distances()
+        neighbor_lists = {}
+        
+        for feature_version, song_ids in by_version.items():
+            ids, matrix = self._load_library_matrix(feature_version)
+            if matrix is None:
+                continue
+            
+            position = {int(song_id): i for i, song_id in enumerate(ids)}
+            rows = sorted(position[song_id] for song_id in song_ids if song_id in position)
+            
+            # Khoảng cách xa nhất đang lưu; bài chưa có danh sách (-inf) sẽ được tính khi cần
+            kth = np.full(len(ids), -np.inf)
+            for i, song_id in enumerate(ids.tolist()):
+                if song_id in stored:
+                    count, max_distance = stored[song_id]
+                    kth[i] = max_distance if count >= min(k, len(ids) - 1) else np.inf
+            
+            targets = np.zeros(len(ids), dtype=bool)
+            targets[rows] = True
+            # Lọc các bài có bài mới lọt vào danh sách; bỏ qua khi mọi bài đều phải tính lại
+            # (vd. rebuild_neighbors). Các dòng thay đổi cũng được chia khối để bộ nhớ tạm
+            # chỉ là 1024 x block_size
+            if len(rows) < len(ids):
+                for start in range(0, len(ids), block_size):
+                    block = matrix[start:start + block_size]
+                    nearest = np.full(len(block), np.inf)
+                    for row_start in range(0, len(rows), 1024):
+                        scores = _score_block(matrix[rows[row_start:row_start + 1024]], block, 'euclidean')
+                        np.minimum(nearest, scores.min(axis=0), out=nearest)
+                    targets[start:start + block_size] |= nearest < kth[start:start + block_size]
+            
+            target_rows = np.flatnonzero(targets)
+            for start in range(0, len(target_rows), 1024):
+                chunk = target_rows[start:start + 1024]
+                scores, indices = _blocked_topk(
+                    matrix[chunk], matrix, min(k + 1, len(ids)), 'euclidean', block_size
+                )
+                for row, row_scores, row_indices in zip(chunk, scores, indices):
+                    neighbor_lists[int(ids[row])] = [
+                        (int(ids[index]), float(score))
+                        for score, index in zip(row_scores, row_indices) if index != row
+                    ][:k]
+        
+        self.db.save_neighbors(neighbor_lists, [song_id for song_id, _ in pending])
+        return len(neighbor_lists)
+    
+    def rebuild_neighbors(self, k=NEIGHBOR_K):
+        """Tính lại bảng láng giềng cho toàn bộ thư viện."""
+        self.db.mark_neighbors_pending()
+        return self.refresh_neighbors(k)
+    
+    def schedule_neighbor_refresh(self):
+        """
+        Yêu cầu cập nhật bảng láng giềng trong luồng nền (không chờ kết quả).
+        
+        Kết nối SQLite chỉ dùng được trong luồng tạo ra nó, nên luồng nền mở
+        database riêng; database ':memory:' không dùng chung được nên chạy ngay.
+        """
+        if self.db.db_path == ':memory:':
+            self.refresh_neighbors()
+            return
+        
+        if self._neighbor_thread is None:
+            self._neighbor_stop = False
+            self._neighbor_thread = threading.Thread(target=self._neighbor_worker, daemon=True)
+            self._neighbor_thread.start()
+        self._neighbor_event.set()
+    
+    def _neighbor_worker(self):
+        db = DatabaseManager(self.db.db_path, async_history=False)
+        engine = SearchEngine(db, cache_size=0, feature_store=self.feature_store)
+        try:
+            while True:
+                self._neighbor_event.wait()
+                self._neighbor_event.clear()
+                if self._neighbor_stop:
+                    break
+                try:
+                    engine.refresh_neighbors()
+                except Exception as e:
+                    # Thử lại ở lần yêu cầu sau (vd. database đang bị khóa ghi)
+                    print(f"Lỗi cập nhật láng giềng: {e}")
+        finally:
+            db.close()
+    
+    def _get_popularity(self):
+        """Số lần xuất hiện của từng bài trong lịch sử tìm kiếm (đọc lại khi lịch sử đổi)."""
+        marker = self.db.get_history_marker()
+        if marker != self._popularity_marker:
+            self._popularity = self.db.get_history_counts()
+            self._popularity_marker = marker
+        return self._popularity
+    
+    def get_recommendations(self, song_id, top_k=5, popularity_weight=0.0):
+        """
+        Gợi ý các bài hát gần nhất với một bài trong thư viện.
+        
+        Đọc từ bảng láng giềng tính sẵn. Các thay đổi đang chờ được cập nhật trong
+        luồng nền, nên ngay sau khi thư viện đổi có thể đọc danh sách cũ. Với
+        popularity_weight > 0, các láng giềng được xếp lại theo
+        khoảng cách / (1 + popularity_weight * log(1 + số lần xuất hiện trong
+        lịch sử tìm kiếm)).
+        """
+        if top_k > NEIGHBOR_K:
+            return self._search_recommendations(song_id, top_k)
+        
+        if self.db.has_pending_neighbors():
+            self.schedule_neighbor_refresh()
+        neighbors = self.db.get_neighbors(song_id)
+        if not neighbors and not self.db.has_neighbor_list(song_id):
+            # Bài hát chưa có danh sách (mới thêm hoặc database cũ): tìm trực tiếp cho
+            # riêng bài này, danh sách được lưu khi luồng nền cập nhật xong
+            if self.db.get_song_by_id(song_id, include_series=False) is None:
+                return []
+            self.db.mark_neighbors_pending([song_id])
+            self.schedule_neighbor_refresh()
+            neighbors = self.db.get_neighbors(song_id) or [
+                (result['id'], result['score'])
+                for result in self._search_recommendations(song_id, NEIGHBOR_K)
+            ]
+        
+        if popularity_weight > 0:
+            popularity = self._get_popularity()
+            neighbors = sorted(
+                neighbors,
+                key=lambda item: item[1] / (1 + popularity_weight * np.log1p(popularity.get(item[0], 0)))
+            )
+        
+        recommendations = []
+        for neighbor_id, distance in neighbors[:top_k]:
+            song_info = self.db.get_song_by_id(neighbor_id, include_series=False)
+            if song_info:
+                song_info['score'] = distance
+                song_info['score_type'] = 'distance'
+                song_info['rank'] = len(recommendations) + 1
+                if popularity_weight > 0:
+                    song_info['popularity'] = popularity.get(neighbor_id, 0)
+                recommendations.append(song_info)
+        
+        return recommendations
+    
+    def _search_recommendations(self, song_id, top_k):
 
-        song = self.db.get_song_by_id(song_id)
+        song = self.db.get_song_by_id(song_id, include_series=False)
         if not song:
             return []
         
         query_vector = song['feature_vector']
+        feature_version = song['feature_version'] or DEFAULT_FEATURE_VERSION
         
         # Tìm kiếm và loại bỏ chính nó
-        results = self.search_similar(query_vector, top_k + 1, method='euclidean')
+        results = self.search_similar(query_vector, top_k + 1, method='euclidean',
+                                      feature_version=feature_version)
         
         # Lọc bỏ bài hát gốc
         recommendations = [r for r in results if r['id'] != song_id][:top_k]
         
         return recommendations
 
-
 # Test module
 if __name__ == "__main__":
     print("=== Module Search Engine ===")
@@ -236,8 +969,14 @@ if __name__ == "__main__":
     print(f"Manhattan Distance: {engine.manhattan_distance(v1, v2):.4f}")
     
     print("\nCác hàm tìm kiếm có sẵn:")
-    print("- search_similar(query_vector, top_k, method)")
+    print("- search_similar(query_vector, top_k, method, feature_version)")
     print("- search_by_audio_file(processed_data, top_k, method)")
+    print("- search_similar_batch(query_matrix, top_k, method, feature_version=...)")
+    print("- build_quantized_index(feature_version, codec) / search_quantized(query_matrix, top_k, method, feature_version, rerank_k)")
     print("- classify_by_threshold(features, ste_threshold, zcr_threshold)")
+    print("- reclassify_library(ste_threshold, zcr_threshold)")
+    print("- calibrate_thresholds(labels, bins, apply)")
+    print("- cache_stats()")
     print("- find_duplicates(threshold)")
-    print("- get_recommendations(song_id, top_k)")
+    print("- get_recommendations(song_id, top_k, popularity_weight)")
+    print("- refresh_neighbors() / rebuild_neighbors() / schedule_neighbor_refresh()")
@@ -0,0 +1,367 @@
+"""
+Module 8: Dich vu tim kiem (Local HTTP Search Service)
+Tien trinh chay lau dai giu san ma tran dac trung cua thu vien trong bo nho va phuc vu
+tim kiem qua HTTP/JSON (asyncio, chi dung thu vien chuan).
+
+Cac endpoint:
+    GET  /health
+    GET  /stats                                 - do tre theo tung endpoint
+    POST /search           {"vector": [...], "top_k": 5, "method": "euclidean", "feature_version": "..."}
+                                                - feature_version mac dinh la DEFAULT_FEATURE_VERSION;
+                                                  chi so sanh voi ban ghi cung phien ban
+    GET  /recommendations?song_id=1&top_k=5&popularity_weight=0
+    POST /upload?filename=a.mp3&top_k=5&method=euclidean   (than request la noi dung file)
+    POST /reload                                - doc lai thu vien tu database
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from audio_processing import process_audio_file, DEFAULT_FEATURE_VERSION
+from database_manager import DatabaseManager
+from search_engine import SearchEngine, _blocked_topk
+
+
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Các cột trả về cho client (không gửi chuỗi STE/ZCR)
+RESULT_COLUMNS = ('id', 'title', 'artist', 'file_path', 'classification', 'duration', 'feature_version')
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _decode_upload(file_path):
+    """Giải mã và trích đặc trưng một file tải lên (chạy trong tiến trình con)."""
+    result = process_audio_file(file_path, keep_audio=False)
+    return result['feature_vector'], result['feature_version'], result['classification']
+
+
+class WarmIndex:
+    """
+    Ma trận đặc trưng của thư viện nằm sẵn trong bộ nhớ, theo từng phiên bản đặc trưng.
+    
+    Được đọc lại khi bộ đếm thế hệ của database thay đổi (thêm/sửa/xóa bài hát).
+    """
+    
+    def __init__(self, db, feature_store=None):
+        self.db = db
+        self.engine = SearchEngine(db, cache_size=0, feature_store=feature_store)
+        self.generation = None
+        self._matrices = {}
+        self._songs = {}
+    
+    def refresh(self, force=False):
+        """Đọc lại thư viện nếu database đã thay đổi; trả về True nếu có đọc lại."""
+        generation = self.db.get_library_generation()
+        if not force and generation == self.generation:
+            return False
+        
+        self._matrices = {}
+        self._songs = {}
+        self.generation = generation
+        return True
+    
+    def matrix(self, feature_version):
+        if feature_version not in self._matrices:
+            self._matrices[feature_version] = self.engine._load_library_matrix(feature_version)
+        return self._matrices[feature_version]
+    
+    def song(self, song_id):
+        if song_id not in self._songs:
+            song = self.db.get_song_by_id(song_id, include_series=False)
+            self._songs[song_id] = None if song is None else {
+                name: song[name] for name in RESULT_COLUMNS
+            }
+        return self._songs[song_id]
+    
+    def size(self):
+        return {str(version): 0 if matrix is None else len(ids)
+                for version, (ids, matrix) in list(self._matrices.items())}
+
+
+class SearchService:
+    """Máy chủ HTTP asyncio phục vụ tìm kiếm trên WarmIndex."""
+    
+    def __init__(self, db_path="audio_database.db", workers=None, latency_window=1000,
+                 feature_store=False):
+        # Mọi thao tác database (đọc lại ma trận, đọc bài hát, gợi ý) chạy trong một luồng
+        # riêng để không chặn vòng lặp sự kiện; kết nối SQLite chỉ dùng được trong luồng
+        # đã tạo ra nó nên database và WarmIndex được tạo ngay trong luồng đó
+        self.db_pool = ThreadPoolExecutor(max_workers=1)
+        self.db, self.index = self.db_pool.submit(
+            self._open_index, db_path, True if feature_store else None
+        ).result()
+        # Giải mã file tải lên trong tiến trình riêng, tính khoảng cách trong luồng (BLAS nhả GIL)
+        self.decode_pool = ProcessPoolExecutor(max_workers=workers)
+        self.search_pool = ThreadPoolExecutor(max_workers=4)
+        self.latency_window = latency_window
+        self.latencies = {}
+        self.started_at = time.time()
+        self.routes = {
+            ('GET', '/health'): self.handle_health,
+            ('GET', '/stats'): self.handle_stats,
+            ('POST', '/search'): self.handle_search,
+            ('GET', '/recommendations'): self.handle_recommendations,
+            ('POST', '/upload'): self.handle_upload,
+            ('POST', '/reload'): self.handle_reload
+        }
+    
+    @staticmethod
+    def _open_index(db_path, feature_store):
+        db = DatabaseManager(db_path)
+        return db, WarmIndex(db, feature_store=feature_store)
+    
+    async def _run_db(self, func, *args):
+        """Chạy func trong luồng database."""
+        return await asyncio.get_running_loop().run_in_executor(self.db_pool, func, *args)
+    
+    def _load_matrix(self, feature_version):
+        self.index.refresh()
+        return self.index.matrix(feature_version)
+    
+    def _load_songs(self, song_ids):
+        return [self.index.song(song_id) for song_id in song_ids]
+    
+    async def _search(self, vector, top_k, method, feature_version):
+        if method not in ('euclidean', 'cosine', 'manhattan'):
+            raise HTTPError(400, f"Phuong phap khong ho tro: {method}")
+        
+        ids, matrix = await self._run_db(self._load_matrix, feature_version)
+        if matrix is None or top_k <= 0:
+            return []
+        
+        try:
+            query = np.asarray(vector, dtype=np.float64).reshape(1, -1)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "Vector truy van khong hop le")
+        if query.shape[1] != matrix.shape[1]:
+            raise HTTPError(400, "Kich thuoc vector truy van khong khop voi thu vien")
+        
+        loop = asyncio.get_running_loop()
+        scores, indices = await loop.run_in_executor(
+            self.search_pool, _blocked_topk, query, matrix, top_k, method
+        )
+        
+        score_type = 'similarity' if method == 'cosine' else 'distance'
+        songs = await self._run_db(self._load_songs, [int(ids[index]) for index in indices[0]])
+        results = []
+        for score, song in zip(scores[0], songs):
+            if song:
+                results.append(dict(song, score=float(score), score_type=score_type,
+                                    rank=len(results) + 1))
+        return results
+    
+    async def handle_health(self, query, body):
+        return {'status': 'ok', 'uptime': time.time() - self.started_at}
+    
+    async def handle_stats(self, query, body):
+        endpoints = {}
+        for route, samples in self.latencies.items():
+            values = np.array(samples)
+            endpoints[route] = {
+                'count': len(values),
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(np.percentile(values, 50)),
+                'p95_ms': float(np.percentile(values, 95)),
+                'max_ms': float(values.max())
+            }
+        return {'generation': self.index.generation, 'index': self.index.size(), 'latency': endpoints}
+    
+    async def handle_search(self, query, body):
+        request = _parse_json(body)
+        if 'vector' not in request:
+            raise HTTPError(400, "Thieu truong 'vector'")
+        
+        results = await self._search(
+            request['vector'], _parse_number(request.get('top_k', 5), int, 'top_k'),
+            request.get('method', 'euclidean'),
+            # Chỉ so sánh với vector cùng phiên bản (như CLI và SearchEngine)
+            request.get('feature_version') or DEFAULT_FEATURE_VERSION
+        )
+        return {'results': results}
+    
+    async def handle_recommendations(self, query, body):
+        try:
+            song_id = int(query['song_id'])
+            top_k = int(query.get('top_k', 5))
+            popularity_weight = float(query.get('popularity_weight', 0))
+        except (KeyError, ValueError):
+            raise HTTPError(400, "Thieu hoac sai tham so song_id/top_k/popularity_weight")
+        
+        recommendations = await self._run_db(
+            self.index.engine.get_recommendations, song_id, top_k, popularity_weight
+        )
+        return {'results': [
+            dict({name: song[name] for name in RESULT_COLUMNS},
+                 score=float(song['score']), score_type=song['score_type'], rank=song['rank'])
+            for song in recommendations
+        ]}
+    
+    async def handle_upload(self, query, body):
+        if not body:
+            raise HTTPError(400, "Than request rong")
+        
+        suffix = os.path.splitext(query.get('filename', 'upload.wav'))[1].lower() or '.wav'
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(body)
+            
+            loop = asyncio.get_running_loop()
+            try:
+                vector, feature_version, classification = await loop.run_in_executor(
+                    self.decode_pool, _decode_upload, temp_path
+                )
+            except Exception as e:
+                raise HTTPError(400, f"Khong giai ma duoc file: {e}")
+        finally:
+            os.remove(temp_path)
+        
+        results = await self._search(
+            vector, _parse_number(query.get('top_k', 5), int, 'top_k'),
+            query.get('method', 'euclidean'), feature_version
+        )
+        return {'classification': classification, 'feature_version': feature_version, 'results': results}
+    
+    async def handle_reload(self, query, body):
+        await self._run_db(self._reload)
+        return {'generation': self.index.generation, 'index': self.index.size()}
+    
+    async def handle_connection(self, reader, writer):
+        start = time.perf_counter()
+        route_name = None
+        
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            parts = request_line.split(' ')
+            if len(parts) != 3:
+                raise HTTPError(400, "Dong request khong hop le")
+            method, target, _ = parts
+            
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            
+            url = urlsplit(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            route_name = url.path
+            handler = self.routes.get((method, url.path))
+            
+            length = _parse_number(headers.get('content-length', 0), int, 'Content-Length')
+            if length < 0:
+                raise HTTPError(400, "Sai tham so Content-Length")
+            limit = MAX_UPLOAD_BYTES if url.path == '/upload' else MAX_BODY_BYTES
+            if length > limit:
+                raise HTTPError(413, "Du lieu qua lon")
+            body = await reader.readexactly(length) if length else b''
+            
+            if handler is None:
+                if any(path == url.path for _, path in self.routes):
+                    raise HTTPError(405, f"Khong ho tro {method} {url.path}")
+                raise HTTPError(404, f"Khong tim thay {url.path}")
+            
+            status, payload = 200, await handler(query, body)
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+        
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if route_name in {path for _, path in self.routes}:
+            self.latencies.setdefault(route_name, deque(maxlen=self.latency_window)).append(elapsed_ms)
+        
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"X-Response-Time-Ms: {elapsed_ms:.3f}\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    def _reload(self):
+        self.index.refresh(force=True)
+        self.index.matrix(DEFAULT_FEATURE_VERSION)
+    
+    async def serve(self, host='127.0.0.1', port=8765):
+        # Nạp sẵn ma trận của phiên bản mặc định trước khi nhận request
+        await self._run_db(self._reload)
+        
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Dich vu tim kiem dang chay tai http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+    
+    def close(self):
+        self.decode_pool.shutdown(cancel_futures=True)
+        self.search_pool.shutdown()
+        self.index.engine.close()
+        self.db_pool.submit(self.db.close).result()
+        self.db_pool.shutdown()
+
+
+def _parse_number(value, cast, name):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Sai tham so {name}")
+
+
+def _parse_json(body):
+    try:
+        request = json.loads(body.decode('utf-8')) if body else {}
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise HTTPError(400, f"JSON khong hop le: {e}")
+    if not isinstance(request, dict):
+        raise HTTPError(400, "Than request phai la mot JSON object")
+    return request
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dich vu tim kiem am thanh qua HTTP")
+    parser.add_argument('--db', default='audio_database.db', help="Duong dan database")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="So tien trinh giai ma file tai len")
+    parser.add_argument('--feature-store', action='store_true',
+                        help="Anh xa vector tu kho file canh database thay vi doc SQLite")
+    args = parser.parse_args(argv)
+    
+    service = SearchService(args.db, args.workers, feature_store=args.feature_store)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
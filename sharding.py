@@ -0,0 +1,395 @@
+"""
+Module 12: Thu vien phan manh (Sharded Library)
+Chia thu vien thanh nhieu file database (shard) theo bam duong dan hoac theo bo suu tap.
+Nap va tim kiem chay song song tren tung shard trong cac tien trinh rieng, ket qua
+top-k cua cac shard duoc gop bang heap.
+
+Vi du:
+    python sharding.py --dir library/ --shards 8 ingest music/ --recursive
+    python sharding.py --dir library/ search query.wav --top-k 10
+    python sharding.py --dir library/ stats
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_processing import process_audio_file, DEFAULT_FEATURE_VERSION
+from database_manager import DatabaseManager
+from search_engine import SearchEngine, _blocked_topk
+
+
+MANIFEST_NAME = 'shards.json'
+PARTITION_MODES = ('hash', 'collection')
+
+# Các cột trả về trong kết quả tìm kiếm (không gửi chuỗi STE/ZCR giữa các tiến trình)
+RESULT_COLUMNS = ('id', 'title', 'artist', 'file_path', 'classification', 'duration', 'feature_version')
+
+
+# Trạng thái trong tiến trình con: kết nối và ma trận đặc trưng của các shard
+# mà tiến trình này phụ trách, giữ lại giữa các lần tìm kiếm
+_worker_dbs = {}
+_worker_matrices = {}
+
+
+def _worker_db(shard_path):
+    if shard_path not in _worker_dbs:
+        _worker_dbs[shard_path] = DatabaseManager(shard_path, async_history=False)
+    return _worker_dbs[shard_path]
+
+
+def _decode_file(file_path, options):
+    """Giải mã và trích đặc trưng một file (chạy trong tiến trình giải mã bất kỳ)."""
+    try:
+        return process_audio_file(file_path, keep_audio=False, **options), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _write_shard(shard_path, items):
+    """
+    Ghi các kết quả đã trích đặc trưng vào một shard (chạy trong tiến trình của shard).
+    
+    Returns:
+        list: [(file_path, song_id, lỗi)]
+    """
+    db = _worker_db(shard_path)
+    rows = []
+    for file_path, title, artist, result in items:
+        song_id = db.add_song(file_path, result, title=title, artist=artist)
+        rows.append((file_path, song_id, None if song_id is not None else "Khong ghi duoc vao database"))
+    return rows
+
+
+def _search_shard(shard_path, queries, top_k, method, feature_version):
+    """
+    Top-k của một shard cho mỗi truy vấn (chạy trong tiến trình con).
+    
+    Ma trận đặc trưng được giữ trong tiến trình và chỉ đọc lại khi bộ đếm thế hệ
+    của shard thay đổi.
+    
+    Returns:
+        list: Q danh sách [(score, thông tin bài hát)] đã sắp từ tốt nhất đến kém nhất
+    """
+    db = _worker_db(shard_path)
+    generation = db.get_library_generation()
+    key = (shard_path, feature_version)
+    
+    cached = _worker_matrices.get(key)
+    if cached is None or cached[0] != generation:
+        ids, matrix = SearchEngine(db, cache_size=0)._load_library_matrix(feature_version)
+        cached = _worker_matrices[key] = (generation, ids, matrix)
+    _, ids, matrix = cached
+    
+    if matrix is None:
+        return [[] for _ in range(len(queries))]
+    if queries.shape[1] != matrix.shape[1]:
+        raise ValueError("Kích thước vector truy vấn không khớp với thư viện")
+    
+    scores, indices = _blocked_topk(queries, matrix, top_k, method)
+    
+    songs = {}
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        row = []
+        for score, index in zip(row_scores, row_indices):
+            song_id = int(ids[index])
+            if song_id not in songs:
+                song = db.get_song_by_id(song_id, include_series=False)
+                songs[song_id] = None if song is None else {name: song[name] for name in RESULT_COLUMNS}
+            if songs[song_id] is not None:
+                row.append((float(score), songs[song_id]))
+        results.append(row)
+    return results
+
+
+def _shard_stats(shard_path):
+    db = _worker_db(shard_path)
+    stats = db.get_statistics()
+    stats['feature_versions'] = db.get_feature_versions()
+    return stats
+
+
+class ShardedLibrary:
+    """
+    Thư viện gồm nhiều file SQLite trong cùng một thư mục.
+    
+    - partition='hash': bài hát nằm ở shard crc32(đường dẫn) % num_shards
+    - partition='collection': mỗi bộ sưu tập là một shard riêng (<tên>.db)
+    
+    Số shard và cách chia được ghi vào shards.json khi tạo thư viện để lần mở sau
+    chia giống hệt. Mỗi shard luôn được giao cho cùng một tiến trình (shard thứ i
+    cho tiến trình i % workers), nên ma trận đặc trưng của nó chỉ nằm trong bộ nhớ
+    của một tiến trình và được giữ lại giữa các lần tìm kiếm. Khi nạp, file được
+    giải mã trong một nhóm tiến trình chung (dùng hết workers lõi dù chỉ ghi vào
+    một shard); chỉ bước ghi database chạy trên tiến trình của shard. id bài hát
+    là id trong shard; kết quả có thêm khóa 'shard'.
+    """
+    
+    def __init__(self, directory, num_shards=4, partition='hash', workers=None):
+        if partition not in PARTITION_MODES:
+            raise ValueError(f"Cach chia shard khong ho tro: {partition}")
+        
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        else:
+            manifest = {'partition': partition, 'num_shards': num_shards}
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+        
+        self.partition = manifest['partition']
+        self.num_shards = manifest['num_shards']
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._executors = {}
+        self._decode_pool = None
+    
+    def shard_names(self):
+        """Tên các shard hiện có (với 'hash': luôn đủ num_shards shard)."""
+        if self.partition == 'hash':
+            return [f'shard_{index:03d}' for index in range(self.num_shards)]
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(self.directory)
+                      if name.endswith('.db'))
+    
+    def shard_path(self, name):
+        return os.path.join(self.directory, f'{name}.db')
+    
+    def shard_for(self, file_path, collection=None):
+        """Tên shard chứa file_path."""
+        if self.partition == 'collection':
+            if not collection:
+                raise ValueError("Can chi ro bo suu tap khi chia shard theo collection")
+            if os.sep in collection or collection.startswith('.'):
+                raise ValueError(f"Ten bo suu tap khong hop le: {collection}")
+            return collection
+        
+        # crc32 thay cho hash() vì hash() của str đổi giữa các lần chạy Python
+        index = zlib.crc32(os.path.abspath(file_path).encode('utf-8')) % self.num_shards
+        return f'shard_{index:03d}'
+    
+    def _executor(self, name):
+        """Tiến trình phụ trách shard name (mỗi executor chỉ có một tiến trình)."""
+        if self.partition == 'hash':
+            slot = int(name.rsplit('_', 1)[1]) % self.workers
+        else:
+            slot = zlib.crc32(name.encode('utf-8')) % self.workers
+        if slot not in self._executors:
+            self._executors[slot] = ProcessPoolExecutor(max_workers=1)
+        return self._executors[slot]
+    
+    def _fan_out(self, func, args_by_shard):
+        """Gọi func(shard_path, *args) trên tiến trình của từng shard; trả về {tên shard: kết quả}."""
+        futures = {
+            name: self._executor(name).submit(func, self.shard_path(name), *args)
+            for name, args in args_by_shard.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+    
+    def ingest(self, file_paths, collection=None, titles=None, write_batch=32, **options):
+        """
+        Phân tích và thêm nhiều file: giải mã song song trên mọi tiến trình, mỗi shard
+        ghi theo lô (write_batch file) trong tiến trình riêng của nó.
+        
+        Args:
+            file_paths (list): Các file âm thanh
+            collection (str): Bộ sưu tập (bắt buộc với partition='collection')
+            titles (dict): {file_path: (title, artist)} (tùy chọn)
+            **options: Tham số trích đặc trưng của process_audio_file
+        
+        Returns:
+            list: Các dòng {'file_path', 'shard', 'song_id', 'classification', 'status', 'error'}
+        """
+        titles = titles or {}
+        shards = [self.shard_for(file_path, collection) for file_path in file_paths]
+        
+        if self._decode_pool is None:
+            self._decode_pool = ProcessPoolExecutor(max_workers=self.workers)
+        decoded = self._decode_pool.map(_decode_file, file_paths, [options] * len(file_paths))
+        
+        rows = []
+        batches = {}
+        writes = []
+        
+        def flush(name):
+            writes.append(self._executor(name).submit(_write_shard, self.shard_path(name), batches.pop(name)))
+        
+        # Lô ghi được gửi ngay khi đủ, để việc ghi chồng lên việc giải mã các file sau
+        for file_path, name, (result, error) in zip(file_paths, shards, decoded):
+            rows.append({
+                'file_path': file_path,
+                'shard': name,
+                'song_id': None,
+                'classification': result['classification'] if result else None,
+                'status': 'ok' if error is None else 'error',
+                'error': error
+            })
+            if result is None:
+                continue
+            title, artist = titles.get(file_path, (None, None))
+            batches.setdefault(name, []).append((file_path, title, artist, result))
+            if len(batches[name]) >= write_batch:
+                flush(name)
+        for name in list(batches):
+            flush(name)
+        
+        written = {}
+        for future in writes:
+            for file_path, song_id, error in future.result():
+                written[file_path] = (song_id, error)
+        for row in rows:
+            if row['file_path'] in written:
+                row['song_id'], error = written[row['file_path']]
+                if error is not None:
+                    row['status'], row['error'] = 'error', error
+        return rows
+    
+    def search_similar_batch(self, query_matrix, top_k=5, method='euclidean',
+                             feature_version=DEFAULT_FEATURE_VERSION):
+        """
+        Tìm kiếm trên mọi shard song song rồi gộp top-k của các shard bằng heap.
+        
+        Returns:
+            list: Q danh sách kết quả, cùng định dạng với SearchEngine.search_similar_batch
+        """
+        if method not in ('euclidean', 'cosine', 'manhattan'):
+            raise ValueError(f"Phương pháp không hỗ trợ: {method}")
+        
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float64))
+        names = [name for name in self.shard_names() if os.path.exists(self.shard_path(name))]
+        if not names or top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+        
+        results = self._fan_out(
+            _search_shard, {name: (queries, top_k, method, feature_version) for name in names}
+        )
+        
+        largest = method == 'cosine'
+        score_type = 'similarity' if largest else 'distance'
+        all_results = []
+        
+        for query_index in range(queries.shape[0]):
+            # Mỗi danh sách đã sắp sẵn: heapq.merge chỉ cần so sánh phần đầu của các shard
+            streams = [
+                [((-score if largest else score), shard_index, song['id'], score, name, song)
+                 for score, song in results[name][query_index]]
+                for shard_index, name in enumerate(names)
+            ]
+            top_results = []
+            for _, _, _, score, name, song in heapq.merge(*streams):
+                top_results.append(dict(song, shard=name, score=score, score_type=score_type,
+                                        rank=len(top_results) + 1))
+                if len(top_results) == top_k:
+                    break
+            all_results.append(top_results)
+        
+        return all_results
+    
+    def search_similar(self, query_vector, top_k=5, method='euclidean',
+                       feature_version=DEFAULT_FEATURE_VERSION):
+        return self.search_similar_batch(query_vector, top_k, method, feature_version)[0]
+    
+    def get_statistics(self):
+        """Thống kê từng shard và tổng."""
+        names = [name for name in self.shard_names() if os.path.exists(self.shard_path(name))]
+        shards = self._fan_out(_shard_stats, {name: () for name in names})
+        return {
+            'total_songs': sum(stats['total_songs'] for stats in shards.values()),
+            'total_duration': sum(stats['total_duration'] for stats in shards.values()),
+            'shards': shards
+        }
+    
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors = {}
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown()
+            self._decode_pool = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _add_output_arguments(parser, defaults=True):
+    # Giống cli.py: trên subcommand dùng SUPPRESS để không ghi đè giá trị đặt trước tên lệnh
+    parser.add_argument('--format', choices=('json', 'csv'),
+                        default='json' if defaults else argparse.SUPPRESS, help="Dinh dang dau ra")
+    parser.add_argument('--output', '-o', default=None if defaults else argparse.SUPPRESS,
+                        help="Ghi ket qua ra file thay vi stdout")
+
+
+def main(argv=None):
+    # Dùng chung cách duyệt file và ghi kết quả với cli.py
+    from cli import _collect_files, write_output
+    
+    parser = argparse.ArgumentParser(description="Thu vien am thanh chia thanh nhieu shard")
+    parser.add_argument('--dir', required=True, help="Thu muc chua cac shard")
+    parser.add_argument('--shards', type=int, default=4, help="So shard khi tao thu vien (partition=hash)")
+    parser.add_argument('--partition', choices=PARTITION_MODES, default='hash')
+    parser.add_argument('--workers', type=int, default=None, help="So tien trinh")
+    _add_output_arguments(parser)
+    
+    common = argparse.ArgumentParser(add_help=False)
+    _add_output_arguments(common, defaults=False)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    ingest = subparsers.add_parser('ingest', parents=[common], help="Phan tich va them file vao thu vien")
+    ingest.add_argument('paths', nargs='+', help="File hoac thu muc")
+    ingest.add_argument('--recursive', '-r', action='store_true', help="Duyet thu muc con")
+    ingest.add_argument('--collection', default=None, help="Bo suu tap (partition=collection)")
+    
+    search = subparsers.add_parser('search', parents=[common], help="Tim bai hat tuong dong voi cac file truy van")
+    search.add_argument('queries', nargs='+', help="File truy van")
+    search.add_argument('--top-k', type=int, default=5, help="So ket qua moi truy van")
+    search.add_argument('--method', choices=('euclidean', 'cosine', 'manhattan'), default='euclidean')
+    
+    subparsers.add_parser('stats', parents=[common], help="Thong ke tung shard")
+    
+    args = parser.parse_args(argv)
+    
+    with ShardedLibrary(args.dir, args.shards, args.partition, args.workers) as library:
+        if args.command == 'ingest':
+            rows = library.ingest(_collect_files(args.paths, args.recursive), args.collection)
+        
+        elif args.command == 'search':
+            rows = []
+            for query in _collect_files(args.queries, recursive=False):
+                processed = process_audio_file(query, keep_audio=False)
+                for match in library.search_similar(processed['feature_vector'], args.top_k, args.method,
+                                                    processed['feature_version']):
+                    rows.append({
+                        'query': query,
+                        'rank': match['rank'],
+                        'shard': match['shard'],
+                        'song_id': match['id'],
+                        'title': match['title'],
+                        'file_path': match['file_path'],
+                        'score': match['score'],
+                        'score_type': match['score_type']
+                    })
+        
+        else:
+            stats = library.get_statistics()
+            rows = [{'shard': name, 'total_songs': item['total_songs'],
+                     'total_duration': item['total_duration']}
+                    for name, item in stats['shards'].items()]
+    
+    write_output(rows, args.format, args.output)
+    return 1 if any(row.get('error') for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())